@@ -1,28 +1,132 @@
 import os
+import json
+import time
+import hashlib
+import threading
+import requests
 import mercadopago
+from mercadopago.config import RequestOptions
+from mercadopago.http import HttpClient
 import database
+import metricas
 
-def gerar_link_pagamento(produto, id_venda, valor_total):
+MP_API_URL_PADRAO = "https://api.mercadopago.com"
+# Pode apontar para um servidor local falso em testes/benchmarks
+MP_API_URL = os.getenv("MP_API_URL", MP_API_URL_PADRAO)
+# Tempo máximo (conexão, leitura) das consultas à API de pagamentos
+MP_TIMEOUT = (3.05, 10)
+
+_sessao = requests.Session()
+
+# O mesmo pedido (cliente + itens + valor) reaproveita o link por este tempo
+IDEMPOTENCIA_VALIDADE = 30 * 60
+# Reserva sem link há mais que isso é considerada abandonada (worker caiu no meio)
+IDEMPOTENCIA_RESERVA = 60
+# Quanto uma requisição repetida espera a original terminar de criar o link
+IDEMPOTENCIA_ESPERA = 10.0
+
+_sdk = {'token': None, 'cliente': None}
+_sdk_lock = threading.Lock()
+
+class ClienteHttpMP(HttpClient):
+    """HttpClient do SDK que troca a URL base fixa dele por MP_API_URL"""
+
+    def request(self, method, url, maxretries=None, **kwargs):
+        if url.startswith(MP_API_URL_PADRAO):
+            url = MP_API_URL + url[len(MP_API_URL_PADRAO):]
+        return super().request(method, url, maxretries=maxretries, **kwargs)
+
+def obter_sdk():
+    """SDK do Mercado Pago reaproveitado; só é recriado quando o token muda"""
+    token_do_banco = database.get_configuracao('mercado_pago_token')
+    ACCESS_TOKEN = token_do_banco if token_do_banco else os.getenv("ACCESS_TOKEN")
+    if not ACCESS_TOKEN:
+        return None
+    with _sdk_lock:
+        if _sdk['token'] != ACCESS_TOKEN:
+            _sdk['cliente'] = mercadopago.SDK(ACCESS_TOKEN, http_client=ClienteHttpMP())
+            _sdk['token'] = ACCESS_TOKEN
+        return _sdk['cliente']
+
+def consultar_status_mp(payment_id):
+    """Consulta o status oficial de um pagamento; retorna (status, external_reference)"""
+    token_do_banco = database.get_configuracao('mercado_pago_token')
+    token = token_do_banco if token_do_banco else os.getenv("ACCESS_TOKEN")
+    if not token: return None, None
+
+    url = f"{MP_API_URL}/v1/payments/{payment_id}"
+    headers = {"Authorization": f"Bearer {token}"}
+
+    try:
+        with metricas.medir_api('mercadopago', 'consultar_pagamento'):
+            response = _sessao.get(url, headers=headers, timeout=MP_TIMEOUT)
+        if response.status_code == 200:
+            dados = response.json()
+            return dados.get('status'), dados.get('external_reference')
+    except Exception as e:
+        print(f"Erro ao consultar pagamento {payment_id}: {e}")
+    return None, None
+
+def chave_idempotencia(email, itens, valor_total):
+    """Impressão digital do pedido: mesmo cliente, mesmos itens e mesmo valor"""
+    dados = {
+        'email': (email or '').strip().lower(),
+        'itens': sorted((str(k), int(v)) for k, v in (itens or {}).items()),
+        'valor': round(float(valor_total), 2),
+    }
+    return hashlib.sha256(json.dumps(dados, sort_keys=True).encode()).hexdigest()
+
+def _aguardar_link(chave):
+    limite = time.monotonic() + IDEMPOTENCIA_ESPERA
+    while time.monotonic() < limite:
+        existente = database.get_preferencia_mp(chave)
+        if not existente:
+            return None
+        if existente['init_point']:
+            return existente['init_point']
+        time.sleep(0.25)
+    return None
+
+def checkout_idempotente(chave, registrar_venda, produto, valor_total):
+    """
+    Devolve o init_point do pedido identificado por chave. Na primeira tentativa
+    registra a venda (registrar_venda() -> id) e cria a preferência; reenvios e
+    cliques duplos recebem o mesmo link sem nova venda nem nova chamada à API.
+    """
+    if not database.reservar_preferencia_mp(chave, IDEMPOTENCIA_VALIDADE, IDEMPOTENCIA_RESERVA):
+        link = _aguardar_link(chave)
+        if link:
+            return link
+        # A tentativa original falhou ou travou; tenta assumir a reserva
+        if not database.reservar_preferencia_mp(chave, IDEMPOTENCIA_VALIDADE, IDEMPOTENCIA_RESERVA):
+            return None
+
+    try:
+        id_venda = registrar_venda()
+        link = gerar_link_pagamento(produto, id_venda, valor_total, chave_idempotencia=chave)
+    except Exception:
+        database.liberar_preferencia_mp(chave)
+        raise
+    if link:
+        database.concluir_preferencia_mp(chave, id_venda, link)
+    else:
+        database.liberar_preferencia_mp(chave)
+    return link
+
+def gerar_link_pagamento(produto, id_venda, valor_total, chave_idempotencia=None):
     """
     Gera o link do Mercado Pago configurado para o domínio PythonAnywhere.
     Busca o token dinamicamente do banco de dados.
     """
     try:
-        # 1. Busca as configurações no banco de dados
-        configs = database.get_configuracoes()
-        token_do_banco = configs.get('mercado_pago_token')
-        
-        # 2. Define o Access Token
-        ACCESS_TOKEN = token_do_banco if token_do_banco else os.getenv("ACCESS_TOKEN")
+        # 1. SDK em cache (token do banco ou do ambiente)
+        sdk = obter_sdk()
 
-        if not ACCESS_TOKEN:
+        if not sdk:
             print("ERRO: Access Token do Mercado Pago não encontrado!")
             return None
 
-        # Inicializa o SDK
-        sdk = mercadopago.SDK(ACCESS_TOKEN)
-
-        # 3. Configura seu domínio real do PythonAnywhere
+        # 2. Configura seu domínio real do PythonAnywhere
         # O Webhook só funciona com links HTTPS reais como o seu
         LINK_EXTERNO = "https://denissousa827.pythonanywhere.com"
 
@@ -50,8 +154,12 @@ def gerar_link_pagamento(produto, id_venda, valor_total):
             }
         }
 
+        # A mesma chave faz o Mercado Pago devolver a preferência já criada
+        opcoes = RequestOptions(custom_headers={"x-idempotency-key": chave_idempotencia}) if chave_idempotencia else None
+
         # Cria a preferência de pagamento no Mercado Pago
-        resultado = sdk.preference().create(preference_data)
+        with metricas.medir_api('mercadopago', 'criar_preferencia'):
+            resultado = sdk.preference().create(preference_data, opcoes)
         
         if "response" in resultado and "init_point" in resultado["response"]:
             # Retorna o link (Checkout Pro) para o cliente pagar
@@ -0,0 +1,156 @@
+import os
+import time
+import random
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as TempoEsgotado
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+import database
+
+# Método de hash das senhas novas; hashes salvos com outro método são refeitos no login
+METODO_HASH = os.getenv("AUTH_METODO_HASH", "scrypt:32768:8:1")
+# Processos que calculam hashes (por worker do gunicorn) e quantas conferências
+# podem estar na fila antes de recusar na hora
+AUTH_PROCESSOS = int(os.getenv("AUTH_PROCESSOS", "2"))
+AUTH_FILA_MAX = int(os.getenv("AUTH_FILA_MAX", "8"))
+AUTH_TIMEOUT = 5.0
+
+# Limites de falhas: (máximo na janela, janela em segundos, bloqueio em segundos)
+LIMITE_IP = (20, 10 * 60, 10 * 60)
+LIMITE_CONTA = (5, 15 * 60, 15 * 60)
+
+class AutenticacaoOcupada(Exception):
+    """Fila de hashes cheia: a requisição é recusada em vez de prender o worker"""
+
+class LoginBloqueado(Exception):
+    def __init__(self, segundos):
+        super().__init__(f"Muitas tentativas; tente de novo em {int(segundos // 60) + 1} min")
+        self.segundos = segundos
+
+_executor = {'pool': None, 'pid': None}
+_executor_lock = threading.Lock()
+_vagas = {'semaforo': threading.BoundedSemaphore(AUTH_FILA_MAX)}
+_hash_ficticio = {'valor': None}
+
+def _gerar(senha, metodo):
+    return generate_password_hash(senha, method=metodo)
+
+def _conferir(senha_hash, senha):
+    return check_password_hash(senha_hash, senha)
+
+def _obter_pool():
+    with _executor_lock:
+        if _executor['pid'] != os.getpid():
+            # Pool herdado do processo pai (fork do gunicorn) não serve no filho
+            _executor['pool'], _executor['pid'] = None, os.getpid()
+            _vagas['semaforo'] = threading.BoundedSemaphore(AUTH_FILA_MAX)
+        if _executor['pool'] is None and AUTH_PROCESSOS > 0:
+            try:
+                # forkserver: o worker tem threads (webhooks, ofertas) e fork com threads é arriscado
+                contexto = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+                _executor['pool'] = ProcessPoolExecutor(max_workers=AUTH_PROCESSOS, mp_context=contexto)
+            except (OSError, NotImplementedError, ValueError) as e:
+                # Ex.: ambiente serverless sem suporte a processos; calcula no próprio worker
+                print(f"Pool de autenticação indisponível: {e}")
+        return _executor['pool']
+
+def _descartar_pool(pool):
+    with _executor_lock:
+        if _executor['pool'] is pool:
+            _executor['pool'] = None
+
+def _executar(func, *args):
+    pool = _obter_pool()
+    semaforo = _vagas['semaforo']
+    if not semaforo.acquire(blocking=False):
+        raise AutenticacaoOcupada()
+    futuro = None
+    if pool is not None:
+        try:
+            futuro = pool.submit(func, *args)
+        except BrokenProcessPool:
+            _descartar_pool(pool)
+        except Exception:
+            semaforo.release()
+            raise
+    if futuro is None:
+        # Sem pool o hash roda no próprio worker, ocupando a vaga até terminar
+        try:
+            return func(*args)
+        finally:
+            semaforo.release()
+    # A vaga só volta quando o processo termina o hash: se a espera abaixo
+    # desiste antes, o trabalho continua no pool e ainda conta na fila
+    futuro.add_done_callback(lambda _: semaforo.release())
+    try:
+        return futuro.result(timeout=AUTH_TIMEOUT)
+    except TempoEsgotado:
+        raise AutenticacaoOcupada()
+    except BrokenProcessPool:
+        _descartar_pool(pool)
+        return func(*args)
+
+def gerar_hash(senha):
+    return _executar(_gerar, senha, METODO_HASH)
+
+def conferir_senha(senha_hash, senha):
+    if not senha_hash or not senha: return False
+    return _executar(_conferir, senha_hash, senha)
+
+def precisa_rehash(senha_hash):
+    return senha_hash.split("$", 1)[0] != METODO_HASH
+
+def _verificar_bloqueio(chaves):
+    segundos = database.get_bloqueio_login(chaves)
+    if segundos > 0:
+        raise LoginBloqueado(segundos)
+
+def _registrar_falha(chave_ip, chave_conta):
+    database.registrar_falha_login(chave_ip, LIMITE_IP[1], LIMITE_IP[0], LIMITE_IP[2])
+    database.registrar_falha_login(chave_conta, LIMITE_CONTA[1], LIMITE_CONTA[0], LIMITE_CONTA[2])
+    # De vez em quando apaga janelas antigas para a tabela não crescer
+    if random.random() < 0.01:
+        database.limpar_tentativas_login(antes_de=time.time() - max(LIMITE_IP[1], LIMITE_CONTA[1]))
+
+def _obter_hash_ficticio():
+    """Hash de uma senha aleatória com METODO_HASH, gerado uma vez por processo"""
+    if _hash_ficticio['valor'] is None:
+        _hash_ficticio['valor'] = gerar_hash(os.urandom(16).hex())
+    return _hash_ficticio['valor']
+
+def _login(chave_conta, ip, registro, campo_hash, salvar_hash, senha):
+    chave_ip = f"ip:{ip or '-'}"
+    # Bloqueio checado antes do hash: tentativa recusada não gasta CPU
+    _verificar_bloqueio([chave_ip, chave_conta])
+    if not registro:
+        # Conta inexistente também paga uma conferência do mesmo custo; senão o
+        # tempo de resposta revelaria quais e-mails/usuários estão cadastrados
+        conferir_senha(_obter_hash_ficticio(), senha)
+    if not registro or not conferir_senha(registro[campo_hash], senha):
+        _registrar_falha(chave_ip, chave_conta)
+        return None
+    database.limpar_tentativas_login([chave_conta])
+    if precisa_rehash(registro[campo_hash]):
+        try:
+            salvar_hash(registro['id'], gerar_hash(senha))
+        except AutenticacaoOcupada:
+            pass
+    return registro
+
+def login_cliente(email, senha, ip):
+    """Cliente se a senha confere; None se não. Levanta LoginBloqueado/AutenticacaoOcupada"""
+    email = (email or '').strip()
+    registro = database.get_cliente_para_login(email)
+    cliente = _login(f"cliente:{email.lower()}", ip, registro, 'senha', database.atualizar_senha_cliente, senha)
+    if cliente:
+        cliente.pop('senha', None)
+    return cliente
+
+def login_admin(usuario, senha, ip):
+    registro = database.get_admin_para_login(usuario)
+    # A chave de bloqueio ignora maiúsculas/espaços: "Admin " conta como "admin"
+    admin = _login(f"admin:{(usuario or '').strip().lower()}", ip, registro, 'password_hash', database.atualizar_hash_admin, senha)
+    if admin:
+        admin.pop('password_hash', None)
+    return admin
@@ -0,0 +1,338 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+import psycopg2
+import psycopg2.pool
+import psycopg2.extras
+import psycopg2.extensions
+
+# Conexões por processo (worker do gunicorn) e quanto tempo esperar por uma livre
+PG_POOL_MIN = int(os.getenv("LOJA_PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("LOJA_PG_POOL_MAX", "10"))
+PG_POOL_ESPERA = 5.0
+# Fuso usado onde o SQLite usa 'localtime' (dia/hora dos relatórios, painel)
+FUSO_HORARIO = os.getenv("LOJA_FUSO_HORARIO") or os.getenv("TZ") or "America/Sao_Paulo"
+# Comandos preparados guardados por conexão antes de descartar todos
+MAX_PREPARADOS = 500
+
+# Tabelas com id gerado pelo banco: o INSERT devolve o id (cursor.lastrowid)
+TABELAS_COM_ID = {'users', 'vendas', 'itens_venda', 'clientes', 'fila_webhooks', 'reservas_estoque'}
+# Chave usada pelo INSERT OR REPLACE de cada tabela
+CHAVES_SUBSTITUICAO = {'configuracoes': 'chave', 'cache_frete': 'chave'}
+# Tabelas que o init_db já preenche (admin padrão, contadores): a cópia substitui
+TABELAS_SEMEADAS = {'users', 'versoes'}
+# Controle de cada banco, nunca copiado (as migrações do Postgres são as dele)
+TABELAS_NAO_COPIADAS = {'migracoes'}
+
+_pool = {'pool': None, 'pid': None, 'dsn': None, 'vagas': None}
+_pool_lock = threading.Lock()
+
+# --- TRADUÇÃO DO SQL (dialeto SQLite usado no database.py) ---
+
+def _trocar_min_max(sql):
+    """MIN(a, b)/MAX(a, b) escalares do SQLite viram LEAST/GREATEST (agregados ficam)"""
+    saida, i = [], 0
+    for achado in re.finditer(r"\b(MIN|MAX)\(", sql, re.IGNORECASE):
+        nivel, virgulas, j = 1, 0, achado.end()
+        while j < len(sql) and nivel:
+            if sql[j] == '(': nivel += 1
+            elif sql[j] == ')': nivel -= 1
+            elif sql[j] == ',' and nivel == 1: virgulas += 1
+            j += 1
+        if virgulas:
+            funcao = 'LEAST' if achado.group(1).upper() == 'MIN' else 'GREATEST'
+            saida.append(sql[i:achado.start()] + funcao + '(')
+            i = achado.end()
+    saida.append(sql[i:])
+    return ''.join(saida)
+
+def _numerar_parametros(sql):
+    """Troca os ? (fora de strings) por $1, $2...; retorna (sql, quantidade)"""
+    partes, n, em_texto = [], 0, False
+    for c in sql:
+        if c == "'":
+            em_texto = not em_texto
+        elif c == '?' and not em_texto:
+            n += 1
+            partes.append(f"${n}")
+            continue
+        partes.append(c)
+    return ''.join(partes), n
+
+@lru_cache(maxsize=2048)
+def traduzir(sql):
+    """
+    Converte um comando do database.py para o Postgres. Retorna
+    (sql_com_$n, n_parametros, sql_com_%s).
+    """
+    texto = sql.strip()
+    comando = " ".join(texto.split()).upper()
+    if comando == "BEGIN IMMEDIATE":
+        # Sem lock global: o que precisa de exclusão pega o seu em database._travar
+        return "BEGIN", 0, "BEGIN"
+    if comando == "BEGIN":
+        # Leitura consistente de várias tabelas (ex.: versão + configurações)
+        return "BEGIN ISOLATION LEVEL REPEATABLE READ", 0, "BEGIN ISOLATION LEVEL REPEATABLE READ"
+
+    substituir = re.match(r"INSERT\s+OR\s+REPLACE\s+INTO\s+(\w+)\s*\(([^)]*)\)", texto, re.IGNORECASE)
+    if substituir:
+        tabela = substituir.group(1)
+        colunas = [c.strip() for c in substituir.group(2).split(',')]
+        chave = CHAVES_SUBSTITUICAO.get(tabela, colunas[0])
+        atualizar = ", ".join(f"{c} = EXCLUDED.{c}" for c in colunas if c != chave)
+        texto = re.sub(r"INSERT\s+OR\s+REPLACE\s+INTO", "INSERT INTO", texto, count=1, flags=re.IGNORECASE)
+        texto += f" ON CONFLICT ({chave}) DO UPDATE SET {atualizar}" if atualizar else f" ON CONFLICT ({chave}) DO NOTHING"
+    elif re.match(r"INSERT\s+OR\s+IGNORE\s+INTO", texto, re.IGNORECASE):
+        texto = re.sub(r"INSERT\s+OR\s+IGNORE\s+INTO", "INSERT INTO", texto, count=1, flags=re.IGNORECASE)
+        texto += " ON CONFLICT DO NOTHING"
+
+    texto = re.sub(r"([\w.]+)\s*=\s*\?\s+COLLATE\s+NOCASE", r"lower(\1) = lower(?)", texto, flags=re.IGNORECASE)
+    texto = _trocar_min_max(texto)
+
+    insercao = re.match(r"INSERT\s+INTO\s+(\w+)", texto, re.IGNORECASE)
+    if insercao and insercao.group(1) in TABELAS_COM_ID and not re.search(r"\bRETURNING\b", texto, re.IGNORECASE):
+        texto += " RETURNING id"
+
+    numerado, n = _numerar_parametros(texto)
+    formatado = re.sub(r"\$\d+", "%s", numerado.replace('%', '%%')) if n else texto
+    return numerado, n, formatado
+
+# --- CONEXÕES ---
+
+class _ConexaoBruta(psycopg2.extensions.connection):
+    """Conexão do psycopg2 que guarda os comandos já preparados nela"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparados = {}
+        self.pool_origem = self.vagas_origem = None
+
+class CursorPostgres:
+    """Cursor com a interface do sqlite3 usada no database.py (?, lastrowid, linhas por nome e índice)"""
+
+    def __init__(self, conexao):
+        self._conexao = conexao
+        self._cur = conexao.bruta.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        self.lastrowid = None
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    def _iniciar_se_preciso(self, sql):
+        # Igual ao módulo sqlite3: INSERT/UPDATE/DELETE fora de transação abrem uma
+        if not self._conexao.in_transaction and re.match(r"\s*(INSERT|UPDATE|DELETE|REPLACE)\b", sql, re.IGNORECASE):
+            self._cur.execute("BEGIN")
+            self._conexao.in_transaction = True
+
+    def execute(self, sql, parametros=()):
+        numerado, n, formatado = traduzir(sql)
+        self.lastrowid = None
+        if numerado.startswith("BEGIN"):
+            self._cur.execute(numerado)
+            self._conexao.in_transaction = True
+            return self
+        self._iniciar_se_preciso(sql)
+        nome = self._conexao.preparar(numerado, n) if n else None
+        if nome:
+            self._cur.execute(f"EXECUTE {nome} ({', '.join(['%s'] * n)})", tuple(parametros))
+        else:
+            self._cur.execute(formatado, tuple(parametros) if n else None)
+        if numerado.endswith(" RETURNING id"):
+            linha = self._cur.fetchone()
+            self.lastrowid = linha[0] if linha else None
+        return self
+
+    def executemany(self, sql, lista_parametros):
+        numerado, n, formatado = traduzir(sql)
+        lista_parametros = [tuple(p) for p in lista_parametros]
+        if not lista_parametros: return self
+        if numerado.endswith(" RETURNING id"):
+            numerado, formatado = numerado[:-len(" RETURNING id")], formatado[:-len(" RETURNING id")]
+        self._iniciar_se_preciso(sql)
+        nome = self._conexao.preparar(numerado, n) if n else None
+        comando = f"EXECUTE {nome} ({', '.join(['%s'] * n)})" if nome else formatado
+        psycopg2.extras.execute_batch(self._cur, comando, lista_parametros, page_size=500)
+        return self
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def fetchmany(self, tamanho):
+        return self._cur.fetchmany(tamanho)
+
+    def close(self):
+        self._cur.close()
+
+class ConexaoPostgres:
+    """Conexão do pool com a interface de sqlite3.Connection; close() devolve ao pool"""
+
+    def __init__(self, bruta):
+        self.bruta = bruta
+        self.in_transaction = False
+
+    def cursor(self):
+        return CursorPostgres(self)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def preparar(self, numerado, n):
+        """
+        Nome do comando preparado (PREPARE) para este SQL nesta conexão, ou None se o
+        Postgres não consegue inferir os tipos dos parâmetros (aí vai sem preparar)
+        """
+        nome = "loja_" + hashlib.sha1(numerado.encode()).hexdigest()[:16]
+        preparados = self.bruta.preparados
+        if nome in preparados:
+            return nome if preparados[nome] else None
+        cur = self.bruta.cursor()
+        if len(preparados) >= MAX_PREPARADOS and not self.in_transaction:
+            cur.execute("DEALLOCATE ALL")
+            preparados.clear()
+        try:
+            # Dentro de transação, um PREPARE que falha não pode abortar o resto
+            if self.in_transaction: cur.execute("SAVEPOINT preparar")
+            cur.execute(f"PREPARE {nome} AS {numerado}")
+            if self.in_transaction: cur.execute("RELEASE SAVEPOINT preparar")
+            preparados[nome] = True
+        except psycopg2.Error:
+            if self.in_transaction: cur.execute("ROLLBACK TO SAVEPOINT preparar")
+            preparados[nome] = False
+        finally:
+            cur.close()
+        return nome if preparados[nome] else None
+
+    def commit(self):
+        if self.in_transaction:
+            self.bruta.cursor().execute("COMMIT")
+            self.in_transaction = False
+
+    def rollback(self):
+        if self.in_transaction:
+            self.bruta.cursor().execute("ROLLBACK")
+            self.in_transaction = False
+
+    def close(self):
+        bruta, self.bruta = self.bruta, None
+        if bruta is None: return
+        try:
+            if self.in_transaction and not bruta.closed:
+                bruta.cursor().execute("ROLLBACK")
+        except psycopg2.Error:
+            pass
+        _devolver(bruta)
+
+def _obter_pool(dsn):
+    with _pool_lock:
+        if _pool['pid'] != os.getpid() or _pool['dsn'] != dsn:
+            # Pool herdado do processo pai (fork do gunicorn) não serve no filho
+            _pool['pool'] = psycopg2.pool.ThreadedConnectionPool(
+                PG_POOL_MIN, PG_POOL_MAX, dsn, connection_factory=_ConexaoBruta,
+                options=f"-c TimeZone={FUSO_HORARIO}")
+            _pool['vagas'] = threading.BoundedSemaphore(PG_POOL_MAX)
+            _pool['pid'], _pool['dsn'] = os.getpid(), dsn
+        return _pool['pool'], _pool['vagas']
+
+def conectar(dsn):
+    """Conexão do pool deste processo (espera até PG_POOL_ESPERA por uma livre)"""
+    pool, vagas = _obter_pool(dsn)
+    if not vagas.acquire(timeout=PG_POOL_ESPERA):
+        raise psycopg2.pool.PoolError("todas as conexões do pool em uso")
+    try:
+        bruta = pool.getconn()
+        if bruta.closed:
+            pool.putconn(bruta, close=True)
+            bruta = pool.getconn()
+        bruta.autocommit = True
+        bruta.pool_origem, bruta.vagas_origem = pool, vagas
+        return ConexaoPostgres(bruta)
+    except Exception:
+        vagas.release()
+        raise
+
+def _devolver(bruta):
+    pool, vagas = bruta.pool_origem, bruta.vagas_origem
+    try:
+        pool.putconn(bruta, close=bool(bruta.closed))
+    except psycopg2.pool.PoolError:
+        # Pool já recriado (fork/troca de DSN): só fecha
+        bruta.close()
+    finally:
+        vagas.release()
+
+# --- CÓPIA DO SQLITE (flask banco migrar) ---
+
+def _tabelas_postgres(cur):
+    cur.execute("""
+        SELECT table_name, column_name, data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() ORDER BY table_name, ordinal_position
+    """)
+    tabelas = {}
+    for tabela, coluna, tipo in cur.fetchall():
+        tabelas.setdefault(tabela, {})[coluna] = tipo
+    return tabelas
+
+def _converter(valor, tipo):
+    # O SQLite aceita texto vazio em coluna numérica; o Postgres não
+    if isinstance(valor, str) and tipo in ('integer', 'bigint', 'double precision'):
+        valor = valor.strip().replace(',', '.')
+        if not valor: return None
+        return float(valor) if tipo == 'double precision' else int(float(valor))
+    return valor
+
+def copiar_do_sqlite(dsn, caminho_sqlite, substituir=False, tamanho_lote=1000, ao_progresso=None):
+    """
+    Copia todas as tabelas do arquivo SQLite que existem no esquema do Postgres
+    (criado antes pelo init_db), numa única transação, em lotes. Com substituir,
+    esvazia as tabelas de destino antes; sem, recusa se alguma já tiver dados
+    (fora as TABELAS_SEMEADAS, sempre trocadas pelas do SQLite).
+    Acerta as sequências dos ids no fim. Retorna {tabela: linhas copiadas}.
+    """
+    origem = sqlite3.connect(f"file:{caminho_sqlite}?mode=ro", uri=True)
+    destino = psycopg2.connect(dsn, options=f"-c TimeZone={FUSO_HORARIO}")
+    copiadas = {}
+    try:
+        cur_origem, cur = origem.cursor(), destino.cursor()
+        cur_origem.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+        tabelas_sqlite = {r[0] for r in cur_origem.fetchall()}
+        tabelas = {t: c for t, c in _tabelas_postgres(cur).items() if t in tabelas_sqlite - TABELAS_NAO_COPIADAS}
+
+        # Duas cópias ao mesmo tempo não conferem/esvaziam as tabelas juntas
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('copia_sqlite'))")
+        if not substituir:
+            for tabela in sorted(set(tabelas) - TABELAS_SEMEADAS):
+                cur.execute(f"SELECT EXISTS (SELECT 1 FROM {tabela})")
+                if cur.fetchone()[0]:
+                    raise ValueError(f"a tabela {tabela} já tem dados no Postgres (use --substituir)")
+        cur.execute(f"TRUNCATE {', '.join(sorted(tabelas if substituir else set(tabelas) & TABELAS_SEMEADAS))}")
+
+        for tabela, tipos in sorted(tabelas.items()):
+            cur_origem.execute(f"PRAGMA table_info({tabela})")
+            colunas = [r[1] for r in cur_origem.fetchall() if r[1] in tipos]
+            cur_origem.execute(f"SELECT {', '.join(colunas)} FROM {tabela}")
+            comando = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES %s"
+            copiadas[tabela] = 0
+            while True:
+                bloco = cur_origem.fetchmany(tamanho_lote)
+                if not bloco: break
+                linhas = [tuple(_converter(v, tipos[c]) for v, c in zip(linha, colunas)) for linha in bloco]
+                psycopg2.extras.execute_values(cur, comando, linhas, page_size=tamanho_lote)
+                copiadas[tabela] += len(linhas)
+                if ao_progresso: ao_progresso(tabela, copiadas[tabela])
+            if tabela in TABELAS_COM_ID:
+                cur.execute(f"SELECT setval(pg_get_serial_sequence('{tabela}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {tabela}")
+        destino.commit()
+        return copiadas
+    except Exception:
+        destino.rollback()
+        raise
+    finally:
+        origem.close()
+        destino.close()
@@ -0,0 +1,376 @@
+"""
+Benchmark de carga da loja.
+
+Gera um catálogo sintético num banco temporário, sobe servidores falsos do
+Mercado Pago e do Melhor Envio, inicia o app no gunicorn e dispara um mix de
+tráfego (navegação, busca, carrinho, checkout e rajadas de webhooks). No fim
+mostra p50/p95/p99 e requisições por segundo de cada rota e compara com o
+baseline salvo.
+
+    python benchmark.py --workers 4 --duracao 60
+    python benchmark.py --salvar-baseline
+    python benchmark.py --mix navegacao=20,webhook=80
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import argparse
+import datetime
+import platform
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+PASTA_APP = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PADRAO = os.path.join(PASTA_APP, "benchmark_baseline.json")
+
+CATEGORIAS = ["Celulares", "Notebooks", "Fones de Ouvido", "Smartwatches", "Câmeras", "Tablets",
+              "Games", "Acessórios", "Áudio", "Monitores", "Impressoras", "Casa Inteligente"]
+PALAVRAS = ["carregador", "bluetooth", "sem fio", "gamer", "ultra", "pro", "mini", "preto",
+            "branco", "rápido", "portátil", "4k", "usb-c", "bateria", "tela", "câmera", "som"]
+# Peso de cada cenário no mix padrão (proporção aproximada de uma loja pequena)
+MIX_PADRAO = {"navegacao": 50, "busca": 20, "carrinho": 15, "checkout": 5, "webhook": 10}
+
+# --- BANCO SINTÉTICO ---
+
+def preparar_banco(caminho, n_produtos, n_vendas, semente=42):
+    """Cria o banco do benchmark com n_produtos e n_vendas (determinístico pela semente)"""
+    os.environ["LOJA_DB_PATH"] = caminho
+    os.environ["DATABASE_URL"] = ""
+    import database
+    database.DB_PATH = caminho
+    database.DATABASE_URL = ""
+    database.init_db()
+    rnd = random.Random(semente)
+
+    lote = []
+    for i in range(1, n_produtos + 1):
+        preco = round(rnd.uniform(19.9, 4999.9), 2)
+        em_oferta = rnd.random() < 0.1
+        lote.append({
+            'id': f"b{i:06d}",
+            'nome': f"{rnd.choice(CATEGORIAS)[:-1]} {' '.join(rnd.sample(PALAVRAS, 3))} {i}",
+            'categoria': rnd.choice(CATEGORIAS),
+            'preco': preco,
+            'descricao': " ".join(rnd.choices(PALAVRAS, k=25)),
+            'em_oferta': em_oferta,
+            'novo_preco': round(preco * 0.85, 2) if em_oferta else None,
+            'estoque': rnd.randint(0, 200),
+        })
+        if len(lote) == 1000:
+            database.importar_produtos_lote(lote)
+            lote = []
+    database.importar_produtos_lote(lote)
+
+    agora = datetime.datetime.now()
+    status = ["pendente", "pago", "pago", "pago", "cancelado"]
+    conn = database.create_connection()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.executemany("""
+        INSERT INTO vendas (nome_cliente, email_cliente, whatsapp_cliente, produto_nome, quantidade, valor_total, status, data)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        (f"Cliente {c}", f"cliente{c}@exemplo.com", "11999999999", f"Produto b{rnd.randint(1, n_produtos):06d}",
+         1, round(rnd.uniform(19.9, 4999.9), 2), rnd.choice(status),
+         (agora - datetime.timedelta(minutes=rnd.randint(0, 365 * 24 * 60))).strftime("%Y-%m-%d %H:%M:%S"))
+        for c in (rnd.randint(1, 5000) for _ in range(n_vendas))
+    ))
+    database.reconstruir_resumo_vendas(cur)
+    database.reconstruir_resumo_periodos(cur)
+    conn.commit()
+    conn.close()
+
+    database.update_configuracao('mercado_pago_token', "TEST-benchmark-token")
+    database.update_configuracao('melhor_envio_token', "benchmark-token-melhor-envio")
+    database.update_configuracao('cep_origem', "01001000")
+
+# --- APIS FALSAS ---
+
+class APIsFalsas(BaseHTTPRequestHandler):
+    """Responde como Mercado Pago (preferências e pagamentos) e Melhor Envio (cotação)"""
+    latencia = 0.0
+
+    def _responder(self, codigo, corpo):
+        dados = json.dumps(corpo).encode()
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.latencia)
+        if self.path.startswith("/checkout/preferences"):
+            id_pref = uuid.uuid4().hex
+            return self._responder(201, {"id": id_pref, "init_point": f"http://mp.invalid/checkout/{id_pref}"})
+        if self.path.startswith("/me/shipment/calculate"):
+            return self._responder(200, [
+                {"id": 1, "name": "PAC", "price": "24.90", "delivery_time": 8, "company": {"name": "Correios", "picture": ""}},
+                {"id": 2, "name": "SEDEX", "price": "42.10", "delivery_time": 3, "company": {"name": "Correios", "picture": ""}},
+                {"id": 3, "name": ".Package", "price": "19.75", "delivery_time": 6, "company": {"name": "Jadlog", "picture": ""}},
+            ])
+        self._responder(404, {"message": "not found"})
+
+    def do_GET(self):
+        time.sleep(self.latencia)
+        if self.path.startswith("/v1/payments/"):
+            # O id do pagamento no benchmark é "<id_venda>-<aleatório>"
+            payment_id = self.path.rsplit("/", 1)[-1]
+            return self._responder(200, {"id": payment_id, "status": "approved", "external_reference": payment_id.split("-")[0]})
+        self._responder(404, {"message": "not found"})
+
+    def log_message(self, *args):
+        pass
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def iniciar_apis_falsas(latencia):
+    APIsFalsas.latencia = latencia
+    servidor = ThreadingHTTPServer(("127.0.0.1", porta_livre()), APIsFalsas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+# --- APP NO GUNICORN ---
+
+def iniciar_gunicorn(workers, ambiente, log):
+    porta = porta_livre()
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{porta}", "main:app"],
+        cwd=PASTA_APP, env=ambiente, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{porta}"
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f"gunicorn saiu com código {processo.returncode} (veja {log.name})")
+        try:
+            if requests.get(f"{url}/sobre", timeout=2).status_code == 200:
+                return processo, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.3)
+    processo.terminate()
+    raise RuntimeError(f"gunicorn não respondeu em 60s (veja {log.name})")
+
+# --- CENÁRIOS DE TRÁFEGO ---
+
+class Usuario:
+    """Um cliente virtual com sessão (cookies) própria"""
+
+    def __init__(self, url, n_produtos, n_vendas, registrar, rnd):
+        self.url = url
+        self.n_produtos = n_produtos
+        self.n_vendas = n_vendas
+        self.registrar = registrar
+        self.rnd = rnd
+        self.sessao = requests.Session()
+
+    def _req(self, metodo, rota, caminho, ok=(200, 302, 304), **kwargs):
+        inicio = time.perf_counter()
+        try:
+            resposta = self.sessao.request(metodo, self.url + caminho, allow_redirects=False, timeout=30, **kwargs)
+            sucesso = resposta.status_code in ok
+        except requests.RequestException:
+            sucesso = False
+        self.registrar(rota, time.perf_counter() - inicio, sucesso)
+
+    def _produto(self):
+        return f"b{self.rnd.randint(1, self.n_produtos):06d}"
+
+    def navegacao(self):
+        self._req("GET", "GET /", "/")
+        self._req("GET", "GET /categoria/<nome>", f"/categoria/{self.rnd.choice(CATEGORIAS)}")
+        self._req("GET", "GET /produto/<id>", f"/produto/{self._produto()}")
+
+    def busca(self):
+        termo = " ".join(self.rnd.sample(PALAVRAS, self.rnd.randint(1, 2)))
+        self._req("GET", "GET /pesquisar", "/pesquisar", params={"q": termo})
+
+    def carrinho(self):
+        for _ in range(self.rnd.randint(1, 3)):
+            self._req("POST", "POST /adicionar_carrinho/<id>", f"/adicionar_carrinho/{self._produto()}", data={"quantidade": 1})
+        self._req("GET", "GET /carrinho", "/carrinho")
+        self._req("POST", "POST /calcular_frete", "/calcular_frete",
+                  json={"carrinho": True, "cep": f"{self.rnd.randint(1000000, 99999999):08d}"})
+
+    def checkout(self):
+        id_produto = self._produto()
+        self._req("GET", "GET /checkout/<id>", f"/checkout/{id_produto}")
+        self._req("POST", "POST /processar_pagamento", "/processar_pagamento", ok=(302,), data={
+            "nome": "Cliente Benchmark", "email": f"bench{self.rnd.randint(1, 10**9)}@exemplo.com",
+            "whatsapp": "11999999999", "id_produto": id_produto, "quantidade": 1,
+            "metodo_pagamento": self.rnd.choice(["pix", "cartao"]), "frete_valor": "24.90"})
+
+    def webhook(self):
+        payment_id = f"{self.rnd.randint(1, max(self.n_vendas, 1))}-{uuid.uuid4().hex[:12]}"
+        self._req("POST", "POST /webhook/mercadopago", "/webhook/mercadopago",
+                  json={"type": "payment", "data": {"id": payment_id}})
+
+def disparar_trafego(url, mix, usuarios, duracao, aquecimento, n_produtos, n_vendas):
+    """Roda os usuários virtuais; só as amostras depois do aquecimento entram no resultado"""
+    amostras = {}
+    lock = threading.Lock()
+    inicio_medicao = time.monotonic() + aquecimento
+    fim = inicio_medicao + duracao
+    cenarios, pesos = zip(*mix.items())
+
+    def registrar(rota, segundos, sucesso):
+        if time.monotonic() < inicio_medicao: return
+        with lock:
+            latencias, erros = amostras.setdefault(rota, ([], [0]))
+            latencias.append(segundos)
+            if not sucesso: erros[0] += 1
+
+    def rodar(numero):
+        rnd = random.Random(numero)
+        usuario = Usuario(url, n_produtos, n_vendas, registrar, rnd)
+        while time.monotonic() < fim:
+            getattr(usuario, rnd.choices(cenarios, pesos)[0])()
+
+    threads = [threading.Thread(target=rodar, args=(i,), daemon=True) for i in range(usuarios)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return amostras
+
+# --- RELATÓRIO E BASELINE ---
+
+def _percentil(ordenadas, p):
+    return ordenadas[min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))]
+
+def resumir(amostras, duracao):
+    rotas = {}
+    todas = []
+    erros_total = 0
+    for rota, (latencias, erros) in sorted(amostras.items()):
+        ordenadas = sorted(latencias)
+        todas.extend(ordenadas)
+        erros_total += erros[0]
+        rotas[rota] = {
+            "requisicoes": len(ordenadas), "erros": erros[0], "rps": round(len(ordenadas) / duracao, 2),
+            "p50_ms": round(_percentil(ordenadas, 50) * 1000, 2),
+            "p95_ms": round(_percentil(ordenadas, 95) * 1000, 2),
+            "p99_ms": round(_percentil(ordenadas, 99) * 1000, 2),
+        }
+    todas.sort()
+    total = {"requisicoes": len(todas), "erros": erros_total, "rps": round(len(todas) / duracao, 2)}
+    if todas:
+        total.update({f"p{p}_ms": round(_percentil(todas, p) * 1000, 2) for p in (50, 95, 99)})
+    return rotas, total
+
+def imprimir(rotas, total):
+    print(f"\n{'rota':<32}{'req':>8}{'erros':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for rota, r in list(rotas.items()) + [("TOTAL", total)]:
+        print(f"{rota:<32}{r['requisicoes']:>8}{r['erros']:>7}{r['rps']:>9}"
+              f"{r.get('p50_ms', '-'):>9}{r.get('p95_ms', '-'):>9}{r.get('p99_ms', '-'):>9}")
+
+def comparar(atual, baseline, tolerancia):
+    """Lista as rotas com p95 acima ou req/s abaixo do baseline além da tolerância (%)"""
+    if any(atual["meta"][k] != baseline["meta"].get(k) for k in ("workers", "usuarios", "produtos", "vendas", "mix")):
+        print("⚠️  Parâmetros diferentes do baseline; a comparação é só indicativa.")
+    regressoes = []
+    print(f"\n{'rota':<32}{'p95 base':>10}{'p95 atual':>11}{'Δ%':>8}{'req/s base':>12}{'req/s atual':>13}{'Δ%':>8}")
+    for rota, r in atual["rotas"].items():
+        base = baseline["rotas"].get(rota)
+        if not base: continue
+        dp95 = (r["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100 if base["p95_ms"] else 0.0
+        drps = (r["rps"] - base["rps"]) / base["rps"] * 100 if base["rps"] else 0.0
+        marca = ""
+        if dp95 > tolerancia or drps < -tolerancia:
+            regressoes.append(rota)
+            marca = "  ❌"
+        print(f"{rota:<32}{base['p95_ms']:>10}{r['p95_ms']:>11}{dp95:>8.1f}{base['rps']:>12}{r['rps']:>13}{drps:>8.1f}{marca}")
+    return regressoes
+
+def ler_mix(texto):
+    if not texto: return dict(MIX_PADRAO)
+    mix = {}
+    for parte in texto.split(","):
+        nome, _, peso = parte.partition("=")
+        if nome.strip() not in MIX_PADRAO:
+            raise argparse.ArgumentTypeError(f"cenário desconhecido: {nome!r} (use {', '.join(MIX_PADRAO)})")
+        mix[nome.strip()] = float(peso or 1)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga da loja (gunicorn + APIs falsas)")
+    parser.add_argument("--workers", type=int, default=4, help="workers do gunicorn")
+    parser.add_argument("--usuarios", type=int, default=16, help="usuários virtuais simultâneos")
+    parser.add_argument("--duracao", type=float, default=30, help="segundos de medição")
+    parser.add_argument("--aquecimento", type=float, default=5, help="segundos descartados no início")
+    parser.add_argument("--produtos", type=int, default=10000)
+    parser.add_argument("--vendas", type=int, default=100000)
+    parser.add_argument("--mix", type=ler_mix, default=None, help="ex.: navegacao=50,busca=20,webhook=30")
+    parser.add_argument("--latencia-api", type=float, default=50, help="ms de latência das APIs falsas")
+    parser.add_argument("--baseline", default=BASELINE_PADRAO, help="arquivo JSON do baseline")
+    parser.add_argument("--salvar-baseline", action="store_true", help="grava este resultado como baseline")
+    parser.add_argument("--tolerancia", type=float, default=15, help="piora (%%) aceita antes de acusar regressão")
+    parser.add_argument("--manter-arquivos", action="store_true", help="não apaga o banco e o log do gunicorn")
+    args = parser.parse_args()
+    mix = args.mix or dict(MIX_PADRAO)
+
+    pasta = tempfile.mkdtemp(prefix="loja-bench-")
+    caminho_banco = os.path.join(pasta, "loja.db")
+    print(f"📦 Gerando {args.produtos} produtos e {args.vendas} vendas em {caminho_banco}...")
+    preparar_banco(caminho_banco, args.produtos, args.vendas)
+
+    servidor, url_apis = iniciar_apis_falsas(args.latencia_api / 1000)
+    ambiente = dict(os.environ, LOJA_DB_PATH=caminho_banco, DATABASE_URL="", MP_API_URL=url_apis,
+                    MELHOR_ENVIO_URL=f"{url_apis}/me/shipment/calculate", FRETE_CACHE_PERSISTENTE="1",
+                    METRICAS_PASTA=os.path.join(pasta, "metricas"))
+    with open(os.path.join(pasta, "gunicorn.log"), "w") as log:
+        processo, url = iniciar_gunicorn(args.workers, ambiente, log)
+        print(f"🚀 {args.workers} workers em {url}; {args.usuarios} usuários por {args.duracao:.0f}s (+{args.aquecimento:.0f}s de aquecimento)")
+        try:
+            amostras = disparar_trafego(url, mix, args.usuarios, args.duracao, args.aquecimento, args.produtos, args.vendas)
+        finally:
+            processo.terminate()
+            processo.wait(timeout=30)
+            servidor.shutdown()
+    if args.manter_arquivos:
+        print(f"📁 Banco e log do gunicorn em {pasta}")
+    else:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    rotas, total = resumir(amostras, args.duracao)
+    imprimir(rotas, total)
+    resultado = {
+        "meta": {
+            "data": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+            "workers": args.workers, "usuarios": args.usuarios, "duracao": args.duracao,
+            "produtos": args.produtos, "vendas": args.vendas, "mix": mix, "latencia_api_ms": args.latencia_api,
+        },
+        "rotas": rotas,
+        "total": total,
+    }
+
+    if args.salvar_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Baseline salvo em {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"\nSem baseline em {args.baseline}; rode com --salvar-baseline para criar.")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressoes = comparar(resultado, baseline, args.tolerancia)
+    if regressoes:
+        print(f"\n❌ Regressão acima de {args.tolerancia:.0f}% em: {', '.join(regressoes)}")
+        return 1
+    print("\n✅ Dentro da tolerância do baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import time
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+from flask import request, session, make_response
+import database
+
+# Tempo máximo que uma página fica em cache mesmo sem mudança de versão
+# (conteúdo que depende do relógio, como o fim das ofertas)
+PAGINA_CACHE_TTL = 60
+PAGINA_CACHE_MAX_ITENS = 512
+
+class CacheLRU:
+    """Cache LRU em memória com expiração por item e contadores de acerto/erro"""
+
+    def __init__(self, max_itens, ttl, eventos=("hits", "misses")):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.contadores = {evento: 0 for evento in eventos}
+
+    def get(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            valor, expira_em = item
+            if expira_em < time.time():
+                del self._itens[chave]
+                return None
+            self._itens.move_to_end(chave)
+            return valor
+
+    def set(self, chave, valor, expira_em=None):
+        with self._lock:
+            self._itens[chave] = (valor, expira_em or time.time() + self.ttl)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def contar(self, evento):
+        with self._lock:
+            self.contadores[evento] += 1
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            stats = dict(self.contadores)
+            stats["itens"] = len(self._itens)
+        total = sum(self.contadores.values())
+        stats["max_itens"] = self.max_itens
+        stats["ttl"] = self.ttl
+        stats["taxa_acerto"] = round((total - stats.get("misses", 0)) / total, 4) if total else 0.0
+        return stats
+
+_paginas = CacheLRU(PAGINA_CACHE_MAX_ITENS, PAGINA_CACHE_TTL, eventos=("hits", "nao_modificado", "misses"))
+
+def estatisticas_paginas():
+    return _paginas.estatisticas()
+
+def _etag_pagina(chave):
+    # Muda quando catálogo/configuração mudam ou quando vence a janela do TTL
+    versoes = database.get_versoes()
+    janela = int(time.time() // PAGINA_CACHE_TTL)
+    base = f"{chave}|{versoes.get('catalogo', 0)}|{versoes.get('config', 0)}|{janela}"
+    return hashlib.sha1(base.encode()).hexdigest()[:20]
+
+def pagina_em_cache(view):
+    """
+    Cache da página renderizada para visitantes anônimos (sessão vazia: sem login
+    ou mensagens flash; e sem cookie de carrinho). Responde com ETag e devolve 304 para If-None-Match.
+    """
+    # O cookie do carrinho muda o contador do menu: quem tem carrinho não recebe a
+    # página compartilhada. Import aqui porque o carrinho importa este módulo (CacheLRU)
+    from carrinho import COOKIE_CARRINHO
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or session or request.cookies.get(COOKIE_CARRINHO):
+            return view(*args, **kwargs)
+
+        chave = request.full_path
+        etag = _etag_pagina(chave)
+        if etag in request.if_none_match:
+            _paginas.contar("nao_modificado")
+            resposta = make_response("", 304)
+        else:
+            salvo = _paginas.get(chave)
+            if salvo and salvo[0] == etag:
+                _paginas.contar("hits")
+                resposta = make_response(salvo[1], 200, {'Content-Type': salvo[2]})
+            else:
+                _paginas.contar("misses")
+                resposta = make_response(view(*args, **kwargs))
+                # Não guarda redirecionamentos/erros nem páginas que mexeram na sessão
+                if resposta.status_code != 200 or session:
+                    return resposta
+                _paginas.set(chave, (etag, resposta.get_data(), resposta.content_type))
+        resposta.set_etag(etag)
+        resposta.headers['Cache-Control'] = 'no-cache'
+        return resposta
+    return wrapper
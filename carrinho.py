@@ -0,0 +1,203 @@
+import re
+import math
+import random
+import secrets
+import datetime
+from flask import g, request, session, after_this_request
+import database
+import ofertas
+from cache import CacheLRU
+
+# Desconto (%) aplicado ao subtotal dos produtos quando o pagamento é via Pix
+DESCONTO_PIX_PADRAO = 5
+
+# O carrinho fica no banco; o cookie leva só este id opaco
+COOKIE_CARRINHO = "carrinho_id"
+# Carrinho sem alteração por este tempo vence (cookie e registro)
+CARRINHO_VALIDADE = 30 * 24 * 3600
+QUANTIDADE_MAX_ITEM = 99
+# Cópia em memória dos carrinhos (por worker), conferida pela versão do banco
+CARRINHO_CACHE_MAX_ITENS = 2048
+CARRINHO_CACHE_TTL = 15 * 60
+
+_ID_VALIDO = re.compile(r"^[A-Za-z0-9_-]{32}$")
+_carrinhos = CacheLRU(CARRINHO_CACHE_MAX_ITENS, CARRINHO_CACHE_TTL)
+
+def preco_efetivo(produto, agora=None):
+    """Preço cobrado hoje: novo_preco enquanto a oferta do produto estiver valendo"""
+    return float(produto['novo_preco'] if ofertas.oferta_ativa(produto, agora) else produto['preco'])
+
+def calcular_carrinho(itens):
+    """
+    Precifica um carrinho {id_produto: quantidade} com uma única consulta ao banco.
+    Retorna as linhas (produto, quantidade, preço unitário, subtotal) e os totais,
+    incluindo o valor com desconto Pix. Itens inexistentes ou sem quantidade são ignorados.
+    """
+    produtos = database.get_produtos_por_ids(itens.keys())
+    agora = datetime.datetime.now().strftime(database.FORMATO_OFERTA)
+    linhas = []
+    subtotal = 0.0
+    quantidade_total = 0
+    for id_p, qtd in itens.items():
+        produto = produtos.get(str(id_p))
+        qtd = int(qtd or 0)
+        if not produto or qtd <= 0: continue
+        preco = preco_efetivo(produto, agora)
+        total_linha = round(preco * qtd, 2)
+        linhas.append({'produto': produto, 'quantidade': qtd, 'preco_unitario': preco, 'subtotal': total_linha})
+        subtotal += total_linha
+        quantidade_total += qtd
+
+    subtotal = round(subtotal, 2)
+    desconto_pix = round(subtotal * DESCONTO_PIX_PADRAO / 100, 2)
+    return {
+        'itens': linhas,
+        'quantidade_total': quantidade_total,
+        'subtotal': subtotal,
+        'percentual_pix': DESCONTO_PIX_PADRAO,
+        'desconto_pix': desconto_pix,
+        'total_pix': round(subtotal - desconto_pix, 2),
+    }
+
+def total_a_pagar(resumo, metodo_pagamento, frete=0.0):
+    """Valor final do pedido: subtotal (com desconto se Pix) + frete"""
+    frete = float(frete or 0)
+    if not math.isfinite(frete) or frete < 0:
+        raise ValueError(f"Frete inválido: {frete}")
+    base = resumo['total_pix'] if metodo_pagamento == 'pix' else resumo['subtotal']
+    return round(base + frete, 2)
+
+# --- CARRINHO NO SERVIDOR ---
+
+def _guardar(id_carrinho, carrinho):
+    # Write-through: toda escrita devolve o carrinho como ficou no banco
+    if carrinho:
+        _carrinhos.set(id_carrinho, carrinho)
+    return dict(carrinho[2]) if carrinho else {}
+
+def _carregar(id_carrinho):
+    """(versao, cliente_id, itens) do carrinho, usando a cópia em memória se a versão bate"""
+    atual = database.get_versao_carrinho(id_carrinho)
+    if atual is None:
+        return None
+    salvo = _carrinhos.get(id_carrinho)
+    if salvo and salvo[0] == atual[0]:
+        _carrinhos.contar("hits")
+        return salvo
+    # Outro worker mexeu no carrinho (ou não estava em memória)
+    _carrinhos.contar("misses")
+    carrinho = database.get_carrinho(id_carrinho)
+    if carrinho:
+        _carrinhos.set(id_carrinho, carrinho)
+    return carrinho
+
+def _gravar_cookie(id_carrinho):
+    """Aponta o cookie para id_carrinho (None apaga) na resposta desta requisição"""
+    g.carrinho_id = id_carrinho
+    if g.get('carrinho_cookie_agendado'):
+        return
+    g.carrinho_cookie_agendado = True
+
+    @after_this_request
+    def gravar(resposta):
+        if g.carrinho_id:
+            resposta.set_cookie(COOKIE_CARRINHO, g.carrinho_id, max_age=CARRINHO_VALIDADE,
+                                httponly=True, samesite='Lax', secure=request.is_secure)
+        else:
+            resposta.delete_cookie(COOKIE_CARRINHO)
+        return resposta
+
+def _id_do_cookie():
+    # Id trocado nesta mesma requisição (carrinho novo, login) vale antes do cookie recebido
+    if 'carrinho_id' in g:
+        return g.carrinho_id
+    id_carrinho = request.cookies.get(COOKIE_CARRINHO, '')
+    return id_carrinho if _ID_VALIDO.match(id_carrinho) else None
+
+def _carrinho_da_requisicao():
+    """(id, carrinho) do cookie; carrinho de outro cliente que não o logado é ignorado"""
+    id_carrinho = _id_do_cookie()
+    carrinho = _carregar(id_carrinho) if id_carrinho else None
+    if carrinho and carrinho[1] is not None and carrinho[1] != session.get('cliente_id'):
+        carrinho = None
+    return id_carrinho, carrinho
+
+def _id_para_escrita():
+    """Id do carrinho a alterar; cria um novo (e o cookie) se a requisição não tem um válido"""
+    id_carrinho, carrinho = _carrinho_da_requisicao()
+    if carrinho is None:
+        id_carrinho = secrets.token_urlsafe(24)
+        _gravar_cookie(id_carrinho)
+        # De vez em quando varre os vencidos para as tabelas não crescerem
+        if random.random() < 0.01:
+            limpar_vencidos()
+    return id_carrinho
+
+def migrar_sessao_antiga():
+    """
+    Passa para o banco o carrinho que ainda está no cookie de sessão (antes do
+    carrinho no servidor). Grava no banco e no cookie: chamado só pelas rotas
+    do carrinho e do login, nunca ao renderizar outras páginas.
+    """
+    antigo = session.pop('carrinho', None)
+    for id_p, qtd in (antigo or {}).items():
+        adicionar(id_p, qtd)
+
+def itens():
+    """Carrinho da requisição atual: {id_produto: quantidade}"""
+    _, carrinho = _carrinho_da_requisicao()
+    return dict(carrinho[2]) if carrinho else {}
+
+def quantidade_de_produtos():
+    """
+    Produtos distintos no carrinho (contador do menu). Só lê: sem cookie nem
+    consulta o banco, e o carrinho antigo da sessão entra na conta sem ser migrado.
+    """
+    antigo = session.get('carrinho') or {}
+    if not _id_do_cookie():
+        return len(antigo)
+    return len(set(itens()) | {str(id_p) for id_p in antigo})
+
+def _alterar(id_produto, quantidade, somar):
+    id_carrinho = _id_para_escrita()
+    carrinho = database.alterar_item_carrinho(id_carrinho, id_produto, quantidade, CARRINHO_VALIDADE,
+                                              QUANTIDADE_MAX_ITEM, somar=somar, cliente_id=session.get('cliente_id'))
+    if carrinho:
+        # Renova o cookie junto com a validade do registro
+        _gravar_cookie(id_carrinho)
+    return _guardar(id_carrinho, carrinho)
+
+def adicionar(id_produto, quantidade=1):
+    return _alterar(id_produto, max(int(quantidade), 0), somar=True)
+
+def atualizar_quantidade(id_produto, quantidade):
+    """Define a quantidade do item; zero remove"""
+    return _alterar(id_produto, max(int(quantidade), 0), somar=False)
+
+def remover(id_produto):
+    return _alterar(id_produto, 0, somar=False)
+
+def esvaziar():
+    id_carrinho, carrinho = _carrinho_da_requisicao()
+    if carrinho:
+        _guardar(id_carrinho, database.esvaziar_carrinho(id_carrinho, CARRINHO_VALIDADE))
+
+def mesclar_no_login(cliente_id):
+    """Junta o carrinho anônimo ao do cliente; o cookie passa a apontar para o carrinho dele"""
+    id_carrinho, carrinho = _carrinho_da_requisicao()
+    anonimo = id_carrinho if carrinho and carrinho[1] is None else None
+    destino, carrinho = database.mesclar_carrinho_do_cliente(anonimo, cliente_id, CARRINHO_VALIDADE, QUANTIDADE_MAX_ITEM)
+    if destino:
+        _guardar(destino, carrinho)
+        _gravar_cookie(destino)
+
+def esquecer():
+    """Logout: o carrinho continua salvo na conta, mas este navegador deixa de usá-lo"""
+    if _id_do_cookie():
+        _gravar_cookie(None)
+
+def limpar_vencidos():
+    apagados = database.limpar_carrinhos_vencidos()
+    if apagados:
+        print(f"🛒 {apagados} carrinho(s) vencido(s) apagado(s)")
+    return apagados
@@ -1,114 +1,677 @@
 import sqlite3
 import os
+import re
+import queue
+import threading
+import time
 import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 
-# Nome do arquivo de banco de dados
-DB_PATH = "loja.db"
+# Nome do arquivo de banco de dados (LOJA_DB_PATH permite usar outro, ex.: no benchmark)
+DB_PATH = os.getenv("LOJA_DB_PATH", "loja.db")
+# Com DATABASE_URL postgres://... os dados ficam no Postgres (vários nós atrás do
+# balanceador) em vez do arquivo local; ver banco_postgres
+DATABASE_URL = os.getenv("DATABASE_URL", "")
 
-def create_connection():
-    """Cria conexão com o banco de dados local SQLite"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
+# Quantas conexões ociosas cada processo (worker do gunicorn) mantém abertas
+POOL_MAX_CONEXOES = 8
+# Tempo (segundos) que uma conexão espera por um lock de escrita antes de falhar
+BUSY_TIMEOUT = 5.0
+
+PRAGMAS_CONEXAO = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+    "PRAGMA mmap_size = 67108864",
+)
+
+class ConexaoPooled(sqlite3.Connection):
+    """Conexão SQLite que volta para o pool no close() em vez de ser fechada"""
+
+    def close(self):
+        if not _pool.devolver(self):
+            super().close()
+
+    def fechar_de_verdade(self):
+        super().close()
+
+class PoolConexoes:
+    """Pool de conexões por processo; recriado quando o gunicorn faz fork do worker"""
+
+    def __init__(self, tamanho):
+        self.tamanho = tamanho
+        self._pid = os.getpid()
+        self._livres = queue.LifoQueue(maxsize=tamanho)
+
+    def _checar_fork(self):
+        # Conexões herdadas do processo pai não podem ser usadas no filho
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._livres = queue.LifoQueue(maxsize=self.tamanho)
+
+    def obter(self):
+        self._checar_fork()
+        while True:
+            try:
+                conn = self._livres.get_nowait()
+            except queue.Empty:
+                return self._nova_conexao()
+            if conn.db_path == DB_PATH:
+                return conn
+            conn.fechar_de_verdade()
+
+    def devolver(self, conn):
+        self._checar_fork()
+        if getattr(conn, 'db_path', None) != DB_PATH:
+            return False
+        try:
+            # Nunca devolve ao pool uma transação pela metade
+            if conn.in_transaction:
+                conn.rollback()
+            self._livres.put_nowait(conn)
+            return True
+        except (queue.Full, sqlite3.Error):
+            return False
+
+    def _nova_conexao(self):
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, factory=ConexaoPooled, check_same_thread=False)
+        conn.db_path = DB_PATH
         conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS_CONEXAO:
+            conn.execute(pragma)
         return conn
+
+    def fechar_todas(self):
+        while True:
+            try:
+                self._livres.get_nowait().fechar_de_verdade()
+            except queue.Empty:
+                return
+
+_pool = PoolConexoes(POOL_MAX_CONEXOES)
+
+def _postgres():
+    """True se o banco configurado é o Postgres (lido a cada chamada: testes trocam o banco)"""
+    return DATABASE_URL.startswith(("postgres://", "postgresql://"))
+
+# Erros de banco dos dois motores (o psycopg2 só é importado com Postgres configurado)
+ERROS_BANCO = (sqlite3.Error,)
+
+def create_connection():
+    """
+    Pega uma conexão do pool do processo; close() devolve ao pool. No SQLite é o
+    arquivo local (WAL, busy timeout); no Postgres, uma ConexaoPostgres com a mesma
+    interface, que traduz o SQL deste módulo.
+    """
+    global ERROS_BANCO
+    try:
+        if _postgres():
+            import psycopg2
+            import banco_postgres
+            ERROS_BANCO = (sqlite3.Error, psycopg2.Error)
+            return banco_postgres.conectar(DATABASE_URL)
+        return _pool.obter()
     except Exception as e:
-        print(f"Erro de conexão ao banco local: {e}")
+        print(f"Erro de conexão ao banco {'Postgres' if _postgres() else 'local'}: {e}")
         return None
 
+def _travar(cur, *recursos):
+    """
+    Trava os recursos (ex.: 'estoque:p1', 'venda:42') até o fim da transação.
+    No SQLite o BEGIN IMMEDIATE já deixa uma escrita por vez e nada é feito; no
+    Postgres cada recurso vira um advisory lock próprio, pegos em ordem fixa para
+    duas transações não se cruzarem. Escritas em recursos diferentes seguem em paralelo.
+    """
+    if not _postgres(): return
+    for recurso in sorted(set(recursos)):
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(?))", (recurso,))
+
+# --- ESQUEMA E MIGRAÇÕES ---
+
 def init_db():
-    """Inicializa as tabelas no seu celular e cria o Admin"""
+    """
+    Deixa o esquema na última versão de MIGRACOES. Com o banco em dia (o caso de
+    todo worker depois do primeiro) é uma consulta só; as migrações pendentes
+    rodam uma vez, sob o lock 'migracoes', no primeiro processo que chegar.
+    """
     conn = create_connection()
     if not conn: return
+    cur = conn.cursor()
+    motor = "POSTGRES" if _postgres() else "LOCAL"
     try:
-        cur = conn.cursor()
-
-        # 1. Tabela de Usuários (Admin)
+        if _versao_esquema(cur) >= MIGRACOES[-1][0]:
+            return
+        cur.execute("BEGIN IMMEDIATE")
+        _travar(cur, 'migracoes')
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL
+            CREATE TABLE IF NOT EXISTS migracoes (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT NOT NULL,
+                aplicada_em TEXT NOT NULL
             )
         """)
+        # Outro worker pode ter migrado enquanto este esperava o lock
+        atual = _versao_esquema(cur)
+        for versao, descricao, migrar in MIGRACOES:
+            if versao <= atual: continue
+            migrar(cur)
+            cur.execute("INSERT INTO migracoes (versao, descricao, aplicada_em) VALUES (?, ?, ?)",
+                        (versao, descricao, datetime.datetime.now().isoformat(sep=' ', timespec='seconds')))
+            print(f"🔧 Migração {versao} aplicada: {descricao}")
+        conn.commit()
+        print(f"✅ Banco de dados {motor} pronto!")
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao migrar o banco {motor.lower()}: {e}")
+    finally:
+        conn.close()
 
-        # 2. Tabela de Produtos
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS produtos (
-                id TEXT PRIMARY KEY,
-                nome TEXT NOT NULL,
-                categoria TEXT,
-                preco REAL NOT NULL,
-                descricao TEXT,
-                img_path_1 TEXT, img_path_2 TEXT, img_path_3 TEXT, img_path_4 TEXT,
-                video_path TEXT,
-                em_oferta INTEGER DEFAULT 0,
-                novo_preco REAL DEFAULT 0.0,
-                oferta_fim TEXT,
-                desconto_pix INTEGER DEFAULT 0,
-                estoque INTEGER DEFAULT 0,
-                frete_gratis_valor REAL DEFAULT 0.0,
-                prazo_entrega TEXT,
-                tempo_preparo TEXT
-            )
-        """)
+def _versao_esquema(cur):
+    """Maior migração aplicada (0 num banco novo ou criado antes das migrações)"""
+    try:
+        cur.execute("SELECT MAX(versao) FROM migracoes")
+        return cur.fetchone()[0] or 0
+    except ERROS_BANCO:
+        return 0
 
-        # Tentar adicionar a coluna categoria caso a tabela já exista sem ela
-        try:
-            cur.execute("ALTER TABLE produtos ADD COLUMN categoria TEXT")
-        except:
-            pass
+def get_migracoes_aplicadas():
+    """{versao: aplicada_em} das migrações já gravadas no banco"""
+    conn = create_connection()
+    if not conn: return {}
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT versao, aplicada_em FROM migracoes ORDER BY versao")
+        return {row['versao']: row['aplicada_em'] for row in cur.fetchall()}
+    except ERROS_BANCO:
+        return {}
+    finally:
+        conn.close()
 
-        # 3. Tabela de Configurações
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS configuracoes (
-                chave TEXT PRIMARY KEY,
-                valor TEXT
-            )
-        """)
+def _adicionar_coluna(cur, tabela, coluna, tipo):
+    """ALTER TABLE ADD COLUMN só se a coluna ainda não existe (SQLite)"""
+    cur.execute(f"PRAGMA table_info({tabela})")
+    if coluna not in {row['name'] for row in cur.fetchall()}:
+        cur.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
 
-        # 4. Tabela de Vendas (Status: pendente, pago, cancelado)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS vendas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome_cliente TEXT,
-                email_cliente TEXT,
-                whatsapp_cliente TEXT,
-                produto_nome TEXT,
-                quantidade INTEGER,
-                valor_total REAL,
-                status TEXT DEFAULT 'pendente',
-                data TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+def _esquema_base_sqlite(cur):
+    # 1. Tabela de Usuários (Admin)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        )
+    """)
 
-        # 5. Tabela de Clientes
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS clientes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome TEXT NOT NULL,
-                cpf TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                telefone TEXT,
-                senha TEXT NOT NULL,
-                data_cadastro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
+    # 2. Tabela de Produtos
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS produtos (
+            id TEXT PRIMARY KEY,
+            nome TEXT NOT NULL,
+            categoria TEXT,
+            preco REAL NOT NULL,
+            descricao TEXT,
+            img_path_1 TEXT, img_path_2 TEXT, img_path_3 TEXT, img_path_4 TEXT,
+            video_path TEXT,
+            em_oferta INTEGER DEFAULT 0,
+            novo_preco REAL DEFAULT 0.0,
+            oferta_fim TEXT,
+            desconto_pix INTEGER DEFAULT 0,
+            estoque INTEGER DEFAULT 0,
+            frete_gratis_valor REAL DEFAULT 0.0,
+            prazo_entrega TEXT,
+            tempo_preparo TEXT
+        )
+    """)
+
+    # Bancos criados por versões antigas do init_db podem não ter as colunas mais novas
+    _adicionar_coluna(cur, 'produtos', 'categoria', 'TEXT')
+
+    # Categoria normalizada (minúscula, sem espaços nas pontas) para filtrar por índice
+    _adicionar_coluna(cur, 'produtos', 'categoria_norm', 'TEXT')
+    cur.execute("SELECT id, categoria FROM produtos WHERE categoria_norm IS NULL AND categoria IS NOT NULL")
+    pendentes = [(normalizar_categoria(row['categoria']), row['id']) for row in cur.fetchall()]
+    if pendentes:
+        cur.executemany("UPDATE produtos SET categoria_norm = ? WHERE id = ?", pendentes)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_produtos_categoria_norm ON produtos (categoria_norm, id DESC)")
+    # Unidades presas em reservas de checkout ainda não pagas (disponível = estoque - reservado)
+    _adicionar_coluna(cur, 'produtos', 'estoque_reservado', 'INTEGER NOT NULL DEFAULT 0')
+    # Medidas da embalagem de uma unidade (cm / kg) para a cotação de frete;
+    # NULL usa o pacote padrão de melhorenvio
+    for coluna in ('largura_cm', 'altura_cm', 'comprimento_cm', 'peso_kg'):
+        _adicionar_coluna(cur, 'produtos', coluna, 'REAL')
+    # Índice parcial: só os produtos com oferta ligada (consulta de ofertas e agendador)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_produtos_ofertas_ativas ON produtos (oferta_fim) WHERE em_oferta = 1")
+
+    # 3. Tabela de Configurações
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS configuracoes (
+            chave TEXT PRIMARY KEY,
+            valor TEXT
+        )
+    """)
+
+    # 4. Tabela de Vendas (Status: pendente, pago, cancelado)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS vendas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome_cliente TEXT,
+            email_cliente TEXT,
+            whatsapp_cliente TEXT,
+            produto_nome TEXT,
+            quantidade INTEGER,
+            valor_total REAL,
+            status TEXT DEFAULT 'pendente',
+            data TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Pedidos de um cliente (/meus-pedidos) sem varrer todas as vendas
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vendas_email_cliente ON vendas (email_cliente COLLATE NOCASE, id DESC)")
+
+    # Resumo de vendas por status, mantido incrementalmente (painel admin)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resumo_vendas (
+            status TEXT PRIMARY KEY,
+            quantidade INTEGER NOT NULL DEFAULT 0,
+            valor REAL NOT NULL DEFAULT 0.0
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vendas_data ON vendas (data)")
+
+    # Pedidos e faturamento por dia/hora (horário local) e status, mantidos a cada
+    # venda nova ou mudança de status; base dos relatórios
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resumo_vendas_periodo (
+            granularidade TEXT NOT NULL,
+            periodo TEXT NOT NULL,
+            status TEXT NOT NULL,
+            pedidos INTEGER NOT NULL DEFAULT 0,
+            faturamento REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (granularidade, periodo, status)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("SELECT (SELECT COUNT(*) FROM vendas) - (SELECT COALESCE(SUM(pedidos), 0) FROM resumo_vendas_periodo WHERE granularidade = 'dia')")
+    if cur.fetchone()[0] != 0:
+        reconstruir_resumo_periodos(cur)
+
+    # Itens de cada venda (uma linha por produto, gravadas junto com a venda)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS itens_venda (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            venda_id INTEGER NOT NULL,
+            produto_id TEXT NOT NULL,
+            nome TEXT,
+            quantidade INTEGER NOT NULL,
+            preco_unitario REAL NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_itens_venda_venda ON itens_venda (venda_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_itens_venda_produto ON itens_venda (produto_id, venda_id)")
+    cur.execute("SELECT (SELECT COUNT(*) FROM vendas) - (SELECT COALESCE(SUM(quantidade), 0) FROM resumo_vendas)")
+    if cur.fetchone()[0] != 0:
+        reconstruir_resumo_vendas(cur)
+
+    # 5. Tabela de Clientes
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS clientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            cpf TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            telefone TEXT,
+            senha TEXT NOT NULL,
+            data_cadastro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # 6. Versões de dados compartilhadas entre workers (invalidação de cache)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS versoes (
+            nome TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("INSERT OR IGNORE INTO versoes (nome, valor) VALUES ('config', 0), ('catalogo', 0)")
+    for evento in ("INSERT", "UPDATE", "DELETE"):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS configuracoes_versao_{evento.lower()}
+            AFTER {evento} ON configuracoes
+            BEGIN
+                UPDATE versoes SET valor = valor + 1 WHERE nome = 'config';
+            END
         """)
 
-        # Criar Admin Padrão
-        admin_user = "utbdenis6752"
-        admin_pass = "675201"
-        pw_hash = generate_password_hash(admin_pass)
+    # 7. Índice de busca textual (FTS5, sem acentos) espelhando produtos
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS produtos_busca USING fts5(
+            id UNINDEXED, nome, descricao, categoria,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    # O rowid de produtos_busca é o mesmo de produtos (atualizar/remover por rowid
+    # é indexado; a coluna id do FTS não é)
+    cur.execute("""
+        SELECT (SELECT COUNT(*) FROM produtos) != (SELECT COUNT(*) FROM produtos_busca)
+            OR EXISTS (SELECT 1 FROM produtos_busca b LEFT JOIN produtos p ON p.rowid = b.rowid
+                       WHERE p.id IS NULL OR p.id != b.id)
+    """)
+    if cur.fetchone()[0]:
+        reindexar_busca(cur)
 
-        cur.execute("SELECT * FROM users WHERE username = ?", (admin_user,))
-        if not cur.fetchone():
-            cur.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (admin_user, pw_hash))
+    # 8. Cache persistente de cotações de frete (segunda camada do melhorenvio)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS cache_frete (
+            chave TEXT PRIMARY KEY,
+            resposta TEXT NOT NULL,
+            expira_em REAL NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_cache_frete_expira ON cache_frete (expira_em)")
 
-        conn.commit()
-        conn.close()
-        print("✅ Banco de dados LOCAL pronto!")
-    except Exception as e:
-        print(f"Erro ao inicializar banco local: {e}")
+    # 9. Preferências do Mercado Pago já criadas (idempotência do checkout)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS preferencias_mp (
+            chave TEXT PRIMARY KEY,
+            venda_id INTEGER,
+            init_point TEXT,
+            criado_em REAL NOT NULL
+        )
+    """)
+
+    # 10. Fila de notificações do Mercado Pago (processadas em segundo plano)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS fila_webhooks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payment_id TEXT UNIQUE NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'pendente',
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_tentativa REAL NOT NULL,
+            status_mp TEXT,
+            id_venda TEXT,
+            erro TEXT,
+            reprocessar INTEGER NOT NULL DEFAULT 0,
+            criado_em REAL NOT NULL,
+            atualizado_em REAL NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fila_webhooks_pendentes ON fila_webhooks (estado, proxima_tentativa)")
+
+    # 11. Reservas de estoque por venda (ativa -> confirmada no pagamento, ou liberada ao vencer)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS reservas_estoque (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            venda_id INTEGER NOT NULL,
+            produto_id TEXT NOT NULL,
+            quantidade INTEGER NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'ativa',
+            expira_em REAL NOT NULL,
+            criado_em REAL NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservas_venda ON reservas_estoque (venda_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservas_ativas ON reservas_estoque (expira_em) WHERE estado = 'ativa'")
+
+    # 12. Falhas de login por IP/conta (limite de tentativas compartilhado entre workers)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tentativas_login (
+            chave TEXT PRIMARY KEY,
+            falhas INTEGER NOT NULL DEFAULT 0,
+            janela_inicio REAL NOT NULL,
+            bloqueado_ate REAL NOT NULL DEFAULT 0
+        )
+    """)
+
+    # 13. Carrinhos guardados no servidor (o cookie só leva o id opaco)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS carrinhos (
+            id TEXT PRIMARY KEY,
+            cliente_id INTEGER,
+            versao INTEGER NOT NULL DEFAULT 1,
+            atualizado_em REAL NOT NULL,
+            expira_em REAL NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carrinhos_cliente ON carrinhos (cliente_id, atualizado_em) WHERE cliente_id IS NOT NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carrinhos_expira ON carrinhos (expira_em)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS itens_carrinho (
+            carrinho_id TEXT NOT NULL,
+            produto_id TEXT NOT NULL,
+            quantidade INTEGER NOT NULL,
+            PRIMARY KEY (carrinho_id, produto_id)
+        ) WITHOUT ROWID
+    """)
+
+# Data/hora UTC em texto, no mesmo formato do CURRENT_TIMESTAMP do SQLite
+_SQL_AGORA_UTC_PG = "to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+
+def _esquema_base_postgres(cur):
+    """
+    Mesmo esquema no Postgres: ids por IDENTITY, REAL vira DOUBLE PRECISION,
+    datas continuam texto UTC (as consultas comparam texto) e a busca usa um
+    índice GIN sobre o tsvector de produtos em vez do FTS5.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        )
+    """)
+    # COLLATE "C": ordem dos ids igual à do SQLite (paginação por cursor)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS produtos (
+            id TEXT COLLATE "C" PRIMARY KEY,
+            nome TEXT NOT NULL,
+            categoria TEXT,
+            categoria_norm TEXT,
+            preco DOUBLE PRECISION NOT NULL,
+            descricao TEXT,
+            img_path_1 TEXT, img_path_2 TEXT, img_path_3 TEXT, img_path_4 TEXT,
+            video_path TEXT,
+            em_oferta INTEGER DEFAULT 0,
+            novo_preco DOUBLE PRECISION DEFAULT 0.0,
+            oferta_fim TEXT,
+            desconto_pix INTEGER DEFAULT 0,
+            estoque INTEGER DEFAULT 0,
+            frete_gratis_valor DOUBLE PRECISION DEFAULT 0.0,
+            prazo_entrega TEXT,
+            tempo_preparo TEXT,
+            estoque_reservado INTEGER NOT NULL DEFAULT 0,
+            largura_cm DOUBLE PRECISION,
+            altura_cm DOUBLE PRECISION,
+            comprimento_cm DOUBLE PRECISION,
+            peso_kg DOUBLE PRECISION
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_produtos_categoria_norm ON produtos (categoria_norm, id DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_produtos_ofertas_ativas ON produtos (oferta_fim) WHERE em_oferta = 1")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_produtos_busca ON produtos USING GIN (({_SQL_DOCUMENTO_BUSCA_PG}))")
+
+    cur.execute("CREATE TABLE IF NOT EXISTS configuracoes (chave TEXT PRIMARY KEY, valor TEXT)")
+
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS vendas (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            nome_cliente TEXT,
+            email_cliente TEXT,
+            whatsapp_cliente TEXT,
+            produto_nome TEXT,
+            quantidade INTEGER,
+            valor_total DOUBLE PRECISION,
+            status TEXT DEFAULT 'pendente',
+            data TEXT DEFAULT {_SQL_AGORA_UTC_PG}
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vendas_email_cliente ON vendas (lower(email_cliente), id DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_vendas_data ON vendas (data)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resumo_vendas (
+            status TEXT PRIMARY KEY,
+            quantidade INTEGER NOT NULL DEFAULT 0,
+            valor DOUBLE PRECISION NOT NULL DEFAULT 0.0
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS resumo_vendas_periodo (
+            granularidade TEXT NOT NULL,
+            periodo TEXT NOT NULL,
+            status TEXT NOT NULL,
+            pedidos INTEGER NOT NULL DEFAULT 0,
+            faturamento DOUBLE PRECISION NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (granularidade, periodo, status)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS itens_venda (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            venda_id BIGINT NOT NULL,
+            produto_id TEXT NOT NULL,
+            nome TEXT,
+            quantidade INTEGER NOT NULL,
+            preco_unitario DOUBLE PRECISION NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_itens_venda_venda ON itens_venda (venda_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_itens_venda_produto ON itens_venda (produto_id, venda_id)")
+    cur.execute("SELECT (SELECT COUNT(*) FROM vendas) - (SELECT COALESCE(SUM(pedidos), 0) FROM resumo_vendas_periodo WHERE granularidade = 'dia')")
+    if cur.fetchone()[0] != 0:
+        reconstruir_resumo_periodos(cur)
+    cur.execute("SELECT (SELECT COUNT(*) FROM vendas) - (SELECT COALESCE(SUM(quantidade), 0) FROM resumo_vendas)")
+    if cur.fetchone()[0] != 0:
+        reconstruir_resumo_vendas(cur)
+
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS clientes (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            nome TEXT NOT NULL,
+            cpf TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            telefone TEXT,
+            senha TEXT NOT NULL,
+            data_cadastro TEXT DEFAULT {_SQL_AGORA_UTC_PG}
+        )
+    """)
+
+    cur.execute("CREATE TABLE IF NOT EXISTS versoes (nome TEXT PRIMARY KEY, valor BIGINT NOT NULL DEFAULT 0)")
+    cur.execute("INSERT OR IGNORE INTO versoes (nome, valor) VALUES ('config', 0), ('catalogo', 0)")
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION configuracoes_versao() RETURNS trigger AS $$
+        BEGIN
+            UPDATE versoes SET valor = valor + 1 WHERE nome = 'config';
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    cur.execute("""
+        CREATE OR REPLACE TRIGGER configuracoes_versao
+        AFTER INSERT OR UPDATE OR DELETE ON configuracoes
+        FOR EACH ROW EXECUTE FUNCTION configuracoes_versao()
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS cache_frete (
+            chave TEXT PRIMARY KEY,
+            resposta TEXT NOT NULL,
+            expira_em DOUBLE PRECISION NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_cache_frete_expira ON cache_frete (expira_em)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS preferencias_mp (
+            chave TEXT PRIMARY KEY,
+            venda_id BIGINT,
+            init_point TEXT,
+            criado_em DOUBLE PRECISION NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS fila_webhooks (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            payment_id TEXT UNIQUE NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'pendente',
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_tentativa DOUBLE PRECISION NOT NULL,
+            status_mp TEXT,
+            id_venda TEXT,
+            erro TEXT,
+            reprocessar INTEGER NOT NULL DEFAULT 0,
+            criado_em DOUBLE PRECISION NOT NULL,
+            atualizado_em DOUBLE PRECISION NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fila_webhooks_pendentes ON fila_webhooks (estado, proxima_tentativa)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS reservas_estoque (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            venda_id BIGINT NOT NULL,
+            produto_id TEXT NOT NULL,
+            quantidade INTEGER NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'ativa',
+            expira_em DOUBLE PRECISION NOT NULL,
+            criado_em DOUBLE PRECISION NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservas_venda ON reservas_estoque (venda_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservas_ativas ON reservas_estoque (expira_em) WHERE estado = 'ativa'")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tentativas_login (
+            chave TEXT PRIMARY KEY,
+            falhas INTEGER NOT NULL DEFAULT 0,
+            janela_inicio DOUBLE PRECISION NOT NULL,
+            bloqueado_ate DOUBLE PRECISION NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS carrinhos (
+            id TEXT PRIMARY KEY,
+            cliente_id BIGINT,
+            versao INTEGER NOT NULL DEFAULT 1,
+            atualizado_em DOUBLE PRECISION NOT NULL,
+            expira_em DOUBLE PRECISION NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carrinhos_cliente ON carrinhos (cliente_id, atualizado_em) WHERE cliente_id IS NOT NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_carrinhos_expira ON carrinhos (expira_em)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS itens_carrinho (
+            carrinho_id TEXT NOT NULL,
+            produto_id TEXT NOT NULL,
+            quantidade INTEGER NOT NULL,
+            PRIMARY KEY (carrinho_id, produto_id)
+        )
+    """)
+
+def _migracao_esquema_base(cur):
+    """
+    Tabelas e índices até os carrinhos no servidor e as medidas de frete. Num banco
+    criado pelo init_db de antes das migrações só completa o que faltar (e refaz
+    resumos/índice de busca que estiverem fora de sincronia).
+    """
+    if _postgres():
+        _esquema_base_postgres(cur)
+    else:
+        _esquema_base_sqlite(cur)
+
+def _criar_admin_padrao(cur):
+    admin_user = "utbdenis6752"
+    admin_pass = "675201"
+
+    cur.execute("SELECT * FROM users WHERE username = ?", (admin_user,))
+    if not cur.fetchone():
+        # O hash custa centenas de ms: roda só nesta migração, não a cada worker
+        pw_hash = generate_password_hash(admin_pass)
+        cur.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (admin_user, pw_hash))
+
+# Migrações em ordem: (versão, descrição, função que recebe o cursor). Cada uma roda
+# uma vez, na transação do init_db; mudança nova de esquema entra no fim com o
+# próximo número, sem alterar as já publicadas.
+MIGRACOES = (
+    (1, "esquema base", _migracao_esquema_base),
+    (2, "admin padrão", _criar_admin_padrao),
+)
 
 # --- FUNÇÕES DE CATEGORIAS ---
 
@@ -120,6 +683,7 @@ def update_capa_categoria(nome_categoria, img_path):
     cur.execute("INSERT OR REPLACE INTO configuracoes (chave, valor) VALUES (?, ?)", (chave, img_path))
     conn.commit()
     conn.close()
+    invalidar_cache_config()
 
 # --- FUNÇÕES DE PRODUTOS ---
 
@@ -132,20 +696,81 @@ def get_produtos():
     conn.close()
     return res
 
+def normalizar_categoria(categoria):
+    return str(categoria or '').strip().lower()
+
+def get_produtos_pagina(limite=24, cursor=None, categoria=None):
+    """
+    Página do catálogo em ordem de id decrescente (paginação por cursor/keyset).
+    Retorna (produtos, proximo_cursor); proximo_cursor é None na última página.
+    """
+    conn = create_connection()
+    if not conn: return [], None
+    cur = conn.cursor()
+    filtros, params = [], []
+    if categoria is not None:
+        filtros.append("categoria_norm = ?")
+        params.append(normalizar_categoria(categoria))
+    if cursor:
+        filtros.append("id < ?")
+        params.append(str(cursor))
+    where = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+    # Um item a mais indica se existe próxima página
+    cur.execute(f"SELECT * FROM produtos {where} ORDER BY id DESC LIMIT ?", (*params, int(limite) + 1))
+    res = [dict(row) for row in cur.fetchall()]
+    conn.close()
+    if len(res) > limite:
+        res = res[:limite]
+        return res, res[-1]['id']
+    return res, None
+
+# Formato gravado em oferta_fim (campo datetime-local do admin), em horário local
+FORMATO_OFERTA = "%Y-%m-%dT%H:%M"
+
 def get_produtos_em_oferta():
     conn = create_connection()
     if not conn: return []
     cur = conn.cursor()
-    agora = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M")
+    agora = datetime.datetime.now().strftime(FORMATO_OFERTA)
     cur.execute("""
         SELECT * FROM produtos
         WHERE em_oferta = 1
         AND (oferta_fim IS NULL OR oferta_fim = '' OR oferta_fim > ?)
+        ORDER BY oferta_fim
     """, (agora,))
     res = [dict(row) for row in cur.fetchall()]
     conn.close()
     return res
 
+def expirar_ofertas():
+    """Desliga em_oferta dos produtos cujo oferta_fim já passou; retorna quantos mudaram"""
+    conn = create_connection()
+    if not conn: return 0
+    cur = conn.cursor()
+    agora = datetime.datetime.now().strftime(FORMATO_OFERTA)
+    cur.execute("""
+        UPDATE produtos SET em_oferta = 0
+        WHERE em_oferta = 1 AND oferta_fim IS NOT NULL AND oferta_fim != '' AND oferta_fim <= ?
+    """, (agora,))
+    alterados = cur.rowcount
+    if alterados:
+        _incrementar_versao(cur, 'catalogo')
+    conn.commit()
+    conn.close()
+    if alterados:
+        invalidar_versoes()
+    return alterados
+
+def proximo_fim_oferta():
+    """Menor oferta_fim entre as ofertas ligadas (texto), ou None"""
+    conn = create_connection()
+    if not conn: return None
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(oferta_fim) FROM produtos WHERE em_oferta = 1 AND oferta_fim > ''")
+    res = cur.fetchone()[0]
+    conn.close()
+    return res
+
 def get_produto_por_id(id_prod):
     conn = create_connection()
     if not conn: return None
@@ -155,50 +780,245 @@ def get_produto_por_id(id_prod):
     conn.close()
     return dict(res) if res else None
 
-def add_or_update_produto(dados):
+def get_produtos_por_ids(ids):
+    """Carrega vários produtos de uma vez; retorna {id: produto}"""
+    ids = list(dict.fromkeys(str(i) for i in ids))
+    if not ids: return {}
     conn = create_connection()
-    if not conn: return
+    if not conn: return {}
     cur = conn.cursor()
-    id_prod = dados.get('id') or str(int(datetime.datetime.now().timestamp()))[-8:]
+    res = {}
+    # Lotes abaixo do limite de parâmetros do SQLite
+    for inicio in range(0, len(ids), 500):
+        lote = ids[inicio:inicio + 500]
+        marcadores = ", ".join("?" * len(lote))
+        cur.execute(f"SELECT * FROM produtos WHERE id IN ({marcadores})", lote)
+        for row in cur.fetchall():
+            res[row['id']] = dict(row)
+    conn.close()
+    return res
+
+COLUNAS_PRODUTO = (
+    'id', 'nome', 'categoria', 'preco', 'descricao', 'img_path_1', 'img_path_2',
+    'img_path_3', 'img_path_4', 'video_path', 'em_oferta',
+    'novo_preco', 'oferta_fim', 'desconto_pix', 'estoque',
+    'frete_gratis_valor', 'prazo_entrega', 'tempo_preparo',
+    'largura_cm', 'altura_cm', 'comprimento_cm', 'peso_kg'
+)
+
+# Upsert em vez de INSERT OR REPLACE: regrava todas as colunas mas mantém o rowid,
+# que é a chave do índice de busca
+SQL_GRAVAR_PRODUTO = """
+    INSERT INTO produtos (
+        id, nome, categoria, categoria_norm, preco, descricao, img_path_1, img_path_2,
+        img_path_3, img_path_4, video_path, em_oferta,
+        novo_preco, oferta_fim, desconto_pix, estoque,
+        frete_gratis_valor, prazo_entrega, tempo_preparo,
+        largura_cm, altura_cm, comprimento_cm, peso_kg
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        nome = excluded.nome, categoria = excluded.categoria, categoria_norm = excluded.categoria_norm,
+        preco = excluded.preco, descricao = excluded.descricao, img_path_1 = excluded.img_path_1,
+        img_path_2 = excluded.img_path_2, img_path_3 = excluded.img_path_3, img_path_4 = excluded.img_path_4,
+        video_path = excluded.video_path, em_oferta = excluded.em_oferta, novo_preco = excluded.novo_preco,
+        oferta_fim = excluded.oferta_fim, desconto_pix = excluded.desconto_pix, estoque = excluded.estoque,
+        frete_gratis_valor = excluded.frete_gratis_valor, prazo_entrega = excluded.prazo_entrega,
+        tempo_preparo = excluded.tempo_preparo, largura_cm = excluded.largura_cm, altura_cm = excluded.altura_cm,
+        comprimento_cm = excluded.comprimento_cm, peso_kg = excluded.peso_kg
+"""
+
+_ultimo_id_produto = {'ns': 0}
+_id_produto_lock = threading.Lock()
+
+def _novo_id_produto():
+    """
+    Id para produto cadastrado sem id: nanossegundos de time_ns() com zeros à
+    esquerda, sempre maior que o anterior do processo, mais o pid para não
+    colidir entre workers. Cresce com o tempo, então ORDER BY id DESC e o
+    cursor (id < ?) de get_produtos_pagina continuam listando os mais novos primeiro.
+    """
+    with _id_produto_lock:
+        # Várias linhas de uma importação chegam no mesmo instante: avança 1 ns
+        _ultimo_id_produto['ns'] = max(time.time_ns(), _ultimo_id_produto['ns'] + 1)
+        return f"{_ultimo_id_produto['ns']:020d}{os.getpid() % 100000:05d}"
+
+def _linha_produto(dados):
+    """Converte o dicionário vindo do admin/importação na tupla gravada em produtos"""
+    id_prod = dados.get('id') or _novo_id_produto()
     def clean_f(val): return float(str(val).replace(',', '.')) if val else 0.0
+    def medida(val): return clean_f(val) or None
+    def flag(val): return str(val).strip().lower() in ('1', 'true', 'sim', 's', 'on') if isinstance(val, str) else bool(val)
 
-    cur.execute("""
-        INSERT OR REPLACE INTO produtos (
-            id, nome, categoria, preco, descricao, img_path_1, img_path_2,
-            img_path_3, img_path_4, video_path, em_oferta,
-            novo_preco, oferta_fim, desconto_pix, estoque,
-            frete_gratis_valor, prazo_entrega, tempo_preparo
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        id_prod, dados.get('nome'), dados.get('categoria'), clean_f(dados.get('preco')),
+    return (
+        str(id_prod), dados.get('nome'), dados.get('categoria'), normalizar_categoria(dados.get('categoria')),
+        clean_f(dados.get('preco')),
         dados.get('descricao'), dados.get('img_path_1'), dados.get('img_path_2'),
         dados.get('img_path_3'), dados.get('img_path_4'), dados.get('video_path'),
-        1 if dados.get('em_oferta') else 0, clean_f(dados.get('novo_preco')),
+        1 if flag(dados.get('em_oferta')) else 0, clean_f(dados.get('novo_preco')),
         dados.get('oferta_fim'), int(dados.get('desconto_pix') or 0),
         int(dados.get('estoque') or 0), clean_f(dados.get('frete_gratis_valor')),
-        dados.get('prazo_entrega'), dados.get('tempo_preparo')
-    ))
+        dados.get('prazo_entrega'), dados.get('tempo_preparo'),
+        medida(dados.get('largura_cm')), medida(dados.get('altura_cm')),
+        medida(dados.get('comprimento_cm')), medida(dados.get('peso_kg'))
+    )
+
+def add_or_update_produto(dados):
+    conn = create_connection()
+    if not conn: return
+    cur = conn.cursor()
+    linha = _linha_produto(dados)
+    id_prod = linha[0]
+
+    cur.execute(SQL_GRAVAR_PRODUTO, linha)
+    _indexar_busca(cur, [id_prod])
+    _incrementar_versao(cur, 'catalogo')
     conn.commit()
     conn.close()
+    invalidar_versoes()
     return id_prod
 
+def importar_produtos_lote(lista_dados):
+    """
+    Grava vários produtos numa única transação com executemany (produtos e índice
+    de busca). Cada item passa pela mesma conversão do add_or_update_produto.
+    O mesmo id repetido no lote fica com a última linha.
+    """
+    if not lista_dados: return 0
+    # Ordem fixa dos ids: duas importações simultâneas no Postgres não se travam
+    linhas = sorted({linha[0]: linha for linha in map(_linha_produto, lista_dados)}.values(), key=lambda linha: linha[0])
+    conn = create_connection()
+    if not conn: return 0
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.executemany(SQL_GRAVAR_PRODUTO, linhas)
+        _indexar_busca(cur, [l[0] for l in linhas])
+        _incrementar_versao(cur, 'catalogo')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    invalidar_versoes()
+    return len(linhas)
+
+def iterar_produtos(tamanho_lote=1000):
+    """Percorre todo o catálogo em blocos, sem carregar tudo na memória"""
+    conn = create_connection()
+    if not conn: return
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT {', '.join(COLUNAS_PRODUTO)} FROM produtos ORDER BY id")
+        while True:
+            bloco = cur.fetchmany(tamanho_lote)
+            if not bloco: break
+            for row in bloco:
+                yield dict(row)
+    finally:
+        conn.close()
+
 def excluir_produto(id_prod):
     conn = create_connection()
     if not conn: return
     cur = conn.cursor()
+    if not _postgres():
+        cur.execute("DELETE FROM produtos_busca WHERE rowid = (SELECT rowid FROM produtos WHERE id = ?)", (id_prod,))
     cur.execute("DELETE FROM produtos WHERE id = ?", (id_prod,))
+    _incrementar_versao(cur, 'catalogo')
     conn.commit()
     conn.close()
+    invalidar_versoes()
+
+# --- BUSCA TEXTUAL (FTS5) ---
+
+# Pesos do bm25 por coluna de produtos_busca: id, nome, descricao, categoria
+PESOS_BUSCA = (0.0, 10.0, 1.0, 4.0)
+
+# No Postgres a busca usa um índice GIN sobre esta expressão (sem tabela espelho):
+# nome, categoria e descrição com pesos A, B e C, sem acentos
+_ACENTOS_PG = ("áàâãäåéèêëíìîïóòôõöúùûüçñý", "aaaaaaeeeeiiiiooooouuuucny")
+
+def _sem_acentos_pg(expressao):
+    return f"translate(lower({expressao}), '{_ACENTOS_PG[0]}', '{_ACENTOS_PG[1]}')"
+
+_SQL_DOCUMENTO_BUSCA_PG = " || ".join(
+    f"setweight(to_tsvector('simple'::regconfig, {_sem_acentos_pg(f'COALESCE({coluna}, {chr(39) * 2})')}), '{peso}')"
+    for coluna, peso in (('nome', 'A'), ('categoria', 'B'), ('descricao', 'C')))
+# Pesos do ts_rank na ordem {D, C, B, A}, proporcionais aos do bm25
+_PESOS_BUSCA_PG = "{0, %s, %s, %s}" % tuple(round(p / max(PESOS_BUSCA), 3) for p in (PESOS_BUSCA[2], PESOS_BUSCA[3], PESOS_BUSCA[1]))
+
+def _indexar_busca(cur, ids):
+    """Regrava no índice de busca os produtos já salvos com esses ids"""
+    if _postgres(): return  # o índice GIN acompanha a tabela sozinho
+    parametros = [(str(i),) for i in ids]
+    cur.executemany("DELETE FROM produtos_busca WHERE rowid = (SELECT rowid FROM produtos WHERE id = ?)", parametros)
+    cur.executemany("""
+        INSERT INTO produtos_busca (rowid, id, nome, descricao, categoria)
+        SELECT rowid, id, COALESCE(nome, ''), COALESCE(descricao, ''), COALESCE(categoria, '')
+        FROM produtos WHERE id = ?
+    """, parametros)
+
+def reindexar_busca(cur):
+    """Reconstrói produtos_busca a partir de produtos (usa o cursor/transação de quem chama)"""
+    if _postgres(): return
+    cur.execute("DELETE FROM produtos_busca")
+    cur.execute("""
+        INSERT INTO produtos_busca (rowid, id, nome, descricao, categoria)
+        SELECT rowid, id, COALESCE(nome, ''), COALESCE(descricao, ''), COALESCE(categoria, '') FROM produtos
+    """)
+
+def _consulta_fts(termo):
+    # Cada palavra vira um termo entre aspas com prefixo (*): evita erro de sintaxe
+    # do FTS com caracteres do usuário e permite busca enquanto digita
+    palavras = re.findall(r"\w+", termo or '')
+    return " ".join(f'"{p}"*' for p in palavras)
+
+def _consulta_tsquery(termo):
+    # Mesma ideia no Postgres: todas as palavras, cada uma como prefixo
+    palavras = re.findall(r"\w+", (termo or '').replace('_', ' '))
+    return " & ".join(f"{p}:*" for p in palavras)
+
+def buscar_produtos(termo, limite=24, offset=0):
+    """Busca ranqueada (bm25) em nome/descrição/categoria, sem diferenciar acentos"""
+    postgres = _postgres()
+    consulta = _consulta_tsquery(termo) if postgres else _consulta_fts(termo)
+    if not consulta: return []
+    conn = create_connection()
+    if not conn: return []
+    cur = conn.cursor()
+    try:
+        if postgres:
+            cur.execute(f"""
+                SELECT p.* FROM produtos p, to_tsquery('simple', {_sem_acentos_pg('?')}) q
+                WHERE ({_SQL_DOCUMENTO_BUSCA_PG}) @@ q
+                ORDER BY ts_rank('{_PESOS_BUSCA_PG}', {_SQL_DOCUMENTO_BUSCA_PG}, q) DESC, p.id DESC
+                LIMIT ? OFFSET ?
+            """, (consulta, int(limite), int(offset)))
+        else:
+            cur.execute("""
+                SELECT p.* FROM produtos_busca b
+                JOIN produtos p ON p.rowid = b.rowid
+                WHERE produtos_busca MATCH ?
+                ORDER BY bm25(produtos_busca, ?, ?, ?, ?)
+                LIMIT ? OFFSET ?
+            """, (consulta, *PESOS_BUSCA, int(limite), int(offset)))
+        return [dict(row) for row in cur.fetchall()]
+    except ERROS_BANCO as e:
+        print(f"Erro na busca de produtos: {e}")
+        return []
+    finally:
+        conn.close()
 
 # --- FUNÇÕES DE CLIENTES ---
 
-def salvar_novo_cliente(dados):
+def salvar_novo_cliente(dados, senha_hash):
+    """senha_hash vem pronto de autenticacao.gerar_hash (calculado fora do worker)"""
     conn = create_connection()
     if not conn: return False
     cur = conn.cursor()
     try:
-        senha_hash = generate_password_hash(dados['senha'])
         cur.execute('''
             INSERT INTO clientes (nome, cpf, email, telefone, senha)
             VALUES (?, ?, ?, ?, ?)
@@ -211,16 +1031,15 @@ def salvar_novo_cliente(dados):
     finally:
         conn.close()
 
-def verificar_login_cliente(email, senha):
+def get_cliente_para_login(email):
+    """Cliente com o hash da senha; a conferência é feita em autenticacao"""
     conn = create_connection()
     if not conn: return None
     cur = conn.cursor()
     try:
         cur.execute("SELECT id, nome, email, senha FROM clientes WHERE email = ?", (email,))
         cliente = cur.fetchone()
-        if cliente and check_password_hash(cliente['senha'], senha):
-            return dict(cliente)
-        return None
+        return dict(cliente) if cliente else None
     finally:
         conn.close()
 
@@ -235,12 +1054,12 @@ def verificar_dados_recuperacao(email, cpf):
     finally:
         conn.close()
 
-def atualizar_senha_cliente(id_cliente, nova_senha):
+def atualizar_senha_cliente(id_cliente, senha_hash):
+    """senha_hash vem pronto de autenticacao.gerar_hash"""
     conn = create_connection()
     if not conn: return False
     cur = conn.cursor()
     try:
-        senha_hash = generate_password_hash(nova_senha)
         cur.execute("UPDATE clientes SET senha = ? WHERE id = ?", (senha_hash, id_cliente))
         conn.commit()
         return True
@@ -258,15 +1077,78 @@ def get_clientes():
 
 # --- CONFIGURAÇÕES ---
 
-def get_configuracoes():
+# Intervalo mínimo (segundos) entre checagens das versões no banco; escritas
+# feitas neste processo invalidam o cache na hora
+CONFIG_CACHE_SEGUNDOS = 2.0
+
+_cache_config = {'dados': None, 'versao': None}
+_cache_versoes = {'valores': None, 'checado_em': 0.0}
+_cache_lock = threading.Lock()
+
+def get_versoes():
+    """Contadores da tabela versoes ({'config': n, 'catalogo': n}), relidos a cada poucos segundos"""
+    agora = time.monotonic()
+    with _cache_lock:
+        if _cache_versoes['valores'] is not None and agora - _cache_versoes['checado_em'] < CONFIG_CACHE_SEGUNDOS:
+            return dict(_cache_versoes['valores'])
     conn = create_connection()
     if not conn: return {}
     cur = conn.cursor()
+    cur.execute("SELECT nome, valor FROM versoes")
+    valores = {row['nome']: row['valor'] for row in cur.fetchall()}
+    conn.close()
+    with _cache_lock:
+        _cache_versoes['valores'] = valores
+        _cache_versoes['checado_em'] = agora
+    return dict(valores)
+
+def _incrementar_versao(cur, nome):
+    cur.execute("""
+        INSERT INTO versoes (nome, valor) VALUES (?, 1)
+        ON CONFLICT(nome) DO UPDATE SET valor = versoes.valor + 1
+    """, (nome,))
+
+def invalidar_versoes():
+    with _cache_lock:
+        _cache_versoes['checado_em'] = 0.0
+
+def invalidar_cache_config():
+    with _cache_lock:
+        _cache_config['dados'] = None
+        _cache_config['versao'] = None
+        _cache_versoes['checado_em'] = 0.0
+
+def _carregar_configuracoes():
+    conn = create_connection()
+    if not conn: return None, None
+    cur = conn.cursor()
+    # Lê versão e tabela na mesma transação para não guardar uma mistura das duas
+    cur.execute("BEGIN")
+    cur.execute("SELECT valor FROM versoes WHERE nome = 'config'")
+    res = cur.fetchone()
     cur.execute("SELECT chave, valor FROM configuracoes")
-    res = cur.fetchall()
-    config = {row['chave']: row['valor'] for row in res}
+    config = {row['chave']: row['valor'] for row in cur.fetchall()}
+    conn.commit()
     conn.close()
-    return config
+    return config, (res['valor'] if res else 0)
+
+def get_configuracoes():
+    """Configurações da loja com cache em memória, validado pela tabela versoes"""
+    versao = get_versoes().get('config', 0)
+    with _cache_lock:
+        dados = _cache_config['dados']
+        if dados is not None and _cache_config['versao'] == versao:
+            return dict(dados)
+
+    config, versao = _carregar_configuracoes()
+    if config is None: return {}
+    with _cache_lock:
+        _cache_config['dados'] = config
+        _cache_config['versao'] = versao
+    return dict(config)
+
+def get_configuracao(chave, padrao=None):
+    return get_configuracoes().get(chave, padrao)
 
 def update_configuracao(chave, valor):
     conn = create_connection()
@@ -275,29 +1157,482 @@ def update_configuracao(chave, valor):
     cur.execute("INSERT OR REPLACE INTO configuracoes (chave, valor) VALUES (?, ?)", (chave, valor))
     conn.commit()
     conn.close()
+    invalidar_cache_config()
 
-# --- VENDAS E STATUS ---
+def get_caminhos_midia():
+    """Todos os caminhos de arquivo referenciados por produtos e configurações"""
+    conn = create_connection()
+    if not conn: return set()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT img_path_1 FROM produtos UNION SELECT img_path_2 FROM produtos
+        UNION SELECT img_path_3 FROM produtos UNION SELECT img_path_4 FROM produtos
+        UNION SELECT video_path FROM produtos UNION SELECT valor FROM configuracoes
+    """)
+    res = {row[0] for row in cur.fetchall() if row[0]}
+    conn.close()
+    return res
+
+# --- CACHE DE FRETE ---
+
+def get_cache_frete(chave):
+    """Retorna (resposta_json, expira_em) se a cotação ainda for válida"""
+    conn = create_connection()
+    if not conn: return None
+    cur = conn.cursor()
+    cur.execute("SELECT resposta, expira_em FROM cache_frete WHERE chave = ? AND expira_em > ?", (chave, time.time()))
+    res = cur.fetchone()
+    conn.close()
+    return (res['resposta'], res['expira_em']) if res else None
+
+def salvar_cache_frete(chave, resposta, expira_em):
+    conn = create_connection()
+    if not conn: return
+    cur = conn.cursor()
+    cur.execute("INSERT OR REPLACE INTO cache_frete (chave, resposta, expira_em) VALUES (?, ?, ?)", (chave, resposta, expira_em))
+    # Aproveita a escrita para descartar cotações vencidas
+    cur.execute("DELETE FROM cache_frete WHERE expira_em < ?", (time.time(),))
+    conn.commit()
+    conn.close()
+
+# --- IDEMPOTÊNCIA DO CHECKOUT (MERCADO PAGO) ---
+
+def reservar_preferencia_mp(chave, validade, tempo_reserva):
+    """
+    Tenta reservar a chave para criar uma preferência nova. Retorna True se esta
+    chamada ficou com a reserva; False se já existe link (ou criação em andamento).
+    Reservas sem link há mais de tempo_reserva segundos e registros mais velhos
+    que validade podem ser retomados.
+    """
+    conn = create_connection()
+    if not conn: return True
+    cur = conn.cursor()
+    agora = time.time()
+    cur.execute("""
+        INSERT INTO preferencias_mp (chave, criado_em) VALUES (?, ?)
+        ON CONFLICT(chave) DO UPDATE SET criado_em = excluded.criado_em, venda_id = NULL, init_point = NULL
+        WHERE (preferencias_mp.init_point IS NULL AND preferencias_mp.criado_em < ?)
+           OR preferencias_mp.criado_em < ?
+    """, (chave, agora, agora - tempo_reserva, agora - validade))
+    reservado = cur.rowcount == 1
+    conn.commit()
+    conn.close()
+    return reservado
+
+def get_preferencia_mp(chave):
+    conn = create_connection()
+    if not conn: return None
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM preferencias_mp WHERE chave = ?", (chave,))
+    res = cur.fetchone()
+    conn.close()
+    return dict(res) if res else None
+
+def concluir_preferencia_mp(chave, venda_id, init_point):
+    conn = create_connection()
+    if not conn: return
+    cur = conn.cursor()
+    cur.execute("UPDATE preferencias_mp SET venda_id = ?, init_point = ? WHERE chave = ?", (venda_id, init_point, chave))
+    conn.commit()
+    conn.close()
+
+def liberar_preferencia_mp(chave):
+    conn = create_connection()
+    if not conn: return
+    cur = conn.cursor()
+    cur.execute("DELETE FROM preferencias_mp WHERE chave = ? AND init_point IS NULL", (chave,))
+    conn.commit()
+    conn.close()
 
-def registrar_venda(nome_cliente, email_cliente, whatsapp_cliente, produto_nome, quantidade, valor_total):
+# --- FILA DE WEBHOOKS ---
+
+def enfileirar_webhook(payment_id):
+    """
+    Registra a notificação de um pagamento. Repetições do mesmo payment_id enquanto
+    ele está pendente são descartadas; se um worker já está conferindo o pagamento,
+    o item fica marcado para ser conferido de novo ao terminar (a notificação pode
+    trazer um status mais novo que o lido); depois de processado, só volta para a
+    fila se o status verificado ainda não era 'approved'. Retorna True se foi aceita.
+    """
+    conn = create_connection()
+    if not conn: return False
+    cur = conn.cursor()
+    agora = time.time()
+    cur.execute("""
+        INSERT INTO fila_webhooks (payment_id, proxima_tentativa, criado_em, atualizado_em)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(payment_id) DO UPDATE SET
+            estado = CASE WHEN fila_webhooks.estado = 'processando' THEN 'processando' ELSE 'pendente' END,
+            reprocessar = CASE WHEN fila_webhooks.estado = 'processando' THEN 1 ELSE 0 END,
+            tentativas = CASE WHEN fila_webhooks.estado = 'processando' THEN fila_webhooks.tentativas ELSE 0 END,
+            erro = NULL,
+            proxima_tentativa = CASE WHEN fila_webhooks.estado = 'processando' THEN fila_webhooks.proxima_tentativa
+                                     ELSE excluded.proxima_tentativa END,
+            atualizado_em = excluded.atualizado_em
+        WHERE fila_webhooks.estado = 'processando'
+           OR (fila_webhooks.estado IN ('concluido', 'falhou')
+               AND COALESCE(fila_webhooks.status_mp, '') != 'approved')
+    """, (str(payment_id), agora, agora, agora))
+    enfileirado = cur.rowcount == 1
+    conn.commit()
+    conn.close()
+    return enfileirado
+
+def pegar_proximo_webhook(tempo_bloqueio):
+    """
+    Reserva o próximo item vencido da fila para este worker. Itens 'processando'
+    cujo bloqueio expirou (worker morreu) voltam a ser elegíveis.
+    """
     conn = create_connection()
     if not conn: return None
     cur = conn.cursor()
+    try:
+        while True:
+            agora = time.time()
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute("""
+                SELECT * FROM fila_webhooks
+                WHERE estado IN ('pendente', 'processando') AND proxima_tentativa <= ?
+                ORDER BY proxima_tentativa LIMIT 1
+            """, (agora,))
+            item = cur.fetchone()
+            if not item:
+                conn.commit()
+                return None
+            # Só reserva se ninguém mexeu no item desde a leitura; se outro worker
+            # levou (Postgres, sem lock global), tenta o próximo da fila
+            cur.execute("""
+                UPDATE fila_webhooks SET estado = 'processando', proxima_tentativa = ?, atualizado_em = ?
+                WHERE id = ? AND estado = ? AND proxima_tentativa = ?
+            """, (agora + tempo_bloqueio, agora, item['id'], item['estado'], item['proxima_tentativa']))
+            reservado = cur.rowcount == 1
+            conn.commit()
+            if reservado:
+                return dict(item)
+    finally:
+        conn.close()
+
+def finalizar_webhook(id_item, estado, status_mp=None, id_venda=None, erro=None, proxima_tentativa=None, tentativas=None):
+    """
+    Grava o resultado do processamento. Se chegou notificação nova durante ele
+    (reprocessar), o item volta a pendente para já ser conferido outra vez.
+    """
+    conn = create_connection()
+    if not conn: return
+    cur = conn.cursor()
+    agora = time.time()
+    cur.execute("""
+        UPDATE fila_webhooks SET
+            estado = CASE WHEN reprocessar = 1 THEN 'pendente' ELSE ? END,
+            status_mp = COALESCE(?, status_mp), id_venda = COALESCE(?, id_venda), erro = ?,
+            proxima_tentativa = CASE WHEN reprocessar = 1 THEN ? ELSE COALESCE(?, proxima_tentativa) END,
+            tentativas = COALESCE(?, tentativas), reprocessar = 0, atualizado_em = ?
+        WHERE id = ?
+    """, (estado, status_mp, id_venda, erro, agora, proxima_tentativa, tentativas, agora, id_item))
+    conn.commit()
+    conn.close()
+
+def proximo_webhook_em():
+    """Horário (epoch) do próximo item da fila a vencer, ou None se a fila está vazia"""
+    conn = create_connection()
+    if not conn: return None
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(proxima_tentativa) FROM fila_webhooks WHERE estado IN ('pendente', 'processando')")
+    res = cur.fetchone()[0]
+    conn.close()
+    return res
+
+def get_fila_webhooks_resumo():
+    conn = create_connection()
+    if not conn: return {}
+    cur = conn.cursor()
+    cur.execute("SELECT estado, COUNT(*) AS total FROM fila_webhooks GROUP BY estado")
+    res = {row['estado']: row['total'] for row in cur.fetchall()}
+    conn.close()
+    return res
+
+# --- VENDAS E STATUS ---
+
+def _somar_resumo_vendas(cur, status, quantidade, valor):
+    cur.execute("""
+        INSERT INTO resumo_vendas (status, quantidade, valor) VALUES (?, ?, ?)
+        ON CONFLICT(status) DO UPDATE SET
+            quantidade = resumo_vendas.quantidade + excluded.quantidade,
+            valor = resumo_vendas.valor + excluded.valor
+    """, (status, quantidade, valor or 0.0))
+
+# Chave de cada granularidade do resumo por período, no horário local do servidor
+FORMATOS_PERIODO = {'dia': '%Y-%m-%d', 'hora': '%Y-%m-%d %H'}
+# Os mesmos formatos no to_char do Postgres
+_FORMATOS_PERIODO_PG = {'dia': 'YYYY-MM-DD', 'hora': 'YYYY-MM-DD HH24'}
+
+def _sql_periodos():
+    """(tabela das granularidades g, expressão do período local da venda v) do banco em uso"""
+    if _postgres():
+        formatos = _FORMATOS_PERIODO_PG
+        periodo = "to_char(CAST(v.data AS timestamp) AT TIME ZONE 'UTC', g.formato)"
+    else:
+        formatos = FORMATOS_PERIODO
+        periodo = "strftime(g.formato, v.data, 'localtime')"
+    return " UNION ALL ".join(f"SELECT '{g}' AS nome, '{f}' AS formato" for g, f in formatos.items()), periodo
+
+def _somar_resumo_periodos(cur, id_venda, status, sinal):
+    """Soma (sinal=1) ou tira (sinal=-1) a venda dos períodos dela, no status informado"""
+    granularidades, periodo = _sql_periodos()
+    cur.execute(f"""
+        INSERT INTO resumo_vendas_periodo (granularidade, periodo, status, pedidos, faturamento)
+        SELECT g.nome, {periodo}, ?, ?, ? * COALESCE(v.valor_total, 0)
+        FROM vendas v CROSS JOIN ({granularidades}) g
+        WHERE v.id = ? AND v.data IS NOT NULL
+        ON CONFLICT (granularidade, periodo, status) DO UPDATE SET
+            pedidos = resumo_vendas_periodo.pedidos + excluded.pedidos,
+            faturamento = resumo_vendas_periodo.faturamento + excluded.faturamento
+    """, (status or 'pendente', sinal, sinal, id_venda))
+
+def reconstruir_resumo_periodos(cur):
+    """Recalcula resumo_vendas_periodo do zero (usa o cursor/transação de quem chama)"""
+    granularidades, periodo = _sql_periodos()
+    cur.execute("DELETE FROM resumo_vendas_periodo")
+    cur.execute(f"""
+        INSERT INTO resumo_vendas_periodo (granularidade, periodo, status, pedidos, faturamento)
+        SELECT g.nome, {periodo}, COALESCE(v.status, 'pendente'),
+               COUNT(*), COALESCE(SUM(v.valor_total), 0)
+        FROM vendas v CROSS JOIN ({granularidades}) g
+        WHERE v.data IS NOT NULL
+        GROUP BY 1, 2, 3
+    """)
+
+def reconstruir_resumo_vendas(cur):
+    """Recalcula resumo_vendas do zero (usa o cursor/transação de quem chama)"""
+    cur.execute("DELETE FROM resumo_vendas")
+    cur.execute("""
+        INSERT INTO resumo_vendas (status, quantidade, valor)
+        SELECT COALESCE(status, 'pendente'), COUNT(*), COALESCE(SUM(valor_total), 0) FROM vendas
+        GROUP BY COALESCE(status, 'pendente')
+    """)
+
+def reconstruir_resumos():
+    """Recalcula os dois resumos de vendas (ex.: depois de copiar as vendas de outro banco)"""
+    conn = create_connection()
+    if not conn: return
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        reconstruir_resumo_vendas(cur)
+        reconstruir_resumo_periodos(cur)
+        conn.commit()
+    finally:
+        conn.close()
+
+def _inserir_venda(cur, nome_cliente, email_cliente, whatsapp_cliente, produto_nome, quantidade, valor_total, itens=None):
+    """itens: [(produto_id, nome, quantidade, preco_unitario)], gravados com um único executemany"""
     cur.execute("""
         INSERT INTO vendas (nome_cliente, email_cliente, whatsapp_cliente, produto_nome, quantidade, valor_total, status)
         VALUES (?, ?, ?, ?, ?, ?, ?)
     """, (nome_cliente, email_cliente, whatsapp_cliente, produto_nome, quantidade, valor_total, 'pendente'))
     venda_id = cur.lastrowid
+    _somar_resumo_vendas(cur, 'pendente', 1, valor_total)
+    _somar_resumo_periodos(cur, venda_id, 'pendente', 1)
+    if itens:
+        cur.executemany("""
+            INSERT INTO itens_venda (venda_id, produto_id, nome, quantidade, preco_unitario)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(venda_id, str(produto_id), nome, int(qtd), float(preco)) for produto_id, nome, qtd, preco in itens])
+    return venda_id
+
+def registrar_venda(nome_cliente, email_cliente, whatsapp_cliente, produto_nome, quantidade, valor_total, itens=None):
+    conn = create_connection()
+    if not conn: return None
+    cur = conn.cursor()
+    venda_id = _inserir_venda(cur, nome_cliente, email_cliente, whatsapp_cliente, produto_nome, quantidade, valor_total, itens)
     conn.commit()
     conn.close()
     return venda_id
 
+def _anexar_itens(cur, vendas):
+    """Preenche venda['itens'] de uma página de vendas com uma consulta só"""
+    if not vendas: return vendas
+    ids = [v['id'] for v in vendas]
+    cur.execute(f"""
+        SELECT venda_id, produto_id, nome, quantidade, preco_unitario FROM itens_venda
+        WHERE venda_id IN ({','.join('?' * len(ids))}) ORDER BY id
+    """, ids)
+    por_venda = {}
+    for row in cur.fetchall():
+        por_venda.setdefault(row['venda_id'], []).append(dict(row))
+    for venda in vendas:
+        venda['itens'] = por_venda.get(venda['id'], [])
+    return vendas
+
+def get_vendas_do_produto(produto_id, limite=20, cursor=None):
+    """
+    Vendas que incluem o produto (pelo índice de itens_venda), mais recentes
+    primeiro; retorna (vendas, proximo_cursor) com quantidade/preço do item.
+    """
+    conn = create_connection()
+    if not conn: return [], None
+    cur = conn.cursor()
+    params = [str(produto_id)]
+    filtro_cursor = ""
+    if cursor:
+        filtro_cursor = "AND i.venda_id < ?"
+        params.append(int(cursor))
+    cur.execute(f"""
+        SELECT v.*, i.quantidade AS quantidade_item, i.preco_unitario FROM itens_venda i
+        JOIN vendas v ON v.id = i.venda_id
+        WHERE i.produto_id = ? {filtro_cursor}
+        ORDER BY i.venda_id DESC LIMIT ?
+    """, (*params, int(limite) + 1))
+    res = [dict(row) for row in cur.fetchall()]
+    conn.close()
+    if len(res) > limite:
+        res = res[:limite]
+        return res, res[-1]['id']
+    return res, None
+
+def get_resumo_vendas_produto(produto_id):
+    """Pedidos, unidades e faturamento do produto por status da venda"""
+    conn = create_connection()
+    if not conn: return {}
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT COALESCE(v.status, 'pendente') AS status, COUNT(DISTINCT i.venda_id) AS pedidos,
+               SUM(i.quantidade) AS unidades, SUM(i.quantidade * i.preco_unitario) AS faturamento
+        FROM itens_venda i JOIN vendas v ON v.id = i.venda_id
+        WHERE i.produto_id = ?
+        GROUP BY COALESCE(v.status, 'pendente')
+    """, (str(produto_id),))
+    res = {row['status']: {'pedidos': row['pedidos'], 'unidades': row['unidades'], 'faturamento': round(row['faturamento'] or 0, 2)}
+           for row in cur.fetchall()}
+    conn.close()
+    return res
+
+# --- RESERVAS DE ESTOQUE ---
+
+def _liberar_reservas_vencidas(cur, produto_ids=None):
+    """Devolve ao disponível as reservas ativas vencidas (todas, ou só destes produtos)"""
+    filtro, params = "", [time.time()]
+    if produto_ids is not None:
+        filtro = f" AND produto_id IN ({','.join('?' * len(produto_ids))})"
+        params += list(produto_ids)
+    cur.execute(f"SELECT id, produto_id, quantidade FROM reservas_estoque WHERE estado = 'ativa' AND expira_em <= ?{filtro}", params)
+    vencidas = cur.fetchall()
+    if vencidas:
+        cur.executemany("UPDATE produtos SET estoque_reservado = MAX(estoque_reservado - ?, 0) WHERE id = ?",
+                        [(r['quantidade'], r['produto_id']) for r in vencidas])
+        cur.executemany("UPDATE reservas_estoque SET estado = 'liberada' WHERE id = ?", [(r['id'],) for r in vencidas])
+    return len(vencidas)
+
+def registrar_venda_com_reserva(nome_cliente, email_cliente, whatsapp_cliente, produto_nome, quantidade, valor_total, itens, validade):
+    """
+    Registra a venda (com seus itens, ver _inserir_venda) e reserva o estoque
+    deles na mesma transação curta. Retorna (venda_id, None), ou (None, produto_id)
+    do primeiro item sem estoque disponível — nesse caso nada é gravado.
+    """
+    reservar = {}
+    for produto_id, _, qtd, _ in itens:
+        reservar[str(produto_id)] = reservar.get(str(produto_id), 0) + int(qtd)
+    conn = create_connection()
+    if not conn: return None, None
+    cur = conn.cursor()
+    agora = time.time()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        _travar(cur, *(f"estoque:{produto_id}" for produto_id in reservar))
+        _liberar_reservas_vencidas(cur, list(reservar))
+        # Ordem fixa dos ids: dois pedidos com os mesmos produtos não se cruzam
+        for produto_id, qtd in sorted(reservar.items()):
+            cur.execute("""
+                UPDATE produtos SET estoque_reservado = estoque_reservado + ?
+                WHERE id = ? AND COALESCE(estoque, 0) - estoque_reservado >= ?
+            """, (qtd, produto_id, qtd))
+            if cur.rowcount == 0:
+                conn.rollback()
+                return None, produto_id
+        venda_id = _inserir_venda(cur, nome_cliente, email_cliente, whatsapp_cliente, produto_nome, quantidade, valor_total, itens)
+        cur.executemany("""
+            INSERT INTO reservas_estoque (venda_id, produto_id, quantidade, expira_em, criado_em)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(venda_id, produto_id, qtd, agora + validade, agora) for produto_id, qtd in reservar.items()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return venda_id, None
+
+def _confirmar_reservas(cur, id_venda):
+    """Pagamento aprovado: baixa o estoque das reservas da venda"""
+    cur.execute("SELECT id, produto_id, quantidade, estado FROM reservas_estoque WHERE venda_id = ? AND estado != 'confirmada'", (id_venda,))
+    for r in cur.fetchall():
+        if r['estado'] == 'ativa':
+            cur.execute("UPDATE produtos SET estoque = estoque - ?, estoque_reservado = MAX(estoque_reservado - ?, 0) WHERE id = ?",
+                        (r['quantidade'], r['quantidade'], r['produto_id']))
+        else:
+            # Pagou depois que a reserva venceu: a baixa é feita mesmo sem disponível
+            cur.execute("UPDATE produtos SET estoque = estoque - ? WHERE id = ?", (r['quantidade'], r['produto_id']))
+            print(f"⚠️ Venda {id_venda} paga com a reserva de {r['produto_id']} já vencida; confira o estoque")
+        cur.execute("UPDATE reservas_estoque SET estado = 'confirmada' WHERE id = ?", (r['id'],))
+
+def _cancelar_reservas(cur, id_venda):
+    cur.execute("SELECT id, produto_id, quantidade FROM reservas_estoque WHERE venda_id = ? AND estado = 'ativa'", (id_venda,))
+    ativas = cur.fetchall()
+    cur.executemany("UPDATE produtos SET estoque_reservado = MAX(estoque_reservado - ?, 0) WHERE id = ?",
+                    [(r['quantidade'], r['produto_id']) for r in ativas])
+    cur.executemany("UPDATE reservas_estoque SET estado = 'liberada' WHERE id = ?", [(r['id'],) for r in ativas])
+
+def liberar_reservas_vencidas():
+    """Usado pelo varredor de estoque; retorna quantas reservas foram liberadas"""
+    conn = create_connection()
+    if not conn: return 0
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("SELECT DISTINCT produto_id FROM reservas_estoque WHERE estado = 'ativa' AND expira_em <= ?", (time.time(),))
+        produto_ids = [r['produto_id'] for r in cur.fetchall()]
+        _travar(cur, *(f"estoque:{produto_id}" for produto_id in produto_ids))
+        liberadas = _liberar_reservas_vencidas(cur, produto_ids) if produto_ids else 0
+        conn.commit()
+    finally:
+        conn.close()
+    return liberadas
+
+def proxima_reserva_vence_em():
+    """Timestamp da reserva ativa que vence primeiro, ou None"""
+    conn = create_connection()
+    if not conn: return None
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(expira_em) FROM reservas_estoque WHERE estado = 'ativa'")
+    res = cur.fetchone()[0]
+    conn.close()
+    return res
+
 def atualizar_status_venda(id_venda, novo_status):
     """Atualiza o status da venda (ex: de 'pendente' para 'pago')"""
     conn = create_connection()
     if not conn: return
     try:
         cur = conn.cursor()
-        cur.execute("UPDATE vendas SET status = ? WHERE id = ?", (novo_status, id_venda))
+        # Lê o status antigo e grava o novo sob o lock da venda (e do estoque dos
+        # seus produtos), para o resumo não contar duas vezes quando dois workers
+        # recebem o mesmo webhook
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("SELECT DISTINCT produto_id FROM reservas_estoque WHERE venda_id = ?", (id_venda,))
+        _travar(cur, f"venda:{id_venda}", *(f"estoque:{r['produto_id']}" for r in cur.fetchall()))
+        cur.execute("SELECT status, valor_total FROM vendas WHERE id = ?", (id_venda,))
+        venda = cur.fetchone()
+        if venda and venda['status'] != novo_status:
+            cur.execute("UPDATE vendas SET status = ? WHERE id = ?", (novo_status, id_venda))
+            _somar_resumo_vendas(cur, venda['status'] or 'pendente', -1, -(venda['valor_total'] or 0.0))
+            _somar_resumo_vendas(cur, novo_status, 1, venda['valor_total'])
+            _somar_resumo_periodos(cur, id_venda, venda['status'], -1)
+            _somar_resumo_periodos(cur, id_venda, novo_status, 1)
+            # Estoque acompanha o status na mesma transação
+            if novo_status == 'pago':
+                _confirmar_reservas(cur, id_venda)
+            elif novo_status == 'cancelado':
+                _cancelar_reservas(cur, id_venda)
         conn.commit()
         print(f"✅ Venda {id_venda} atualizada para {novo_status}")
     except Exception as e:
@@ -314,13 +1649,370 @@ def get_vendas():
     conn.close()
     return res
 
-def is_valid_login(user, pwd):
+def get_vendas_pagina(limite=20, cursor=None):
+    """Vendas mais recentes primeiro, paginadas por cursor; retorna (vendas, proximo_cursor)"""
+    conn = create_connection()
+    if not conn: return [], None
+    cur = conn.cursor()
+    if cursor:
+        cur.execute("SELECT * FROM vendas WHERE id < ? ORDER BY id DESC LIMIT ?", (int(cursor), int(limite) + 1))
+    else:
+        cur.execute("SELECT * FROM vendas ORDER BY id DESC LIMIT ?", (int(limite) + 1,))
+    res = _anexar_itens(cur, [dict(row) for row in cur.fetchall()])
+    conn.close()
+    if len(res) > limite:
+        res = res[:limite]
+        return res, res[-1]['id']
+    return res, None
+
+# --- RELATÓRIOS ---
+
+def _sql_data_local(expressao):
+    """Data/hora gravada em UTC ('AAAA-MM-DD HH:MM:SS') convertida para o horário local"""
+    if _postgres():
+        return f"to_char(CAST({expressao} AS timestamp) AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+    return f"datetime({expressao}, 'localtime')"
+
+def _sql_data_utc(expressao):
+    """Data/hora local convertida para o texto UTC comparável com vendas.data"""
+    if _postgres():
+        return f"to_char(CAST({expressao} AS timestamptz) AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+    return f"datetime({expressao}, 'utc')"
+
+def _sql_inicio_do_dia_utc(dias_atras):
+    """Meia-noite local de dias_atras dias atrás, como texto UTC"""
+    if _postgres():
+        return f"to_char((date_trunc('day', now()) - INTERVAL '{dias_atras} days') AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+    return f"datetime('now', 'localtime', 'start of day', '-{dias_atras} days', 'utc')"
+
+def get_resumo_periodos(granularidade, inicio, fim_exclusivo, status=None):
+    """Linhas do resumo por período em [inicio, fim_exclusivo) (chaves como em FORMATOS_PERIODO)"""
+    conn = create_connection()
+    if not conn: return []
+    cur = conn.cursor()
+    params = [granularidade, inicio, fim_exclusivo]
+    filtro_status = ""
+    if status:
+        filtro_status = "AND status = ?"
+        params.append(status)
+    cur.execute(f"""
+        SELECT periodo, status, pedidos, faturamento FROM resumo_vendas_periodo
+        WHERE granularidade = ? AND periodo >= ? AND periodo < ? AND pedidos != 0 {filtro_status}
+        ORDER BY periodo, status
+    """, params)
+    res = [dict(row) for row in cur.fetchall()]
+    conn.close()
+    return res
+
+def iterar_vendas_periodo(inicio, fim_exclusivo, status=None, tamanho_lote=1000):
+    """
+    Vendas entre as datas locais [inicio, fim_exclusivo) em ordem de data, lidas em
+    blocos pelo índice de vendas.data (gravada em UTC)
+    """
+    conn = create_connection()
+    if not conn: return
+    cur = conn.cursor()
+    params = [inicio, fim_exclusivo]
+    filtro_status = ""
+    if status:
+        filtro_status = "AND status = ?"
+        params.append(status)
+    try:
+        cur.execute(f"""
+            SELECT id, {_sql_data_local('data')} AS data, nome_cliente, email_cliente, produto_nome,
+                   quantidade, valor_total, status
+            FROM vendas
+            WHERE data >= {_sql_data_utc('?')} AND data < {_sql_data_utc('?')} {filtro_status}
+            ORDER BY data, id
+        """, params)
+        while True:
+            bloco = cur.fetchmany(tamanho_lote)
+            if not bloco: break
+            for row in bloco:
+                yield dict(row)
+    finally:
+        conn.close()
+
+def get_estatisticas_dashboard():
+    """
+    Números do painel admin calculados no SQL: contagens, vendas/valor por status
+    (tabela resumo_vendas) e pedidos/faturamento de hoje, 7 e 30 dias.
+    """
+    stats = {
+        'total_vendas': 0, 'total_produtos': 0, 'total_clientes': 0,
+        'por_status': {}, 'periodos': {},
+    }
+    conn = create_connection()
+    if not conn: return stats
+    cur = conn.cursor()
+    cur.execute("SELECT (SELECT COUNT(*) FROM produtos), (SELECT COUNT(*) FROM clientes)")
+    stats['total_produtos'], stats['total_clientes'] = cur.fetchone()
+
+    cur.execute("SELECT status, quantidade, valor FROM resumo_vendas WHERE quantidade > 0 ORDER BY quantidade DESC")
+    for row in cur.fetchall():
+        stats['por_status'][row['status']] = {'quantidade': row['quantidade'], 'valor': round(row['valor'], 2)}
+    stats['total_vendas'] = sum(s['quantidade'] for s in stats['por_status'].values())
+
+    # vendas.data é gravado em UTC; os limites são a meia-noite local convertida para UTC.
+    # Faturamento considera só vendas pagas.
+    cur.execute(f"""
+        WITH limites AS (
+            SELECT {_sql_inicio_do_dia_utc(0)} AS hoje,
+                   {_sql_inicio_do_dia_utc(6)} AS d7,
+                   {_sql_inicio_do_dia_utc(29)} AS d30
+        )
+        SELECT
+            SUM(CASE WHEN data >= hoje THEN 1 ELSE 0 END),
+            COALESCE(SUM(CASE WHEN data >= hoje AND status = 'pago' THEN valor_total END), 0),
+            SUM(CASE WHEN data >= d7 THEN 1 ELSE 0 END),
+            COALESCE(SUM(CASE WHEN data >= d7 AND status = 'pago' THEN valor_total END), 0),
+            COUNT(*), COALESCE(SUM(CASE WHEN status = 'pago' THEN valor_total END), 0)
+        FROM vendas, limites
+        WHERE data >= d30
+    """)
+    row = cur.fetchone()
+    conn.close()
+    for i, periodo in enumerate(('hoje', '7_dias', '30_dias')):
+        stats['periodos'][periodo] = {'pedidos': row[i * 2] or 0, 'faturamento': round(row[i * 2 + 1], 2)}
+    return stats
+
+def get_vendas_por_cliente(email, limite=20, cursor=None):
+    """
+    Vendas de um cliente (e-mail sem diferenciar maiúsculas), mais recentes primeiro.
+    Paginação por cursor (id da última venda exibida); retorna (vendas, proximo_cursor).
+    """
+    if not email: return [], None
+    conn = create_connection()
+    if not conn: return [], None
+    cur = conn.cursor()
+    params = [email]
+    filtro_cursor = ""
+    if cursor:
+        filtro_cursor = "AND id < ?"
+        params.append(int(cursor))
+    cur.execute(f"""
+        SELECT * FROM vendas
+        WHERE email_cliente = ? COLLATE NOCASE {filtro_cursor}
+        ORDER BY id DESC LIMIT ?
+    """, (*params, int(limite) + 1))
+    res = _anexar_itens(cur, [dict(row) for row in cur.fetchall()])
+    conn.close()
+    if len(res) > limite:
+        res = res[:limite]
+        return res, res[-1]['id']
+    return res, None
+
+def get_admin_para_login(user):
     conn = create_connection()
     if not conn: return None
     cur = conn.cursor()
     cur.execute("SELECT * FROM users WHERE username = ?", (user,))
     res = cur.fetchone()
     conn.close()
-    if res and check_password_hash(res['password_hash'], pwd):
-        return dict(res)
-    return None
+    return dict(res) if res else None
+
+def atualizar_hash_admin(id_usuario, senha_hash):
+    conn = create_connection()
+    if not conn: return False
+    cur = conn.cursor()
+    cur.execute("UPDATE users SET password_hash = ? WHERE id = ?", (senha_hash, id_usuario))
+    conn.commit()
+    conn.close()
+    return True
+
+# --- LIMITE DE TENTATIVAS DE LOGIN ---
+
+def get_bloqueio_login(chaves):
+    """Segundos até liberar a mais bloqueada das chaves (0 = liberado)"""
+    if not chaves: return 0
+    conn = create_connection()
+    if not conn: return 0
+    cur = conn.cursor()
+    cur.execute(f"SELECT MAX(bloqueado_ate) FROM tentativas_login WHERE chave IN ({','.join('?' * len(chaves))})", list(chaves))
+    bloqueado_ate = cur.fetchone()[0] or 0
+    conn.close()
+    return max(0.0, bloqueado_ate - time.time())
+
+def registrar_falha_login(chave, janela, limite, bloqueio):
+    """Conta uma falha na janela atual; ao atingir o limite bloqueia a chave por bloqueio segundos"""
+    conn = create_connection()
+    if not conn: return
+    cur = conn.cursor()
+    agora = time.time()
+    cur.execute("""
+        INSERT INTO tentativas_login (chave, falhas, janela_inicio) VALUES (?, 1, ?)
+        ON CONFLICT(chave) DO UPDATE SET
+            falhas = CASE WHEN tentativas_login.janela_inicio < ? THEN 1 ELSE tentativas_login.falhas + 1 END,
+            janela_inicio = CASE WHEN tentativas_login.janela_inicio < ? THEN excluded.janela_inicio
+                                 ELSE tentativas_login.janela_inicio END
+    """, (chave, agora, agora - janela, agora - janela))
+    cur.execute("UPDATE tentativas_login SET bloqueado_ate = ? WHERE chave = ? AND falhas >= ?", (agora + bloqueio, chave, limite))
+    conn.commit()
+    conn.close()
+
+def limpar_tentativas_login(chaves=None, antes_de=None):
+    """Apaga as chaves informadas (login certo) ou as entradas velhas e sem bloqueio"""
+    conn = create_connection()
+    if not conn: return
+    cur = conn.cursor()
+    if chaves:
+        cur.executemany("DELETE FROM tentativas_login WHERE chave = ?", [(c,) for c in chaves])
+    if antes_de:
+        cur.execute("DELETE FROM tentativas_login WHERE janela_inicio < ? AND bloqueado_ate < ?", (antes_de, time.time()))
+    conn.commit()
+    conn.close()
+
+# --- CARRINHOS ---
+
+def get_versao_carrinho(id_carrinho):
+    """(versao, cliente_id) do carrinho se ainda não venceu, ou None"""
+    conn = create_connection()
+    if not conn: return None
+    cur = conn.cursor()
+    cur.execute("SELECT versao, cliente_id FROM carrinhos WHERE id = ? AND expira_em > ?", (id_carrinho, time.time()))
+    res = cur.fetchone()
+    conn.close()
+    return (res['versao'], res['cliente_id']) if res else None
+
+def _ler_carrinho(cur, id_carrinho):
+    cur.execute("SELECT versao, cliente_id FROM carrinhos WHERE id = ? AND expira_em > ?", (id_carrinho, time.time()))
+    carrinho = cur.fetchone()
+    if not carrinho:
+        return None
+    cur.execute("SELECT produto_id, quantidade FROM itens_carrinho WHERE carrinho_id = ?", (id_carrinho,))
+    return carrinho['versao'], carrinho['cliente_id'], {r['produto_id']: r['quantidade'] for r in cur.fetchall()}
+
+def get_carrinho(id_carrinho):
+    """(versao, cliente_id, {produto_id: quantidade}) lidos juntos, ou None se não existe/venceu"""
+    conn = create_connection()
+    if not conn: return None
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN")
+        return _ler_carrinho(cur, id_carrinho)
+    finally:
+        conn.commit()
+        conn.close()
+
+def _tocar_carrinho(cur, id_carrinho, validade, cliente_id=None):
+    """Cria o carrinho ou sobe a versão e renova a validade (vencido e não varrido começa vazio)"""
+    agora = time.time()
+    cur.execute("""
+        DELETE FROM itens_carrinho WHERE carrinho_id = ?
+        AND EXISTS (SELECT 1 FROM carrinhos WHERE id = ? AND expira_em <= ?)
+    """, (id_carrinho, id_carrinho, agora))
+    cur.execute("""
+        INSERT INTO carrinhos (id, cliente_id, versao, atualizado_em, expira_em) VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            versao = carrinhos.versao + 1,
+            cliente_id = COALESCE(excluded.cliente_id, carrinhos.cliente_id),
+            atualizado_em = excluded.atualizado_em,
+            expira_em = excluded.expira_em
+    """, (id_carrinho, cliente_id, agora, agora + validade))
+
+def alterar_item_carrinho(id_carrinho, produto_id, quantidade, validade, maximo, somar=False, cliente_id=None):
+    """
+    Grava a quantidade do produto no carrinho (ou soma à atual, com somar=True),
+    limitada a maximo; zero ou menos remove o item. Cria o carrinho se preciso.
+    Retorna o carrinho como ficou (ver get_carrinho).
+    """
+    conn = create_connection()
+    if not conn: return None
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        _travar(cur, f"carrinho:{id_carrinho}")
+        _tocar_carrinho(cur, id_carrinho, validade, cliente_id)
+        cur.execute(f"""
+            INSERT INTO itens_carrinho (carrinho_id, produto_id, quantidade) VALUES (?, ?, ?)
+            ON CONFLICT(carrinho_id, produto_id) DO UPDATE SET
+                quantidade = MIN({'itens_carrinho.quantidade + ' if somar else ''}excluded.quantidade, ?)
+        """, (id_carrinho, str(produto_id), min(int(quantidade), maximo), maximo))
+        cur.execute("DELETE FROM itens_carrinho WHERE carrinho_id = ? AND produto_id = ? AND quantidade <= 0", (id_carrinho, str(produto_id)))
+        carrinho = _ler_carrinho(cur, id_carrinho)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return carrinho
+
+def esvaziar_carrinho(id_carrinho, validade):
+    conn = create_connection()
+    if not conn: return None
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        _travar(cur, f"carrinho:{id_carrinho}")
+        cur.execute("DELETE FROM itens_carrinho WHERE carrinho_id = ?", (id_carrinho,))
+        _tocar_carrinho(cur, id_carrinho, validade)
+        carrinho = _ler_carrinho(cur, id_carrinho)
+        conn.commit()
+    finally:
+        conn.close()
+    return carrinho
+
+def mesclar_carrinho_do_cliente(id_carrinho, cliente_id, validade, maximo):
+    """
+    Login: junta o carrinho anônimo id_carrinho ao carrinho mais recente do cliente
+    (somando as quantidades) e apaga o anônimo; sem carrinho do cliente, o anônimo
+    passa a ser dele. Retorna (id do carrinho que fica, carrinho) ou (None, None).
+    """
+    conn = create_connection()
+    if not conn: return None, None
+    cur = conn.cursor()
+    agora = time.time()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        # Dois logins do mesmo cliente não escolhem destinos diferentes
+        _travar(cur, f"cliente:{cliente_id}", *([f"carrinho:{id_carrinho}"] if id_carrinho else []))
+        cur.execute("""
+            SELECT id FROM carrinhos WHERE cliente_id = ? AND expira_em > ?
+            ORDER BY atualizado_em DESC LIMIT 1
+        """, (cliente_id, agora))
+        do_cliente = cur.fetchone()
+        destino = do_cliente['id'] if do_cliente else None
+        origem = None
+        if id_carrinho and id_carrinho != destino:
+            # Carrinho de outro cliente (cookie que sobrou no aparelho) não é mesclado
+            cur.execute("SELECT id FROM carrinhos WHERE id = ? AND expira_em > ? AND cliente_id IS NULL", (id_carrinho, agora))
+            origem = id_carrinho if cur.fetchone() else None
+
+        if origem and destino:
+            cur.execute("""
+                INSERT INTO itens_carrinho (carrinho_id, produto_id, quantidade)
+                SELECT ?, produto_id, quantidade FROM itens_carrinho WHERE carrinho_id = ? AND true
+                ON CONFLICT(carrinho_id, produto_id) DO UPDATE SET
+                    quantidade = MIN(itens_carrinho.quantidade + excluded.quantidade, ?)
+            """, (destino, origem, maximo))
+            cur.execute("DELETE FROM itens_carrinho WHERE carrinho_id = ?", (origem,))
+            cur.execute("DELETE FROM carrinhos WHERE id = ?", (origem,))
+        destino = destino or origem
+        carrinho = None
+        if destino:
+            _tocar_carrinho(cur, destino, validade, cliente_id)
+            carrinho = _ler_carrinho(cur, destino)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return destino, carrinho
+
+def limpar_carrinhos_vencidos():
+    """Apaga carrinhos vencidos e seus itens; retorna quantos carrinhos saíram"""
+    conn = create_connection()
+    if not conn: return 0
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        agora = time.time()
+        cur.execute("DELETE FROM itens_carrinho WHERE carrinho_id IN (SELECT id FROM carrinhos WHERE expira_em <= ?)", (agora,))
+        cur.execute("DELETE FROM carrinhos WHERE expira_em <= ?", (agora,))
+        apagados = cur.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return apagados
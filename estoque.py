@@ -0,0 +1,62 @@
+import os
+import time
+import threading
+import database
+
+# Quanto tempo a reserva segura o estoque esperando o pagamento (mesma validade
+# do link reaproveitado em apimercadopago.checkout_idempotente)
+RESERVA_VALIDADE = 30 * 60
+# Maior intervalo entre varreduras de reservas vencidas
+VARREDOR_INTERVALO_MAX = 60.0
+
+_acordar = threading.Event()
+_varredor = {'thread': None, 'pid': None}
+_varredor_lock = threading.Lock()
+
+class EstoqueInsuficiente(ValueError):
+    def __init__(self, produto_id):
+        super().__init__(f"Estoque insuficiente para o produto {produto_id}")
+        self.produto_id = produto_id
+
+def registrar_venda_reservando(nome, email, whatsapp, produto_nome, quantidade, valor_total, itens):
+    """
+    Registra a venda já reservando os itens [(produto_id, nome, quantidade, preco_unitario)];
+    levanta EstoqueInsuficiente se faltar
+    """
+    itens = [item for item in itens if int(item[2]) > 0]
+    venda_id, sem_estoque = database.registrar_venda_com_reserva(
+        nome, email, whatsapp, produto_nome, quantidade, valor_total, itens, RESERVA_VALIDADE)
+    if sem_estoque:
+        raise EstoqueInsuficiente(sem_estoque)
+    if venda_id:
+        _acordar.set()
+    return venda_id
+
+def disponivel(produto):
+    return max((produto.get('estoque') or 0) - (produto.get('estoque_reservado') or 0), 0)
+
+# --- VARREDOR DE RESERVAS VENCIDAS ---
+
+def _loop_varredor():
+    while True:
+        try:
+            liberadas = database.liberar_reservas_vencidas()
+            if liberadas:
+                print(f"📦 {liberadas} reserva(s) de estoque vencida(s) liberada(s)")
+            proxima = database.proxima_reserva_vence_em()
+            espera = VARREDOR_INTERVALO_MAX if proxima is None else min(max(proxima - time.time(), 0.5), VARREDOR_INTERVALO_MAX)
+        except Exception as e:
+            print(f"Erro no varredor de estoque: {e}")
+            espera = VARREDOR_INTERVALO_MAX
+        _acordar.wait(espera)
+        _acordar.clear()
+
+def iniciar_varredor():
+    """Sobe a thread que libera reservas vencidas (uma por processo)"""
+    with _varredor_lock:
+        thread = _varredor['thread']
+        if thread and thread.is_alive() and _varredor['pid'] == os.getpid():
+            return
+        thread = threading.Thread(target=_loop_varredor, name="varredor-estoque", daemon=True)
+        thread.start()
+        _varredor['thread'], _varredor['pid'] = thread, os.getpid()
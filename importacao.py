@@ -0,0 +1,90 @@
+import csv
+import json
+import database
+from data import produtos_data
+
+TAMANHO_LOTE = 1000
+
+def _numero(valor):
+    return float(str(valor).replace(',', '.'))
+
+def validar_produto(dados):
+    """Retorna o motivo da rejeição, ou None se a linha pode ser gravada"""
+    if not str(dados.get('nome') or '').strip():
+        return "nome vazio"
+    try:
+        if _numero(dados.get('preco')) < 0: return "preço negativo"
+    except (TypeError, ValueError):
+        return f"preço inválido: {dados.get('preco')!r}"
+    for campo in ('novo_preco', 'frete_gratis_valor', 'largura_cm', 'altura_cm', 'comprimento_cm', 'peso_kg'):
+        if dados.get(campo) not in (None, ''):
+            try: _numero(dados[campo])
+            except (TypeError, ValueError): return f"{campo} inválido: {dados[campo]!r}"
+    for campo in ('estoque', 'desconto_pix'):
+        if dados.get(campo) not in (None, ''):
+            try: int(dados[campo])
+            except (TypeError, ValueError): return f"{campo} inválido: {dados[campo]!r}"
+    return None
+
+def ler_csv(arquivo):
+    # Linha 1 é o cabeçalho; os números devolvidos batem com o editor de planilha
+    for numero, linha in enumerate(csv.DictReader(arquivo), start=2):
+        yield numero, {k: (v if v != '' else None) for k, v in linha.items() if k}
+
+def ler_jsonl(arquivo):
+    for numero, texto in enumerate(arquivo, start=1):
+        texto = texto.strip()
+        if not texto: continue
+        try:
+            dados = json.loads(texto)
+        except json.JSONDecodeError as e:
+            yield numero, {'_erro': f"JSON inválido: {e.msg}"}
+            continue
+        if not isinstance(dados, dict):
+            yield numero, {'_erro': f"linha não é um objeto JSON: {texto[:80]}"}
+            continue
+        yield numero, dados
+
+def ler_semente(categoria):
+    """Catálogo de exemplo de data/produtos_data.py no formato da importação"""
+    for numero, (id_prod, item) in enumerate(produtos_data.get_produtos().items(), start=1):
+        # Sem estoque a semente não poderia ser vendida; usa o mesmo padrão do formulário do admin
+        yield numero, dict(item, id=id_prod, categoria=item.get('categoria', categoria), estoque=item.get('estoque', 50))
+
+def importar(linhas, tamanho_lote=TAMANHO_LOTE, ao_progresso=None):
+    """
+    Grava as linhas (numero, dados) em lotes transacionais. Retorna
+    (total_importado, rejeitados), com rejeitados = [(numero, motivo, dados)].
+    """
+    importados = 0
+    rejeitados = []
+    lote = []
+    for numero, dados in linhas:
+        motivo = dados.pop('_erro', None) or validar_produto(dados)
+        if motivo:
+            rejeitados.append((numero, motivo, dados))
+            continue
+        lote.append(dados)
+        if len(lote) >= tamanho_lote:
+            importados += database.importar_produtos_lote(lote)
+            lote = []
+            if ao_progresso: ao_progresso(importados, len(rejeitados))
+    if lote:
+        importados += database.importar_produtos_lote(lote)
+        if ao_progresso: ao_progresso(importados, len(rejeitados))
+    return importados, rejeitados
+
+def exportar(arquivo, formato):
+    """Escreve o catálogo inteiro em CSV ou JSONL; retorna quantas linhas saíram"""
+    total = 0
+    if formato == 'csv':
+        escritor = csv.DictWriter(arquivo, fieldnames=database.COLUNAS_PRODUTO)
+        escritor.writeheader()
+        for produto in database.iterar_produtos():
+            escritor.writerow(produto)
+            total += 1
+    else:
+        for produto in database.iterar_produtos():
+            arquivo.write(json.dumps(produto, ensure_ascii=False) + "\n")
+            total += 1
+    return total
@@ -1,13 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from werkzeug.utils import secure_filename
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context
 import os
+import hmac
 import datetime
-import requests # Necessário para consultar o Mercado Pago
+import json
+import click
+from flask.cli import AppGroup
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Importação dos seus módulos
-from apimercadopago import gerar_link_pagamento
+import apimercadopago
 import melhorenvio
 import database
+import carrinho
+import webhooks
+import midia
+import importacao
+import ofertas
+import metricas
+import autenticacao
+import estoque
+import relatorios
+from cache import pagina_em_cache, estatisticas_paginas
 
 app = Flask(__name__)
 app.secret_key = 'chave_ultra_secreta_denis'
@@ -21,8 +34,20 @@ else:
     UPLOAD_FOLDER = 'static/uploads'
     UPLOAD_FOLDER_CAT = 'static/uploads/categorias'
 
+# Quantos proxies confiáveis (roteador, Vercel) ficam na frente e acrescentam
+# X-Forwarded-For; sem isso o remote_addr é o do proxy e todos os clientes dividem
+# o mesmo limite de login. 0 = acesso direto, cabeçalhos ignorados
+PROXIES_CONFIAVEIS = int(os.getenv("PROXIES_CONFIAVEIS", "1" if IS_VERCEL else "0"))
+if PROXIES_CONFIAVEIS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXIES_CONFIAVEIS, x_proto=PROXIES_CONFIAVEIS, x_host=PROXIES_CONFIAVEIS)
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.jinja_env.filters['srcset'] = midia.srcset
+# Teto da requisição inteira: 4 fotos + 1 vídeo com folga (cada arquivo tem seu limite em midia)
+app.config['MAX_CONTENT_LENGTH'] = 4 * midia.MAX_BYTES_IMAGEM + midia.MAX_BYTES_VIDEO + 1024 * 1024
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4'}
+PRODUTOS_POR_PAGINA = 24
+PEDIDOS_POR_PAGINA = 20
 
 if not IS_VERCEL:
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -31,6 +56,146 @@ if not IS_VERCEL:
 with app.app_context():
     database.init_db()
 
+# Tempo por rota, por função do database, por template e das APIs externas
+metricas.instalar(app)
+metricas.instrumentar_modulo(database)
+
+# Sobe (uma vez por processo) o worker da fila de webhooks, o agendador de ofertas
+# e o varredor de reservas de estoque;
+# fica fora do import para não rodar em comandos de CLI e não ser herdado por fork do gunicorn
+@app.before_request
+def garantir_worker_webhooks():
+    webhooks.iniciar_worker()
+    ofertas.iniciar_agendador()
+    estoque.iniciar_varredor()
+
+# Rotas que migram o carrinho antigo da sessão para o banco antes de usá-lo
+ROTAS_CARRINHO = {'checkout', 'exibir_carrinho', 'remover_carrinho', 'atualizar_quantidade_carrinho',
+                  'adicionar_carrinho', 'calcular_frete_rota', 'processar_pagamento', 'cliente_login'}
+
+@app.before_request
+def migrar_carrinho_da_sessao():
+    if request.endpoint in ROTAS_CARRINHO and 'carrinho' in session:
+        carrinho.migrar_sessao_antiga()
+
+@app.after_request
+def cache_midia_imutavel(response):
+    # Uploads têm nome derivado do conteúdo: a mesma URL nunca muda de conteúdo
+    if request.path.startswith('/static/uploads/') and response.status_code == 200 and midia.eh_imutavel(request.path.rsplit('/', 1)[-1]):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.context_processor
+def contador_carrinho():
+    # Contador do menu (base.html); só consulta o banco se a requisição tem carrinho
+    return {'itens_no_carrinho': carrinho.quantidade_de_produtos()}
+
+@app.cli.command("limpar-midia")
+@click.option('--simular', is_flag=True, help="Só lista os arquivos que seriam removidos.")
+def limpar_midia(simular):
+    """Remove uploads que não são mais usados por produtos nem configurações."""
+    removidos = midia.coletar_lixo([UPLOAD_FOLDER, UPLOAD_FOLDER_CAT], database.get_caminhos_midia(), apagar=not simular)
+    for caminho in removidos:
+        click.echo(caminho)
+    click.echo(f"{len(removidos)} arquivo(s) {'seriam removidos' if simular else 'removidos'}.")
+
+produtos_cli = AppGroup("produtos", help="Importação e exportação do catálogo.")
+app.cli.add_command(produtos_cli)
+
+def _formato_arquivo(caminho, formato):
+    return formato or ('jsonl' if caminho.lower().endswith(('.jsonl', '.json')) else 'csv')
+
+def _importar_com_relatorio(linhas, lote, rejeitados_path):
+    progresso = lambda ok, ruins: click.echo(f"  {ok} importados, {ruins} rejeitados...")
+    total, rejeitados = importacao.importar(linhas, tamanho_lote=lote, ao_progresso=progresso)
+    for numero, motivo, _ in rejeitados[:20]:
+        click.echo(f"  linha {numero}: {motivo}", err=True)
+    if len(rejeitados) > 20:
+        click.echo(f"  ... e mais {len(rejeitados) - 20} linhas rejeitadas", err=True)
+    if rejeitados_path and rejeitados:
+        with open(rejeitados_path, 'w', encoding='utf-8') as saida:
+            for numero, motivo, dados in rejeitados:
+                saida.write(json.dumps({'linha': numero, 'motivo': motivo, 'dados': dados}, ensure_ascii=False) + "\n")
+    click.echo(f"{total} produto(s) importado(s), {len(rejeitados)} rejeitado(s).")
+
+@produtos_cli.command("importar")
+@click.argument("caminho", type=click.Path(exists=True, dir_okay=False))
+@click.option("--formato", type=click.Choice(["csv", "jsonl"]), help="Padrão: pela extensão do arquivo.")
+@click.option("--lote", default=importacao.TAMANHO_LOTE, show_default=True, help="Linhas por transação.")
+@click.option("--rejeitados", "rejeitados_path", type=click.Path(dir_okay=False), help="Grava as linhas rejeitadas (JSONL).")
+def produtos_importar(caminho, formato, lote, rejeitados_path):
+    """Importa produtos de um CSV/JSONL (mesmas colunas da tabela produtos)."""
+    with open(caminho, newline='', encoding='utf-8-sig') as arquivo:
+        leitor = importacao.ler_jsonl if _formato_arquivo(caminho, formato) == 'jsonl' else importacao.ler_csv
+        _importar_com_relatorio(leitor(arquivo), lote, rejeitados_path)
+
+@produtos_cli.command("exportar")
+@click.argument("caminho", type=click.Path(dir_okay=False))
+@click.option("--formato", type=click.Choice(["csv", "jsonl"]), help="Padrão: pela extensão do arquivo.")
+def produtos_exportar(caminho, formato):
+    """Exporta o catálogo inteiro para CSV/JSONL."""
+    with open(caminho, 'w', newline='', encoding='utf-8') as arquivo:
+        total = importacao.exportar(arquivo, _formato_arquivo(caminho, formato))
+    click.echo(f"{total} produto(s) exportado(s) para {caminho}.")
+
+@produtos_cli.command("semear")
+@click.option("--categoria", default="eletro", show_default=True, help="Categoria dos produtos de exemplo.")
+def produtos_semear(categoria):
+    """Carrega o catálogo de exemplo de data/produtos_data.py."""
+    _importar_com_relatorio(importacao.ler_semente(categoria), importacao.TAMANHO_LOTE, None)
+
+estoque_cli = AppGroup("estoque", help="Reservas de estoque.")
+app.cli.add_command(estoque_cli)
+
+@estoque_cli.command("varrer")
+def estoque_varrer():
+    """Libera agora as reservas vencidas (sem esperar o varredor)."""
+    click.echo(f"{database.liberar_reservas_vencidas()} reserva(s) liberada(s).")
+
+carrinho_cli = AppGroup("carrinho", help="Carrinhos guardados no servidor.")
+app.cli.add_command(carrinho_cli)
+
+@carrinho_cli.command("limpar")
+def carrinho_limpar():
+    """Apaga os carrinhos vencidos e seus itens."""
+    click.echo(f"{carrinho.limpar_vencidos()} carrinho(s) apagado(s).")
+
+banco_cli = AppGroup("banco", help="Motor de banco (SQLite local ou Postgres via DATABASE_URL).")
+app.cli.add_command(banco_cli)
+
+@banco_cli.command("migrar")
+@click.option("--origem", default=database.DB_PATH, show_default=True, type=click.Path(exists=True, dir_okay=False),
+              help="Arquivo SQLite de onde os dados saem.")
+@click.option("--substituir", is_flag=True, help="Apaga o que já existir no Postgres antes de copiar.")
+@click.option("--lote", default=1000, show_default=True, help="Linhas por INSERT.")
+def banco_migrar(origem, substituir, lote):
+    """Copia os dados do SQLite para o Postgres de DATABASE_URL."""
+    if not database._postgres():
+        raise click.UsageError("DATABASE_URL precisa apontar para o Postgres (postgresql://...)")
+    import banco_postgres
+    # O esquema já foi criado pelo init_db na carga do app
+    try:
+        copiadas = banco_postgres.copiar_do_sqlite(
+            database.DATABASE_URL, origem, substituir=substituir, tamanho_lote=lote,
+            ao_progresso=lambda tabela, total: click.echo(f"  {tabela}: {total} linhas...") if total % (lote * 10) == 0 else None)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    # Dia/hora do resumo por período seguem o fuso do Postgres, não o do SQLite
+    database.reconstruir_resumos()
+    for tabela, total in copiadas.items():
+        click.echo(f"  {tabela}: {total}")
+    click.echo(f"✅ {sum(copiadas.values())} linha(s) copiada(s) de {origem}.")
+
+@banco_cli.command("versao")
+def banco_versao():
+    """Lista as migrações do esquema (o init_db da carga do app já aplicou as pendentes)."""
+    aplicadas = database.get_migracoes_aplicadas()
+    for versao, descricao, _ in database.MIGRACOES:
+        click.echo(f"  {versao:>3} {descricao}: {aplicadas.get(versao) or 'pendente'}")
+    pendentes = [v for v, _, _ in database.MIGRACOES if v not in aplicadas]
+    click.echo(f"❌ {len(pendentes)} migração(ões) pendente(s)." if pendentes else "✅ Esquema em dia.")
+    if pendentes: raise SystemExit(1)
+
 # --- FUNÇÕES AUXILIARES ---
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -41,53 +206,43 @@ def load_shop_config():
     banner_pagamento = config.get('banner_principal_1', '')
     return config, banner_pagamento
 
-def consultar_status_mp(payment_id):
-    config, _ = load_shop_config()
-    token = config.get('mercado_pago_token')
-    if not token: return None, None
-    
-    url = f"https://api.mercadopago.com/v1/payments/{payment_id}"
-    headers = {"Authorization": f"Bearer {token}"}
-    
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            dados = response.json()
-            return dados.get('status'), dados.get('external_reference')
-    except:
-        pass
-    return None, None
-
 # --- ROTAS PÚBLICAS (LOJA) ---
 @app.route("/")
+@pagina_em_cache
 def homepage():
-    produtos = database.get_produtos()
+    produtos, proximo_cursor = database.get_produtos_pagina(PRODUTOS_POR_PAGINA, cursor=request.args.get('cursor'))
     ofertas = database.get_produtos_em_oferta()
     config, banner_pagamento = load_shop_config()
-    return render_template("homepage.html", produtos=produtos, ofertas=ofertas, config=config, banner_pagamento=banner_pagamento)
+    proxima_url = url_for('homepage', cursor=proximo_cursor) if proximo_cursor else None
+    return render_template("homepage.html", produtos=produtos, ofertas=ofertas, config=config, banner_pagamento=banner_pagamento, proxima_url=proxima_url)
 
 @app.route("/pesquisar")
 def pesquisar():
     query = request.args.get('q', '')
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
     config, banner_pagamento = load_shop_config()
-    todos_produtos = database.get_produtos()
     produtos_encontrados = []
+    proxima_url = anterior_url = None
     if query:
-        query = query.lower()
-        for p in todos_produtos:
-            if query in p.get('nome', '').lower() or query in p.get('descricao', '').lower():
-                produtos_encontrados.append(p)
-    return render_template("pesquisa.html", produtos=produtos_encontrados, query=query, config=config, banner_pagamento=banner_pagamento)
+        # Busca um item a mais só para saber se existe próxima página
+        produtos_encontrados = database.buscar_produtos(query, limite=PRODUTOS_POR_PAGINA + 1, offset=(pagina - 1) * PRODUTOS_POR_PAGINA)
+        if len(produtos_encontrados) > PRODUTOS_POR_PAGINA:
+            produtos_encontrados = produtos_encontrados[:PRODUTOS_POR_PAGINA]
+            proxima_url = url_for('pesquisar', q=query, pagina=pagina + 1)
+        if pagina > 1:
+            anterior_url = url_for('pesquisar', q=query, pagina=pagina - 1)
+    return render_template("pesquisa.html", produtos=produtos_encontrados, query=query, config=config, banner_pagamento=banner_pagamento, proxima_url=proxima_url, anterior_url=anterior_url)
 
 @app.route("/categoria/<nome_categoria>")
+@pagina_em_cache
 def categoria(nome_categoria):
     config, banner_pagamento = load_shop_config()
-    todos_produtos = database.get_produtos()
-    cat_search = nome_categoria.lower()
-    produtos_categoria = [p for p in todos_produtos if cat_search == str(p.get('categoria', '')).lower()]
-    return render_template("pesquisa.html", produtos=produtos_categoria, query=nome_categoria, config=config, banner_pagamento=banner_pagamento)
+    produtos_categoria, proximo_cursor = database.get_produtos_pagina(PRODUTOS_POR_PAGINA, cursor=request.args.get('cursor'), categoria=nome_categoria)
+    proxima_url = url_for('categoria', nome_categoria=nome_categoria, cursor=proximo_cursor) if proximo_cursor else None
+    return render_template("pesquisa.html", produtos=produtos_categoria, query=nome_categoria, config=config, banner_pagamento=banner_pagamento, proxima_url=proxima_url)
 
 @app.route("/produto/<id_produto>")
+@pagina_em_cache
 def produto_detalhes(id_produto):
     produto = database.get_produto_por_id(id_produto)
     if not produto: return redirect(url_for('homepage'))
@@ -97,57 +252,68 @@ def produto_detalhes(id_produto):
 
 # --- ROTAS INFORMATIVAS (SHOP + MAIS) ---
 @app.route('/sobre')
+@pagina_em_cache
 def sobre():
     config, _ = load_shop_config()
     return render_template('sobre.html', config=config)
 
 @app.route('/politicas')
+@pagina_em_cache
 def politicas():
     config, _ = load_shop_config()
     return render_template('politicas.html', config=config)
 
 @app.route('/privacidade')
+@pagina_em_cache
 def privacidade():
     config, _ = load_shop_config()
     return render_template('privacidade.html', config=config)
 
 @app.route('/ofertas-relampago')
+@pagina_em_cache
 def ofertas_relampago():
     config, _ = load_shop_config()
     return render_template('ofertas_relampago.html', config=config)
 
 @app.route('/blog')
+@pagina_em_cache
 def blog():
     config, _ = load_shop_config()
     return render_template('blog.html', config=config)
 
 # --- OUTRAS ROTAS DO RODAPÉ ---
 @app.route("/ajuda")
+@pagina_em_cache
 def central_ajuda():
     config, _ = load_shop_config()
     return render_template("central_ajuda.html", config=config)
 
 @app.route("/como-comprar")
+@pagina_em_cache
 def como_comprar():
     config, _ = load_shop_config()
     return render_template("como_comprar.html", config=config)
 
 @app.route("/pagamentos")
+@pagina_em_cache
 def metodos_pagamento():
     config, _ = load_shop_config()
     return render_template("metodos_pagamento.html", config=config)
 
 @app.route("/frete-gratis")
+@pagina_em_cache
 def frete_gratis():
     config, _ = load_shop_config()
     return render_template("frete_gratis.html", config=config)
 
 @app.route("/devolucao")
+@pagina_em_cache
 def devolucao_reembolso():
     config, _ = load_shop_config()
     return render_template("devolucao_reembolso.html", config=config)
 
 @app.route("/contato")
+@pagina_em_cache
 def fale_conosco():
     config, _ = load_shop_config()
     return render_template("fale_conosco.html", config=config)
@@ -156,73 +322,76 @@ def fale_conosco():
 @app.route("/checkout/<id_produto>")
 def checkout(id_produto):
     config, _ = load_shop_config()
-    carrinho_para_exibir = []
-    subtotal_valor = 0.0
     qtd_direta = request.args.get('qtd', 1, type=int)
 
     if id_produto != "carrinho":
-        produto = database.get_produto_por_id(id_produto)
-        if not produto: return redirect(url_for('homepage'))
-        preco = float(produto['novo_preco'] if produto.get('em_oferta') else produto['preco'])
-        subtotal_valor = preco * qtd_direta
-        carrinho_para_exibir.append({'produto': produto, 'quantidade': qtd_direta})
+        resumo = carrinho.calcular_carrinho({id_produto: qtd_direta})
+        if not resumo['itens']: return redirect(url_for('homepage'))
     else:
-        carrinho_sessao = session.get('carrinho', {})
-        if not carrinho_sessao:
+        itens_carrinho = carrinho.itens()
+        if not itens_carrinho:
             flash("Seu carrinho está vazio.")
             return redirect(url_for('homepage'))
-        for p_id, qtd in carrinho_sessao.items():
-            p = database.get_produto_por_id(p_id)
-            if p:
-                preco = float(p['novo_preco'] if p.get('em_oferta') else p['preco'])
-                subtotal_valor += (preco * qtd)
-                carrinho_para_exibir.append({'produto': p, 'quantidade': qtd})
+        resumo = carrinho.calcular_carrinho(itens_carrinho)
 
     return render_template("checkout.html", 
-                           produto=carrinho_para_exibir[0]['produto'] if id_produto != "carrinho" else None, 
-                           carrinho=carrinho_para_exibir, 
+                           produto=resumo['itens'][0]['produto'] if id_produto != "carrinho" else None, 
+                           carrinho=resumo['itens'], 
                            config=config, 
-                           subtotal=subtotal_valor)
+                           subtotal=resumo['subtotal'],
+                           resumo=resumo)
 
 # --- SISTEMA DE CARRINHO ---
 @app.route("/carrinho")
 def exibir_carrinho():
     config, _ = load_shop_config()
-    carrinho_sessao = session.get('carrinho', {})
-    produtos_no_carrinho = []
-    total_geral = 0
-    for id_p, qtd in carrinho_sessao.items():
-        p = database.get_produto_por_id(id_p)
-        if p:
-            preco = float(p['novo_preco'] if p.get('em_oferta') else p['preco'])
-            subtotal = preco * qtd
-            total_geral += subtotal
-            p['quantidade_carrinho'] = qtd
-            p['subtotal'] = subtotal
-            produtos_no_carrinho.append(p)
-    return render_template("carrinho.html", produtos=produtos_no_carrinho, total=total_geral, config=config)
-
-@app.route('/remover_carrinho/<id_produto>')
-def remover_carrinho(id_produto):
-    carrinho = session.get('carrinho', {})
-    id_p = str(id_produto)
-    if id_p in carrinho:
-        carrinho.pop(id_p)
-        session.modified = True
-    flash("Item removido do carrinho.")
+    resumo = carrinho.calcular_carrinho(carrinho.itens())
+    produtos_no_carrinho = [dict(item['produto'], quantidade_carrinho=item['quantidade'], subtotal=item['subtotal']) for item in resumo['itens']]
+    return render_template("carrinho.html", produtos=produtos_no_carrinho, total=resumo['subtotal'], config=config)
+
+def _resposta_carrinho(itens_carrinho, mensagem):
+    # Chamadas com JSON (fetch) recebem o carrinho recalculado; formulários voltam para a página
+    if request.is_json:
+        resumo = carrinho.calcular_carrinho(itens_carrinho)
+        return jsonify({'itens': {item['produto']['id']: item['quantidade'] for item in resumo['itens']},
+                        'quantidade_total': resumo['quantidade_total'], 'subtotal': resumo['subtotal'],
+                        'total_pix': resumo['total_pix']})
+    flash(mensagem)
     return redirect(url_for('exibir_carrinho'))
 
+@app.route('/remover_carrinho/<id_produto>', methods=['GET', 'POST'])
+def remover_carrinho(id_produto):
+    return _resposta_carrinho(carrinho.remover(id_produto), "Item removido do carrinho.")
+
+@app.route('/carrinho/quantidade/<id_produto>', methods=['POST'])
+def atualizar_quantidade_carrinho(id_produto):
+    dados = request.get_json(silent=True) if request.is_json else request.form
+    quantidade = (dados or {}).get('quantidade')
+    try:
+        quantidade = int(quantidade)
+    except (TypeError, ValueError):
+        if request.is_json: return jsonify({'erro': 'quantidade inválida'}), 400
+        flash("Quantidade inválida.")
+        return redirect(url_for('exibir_carrinho'))
+    return _resposta_carrinho(carrinho.atualizar_quantidade(id_produto, quantidade), "Carrinho atualizado.")
+
 # --- SISTEMA DE CLIENTE ---
 @app.route("/cliente/login", methods=['GET', 'POST'])
 def cliente_login():
     if request.method == 'POST':
         email = request.form.get('email')
         senha = request.form.get('senha')
-        cliente = database.verificar_login_cliente(email, senha)
+        try:
+            cliente = autenticacao.login_cliente(email, senha, request.remote_addr)
+        except (autenticacao.LoginBloqueado, autenticacao.AutenticacaoOcupada) as e:
+            flash(str(e) or "Muitos acessos no momento, tente novamente em instantes.")
+            return render_template("cliente_login.html"), 429 if isinstance(e, autenticacao.LoginBloqueado) else 503
         if cliente:
             session['cliente_id'] = cliente['id']
             session['cliente_nome'] = cliente['nome']
             session['cliente_email'] = cliente['email']
+            # O carrinho montado antes do login passa para a conta (e vale em outros aparelhos)
+            carrinho.mesclar_no_login(cliente['id'])
             flash(f"Bem-vindo de volta, {cliente['nome']}!")
             return redirect(url_for('homepage'))
         else:
@@ -235,15 +404,16 @@ def meus_pedidos():
         flash("Por favor, faça login para ver seus pedidos.")
         return redirect(url_for('cliente_login'))
     config, banner_pagamento = load_shop_config()
-    todas_vendas = database.get_vendas()
-    pedidos_cliente = [v for v in todas_vendas if v.get('email') == session.get('cliente_email')]
-    return render_template("meus_pedidos.html", pedidos=pedidos_cliente, config=config, banner_pagamento=banner_pagamento)
+    pedidos_cliente, proximo_cursor = database.get_vendas_por_cliente(session.get('cliente_email'), PEDIDOS_POR_PAGINA, cursor=request.args.get('cursor', type=int))
+    proxima_url = url_for('meus_pedidos', cursor=proximo_cursor) if proximo_cursor else None
+    return render_template("meus_pedidos.html", pedidos=pedidos_cliente, config=config, banner_pagamento=banner_pagamento, proxima_url=proxima_url)
 
 @app.route("/cliente/logout")
 def cliente_logout():
     session.pop('cliente_id', None)
     session.pop('cliente_nome', None)
     session.pop('cliente_email', None)
+    carrinho.esquecer()
     flash("Você saiu da sua conta.")
     return redirect(url_for('homepage'))
 
@@ -251,7 +421,12 @@ def cliente_logout():
 def cliente_cadastro_rota():
     if request.method == 'POST':
         dados = {'nome': request.form.get('nome'), 'cpf': request.form.get('cpf'), 'email': request.form.get('email'), 'telefone': request.form.get('telefone'), 'senha': request.form.get('senha')}
-        if database.salvar_novo_cliente(dados):
+        try:
+            senha_hash = autenticacao.gerar_hash(dados['senha'] or '')
+        except autenticacao.AutenticacaoOcupada:
+            flash("Muitos acessos no momento, tente novamente em instantes.")
+            return render_template("cadastro_cliente.html"), 503
+        if database.salvar_novo_cliente(dados, senha_hash):
             flash("Conta criada com sucesso! Faça seu login.")
             return redirect(url_for('cliente_login'))
         else:
@@ -274,7 +449,12 @@ def nova_senha():
     if not session.get('id_recuperacao'): return redirect(url_for('recuperar_senha'))
     if request.method == 'POST':
         if request.form.get('senha') == request.form.get('confirmacao'):
-            database.atualizar_senha_cliente(session['id_recuperacao'], request.form.get('senha'))
+            try:
+                senha_hash = autenticacao.gerar_hash(request.form.get('senha') or '')
+            except autenticacao.AutenticacaoOcupada:
+                flash("Muitos acessos no momento, tente novamente em instantes.")
+                return redirect(url_for('nova_senha'))
+            database.atualizar_senha_cliente(session['id_recuperacao'], senha_hash)
             session.pop('id_recuperacao', None)
             flash("Senha alterada com sucesso!")
             return redirect(url_for('cliente_login'))
@@ -286,7 +466,12 @@ def nova_senha():
 @app.route("/admin/login", methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
-        if database.is_valid_login(request.form.get('username'), request.form.get('password')):
+        try:
+            admin = autenticacao.login_admin(request.form.get('username'), request.form.get('password'), request.remote_addr)
+        except (autenticacao.LoginBloqueado, autenticacao.AutenticacaoOcupada) as e:
+            flash(str(e) or "Muitos acessos no momento, tente novamente em instantes.")
+            return render_template("admin_login.html"), 429 if isinstance(e, autenticacao.LoginBloqueado) else 503
+        if admin:
             session['admin_logged_in'] = True
             return redirect(url_for('admin_dashboard'))
         flash("Dados incorretos.")
@@ -300,18 +485,49 @@ def admin_logout():
 @app.route("/admin/dashboard")
 def admin_dashboard():
     if not session.get('admin_logged_in'): return redirect(url_for('admin_login'))
-    vendas = database.get_vendas()
-    produtos = database.get_produtos()
-    clientes = database.get_clientes()
+    stats = database.get_estatisticas_dashboard()
+    produtos, cursor_produtos = database.get_produtos_pagina(PRODUTOS_POR_PAGINA, cursor=request.args.get('cursor_produtos'))
+    vendas, cursor_vendas = database.get_vendas_pagina(PEDIDOS_POR_PAGINA, cursor=request.args.get('cursor_vendas', type=int))
     config, _ = load_shop_config()
-    return render_template("admin_dashboard.html", vendas=vendas, produtos=produtos, clientes=clientes, config=config)
+    proximos_produtos_url = url_for('admin_dashboard', cursor_produtos=cursor_produtos, cursor_vendas=request.args.get('cursor_vendas')) if cursor_produtos else None
+    proximas_vendas_url = url_for('admin_dashboard', cursor_vendas=cursor_vendas, cursor_produtos=request.args.get('cursor_produtos')) if cursor_vendas else None
+    return render_template("admin_dashboard.html", stats=stats, vendas=vendas, produtos=produtos, config=config, proximos_produtos_url=proximos_produtos_url, proximas_vendas_url=proximas_vendas_url)
 
 @app.route("/admin/pedidos")
 def admin_pedidos():
     if not session.get('admin_logged_in'): return redirect(url_for('admin_login'))
-    pedidos = database.get_vendas()
+    pedidos, proximo_cursor = database.get_vendas_pagina(PEDIDOS_POR_PAGINA, cursor=request.args.get('cursor', type=int))
     config, _ = load_shop_config()
-    return render_template("admin_pedidos.html", pedidos=pedidos, config=config)
+    proxima_url = url_for('admin_pedidos', cursor=proximo_cursor) if proximo_cursor else None
+    return render_template("admin_pedidos.html", pedidos=pedidos, config=config, proxima_url=proxima_url)
+
+@app.route("/admin/relatorios/vendas")
+def admin_relatorio_vendas():
+    """Resumo por dia/hora e status (?inicio=AAAA-MM-DD&fim=AAAA-MM-DD&granularidade=dia|hora&status=)"""
+    if not session.get('admin_logged_in'): return redirect(url_for('admin_login'))
+    try:
+        return jsonify(relatorios.resumo(request.args.get('inicio'), request.args.get('fim'),
+                                         request.args.get('granularidade', 'dia'), request.args.get('status')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/admin/relatorios/vendas.csv")
+def admin_relatorio_vendas_csv():
+    """CSV em streaming: ?tipo=resumo (por período) ou ?tipo=vendas (uma linha por venda)"""
+    if not session.get('admin_logged_in'): return redirect(url_for('admin_login'))
+    inicio, fim, status = request.args.get('inicio'), request.args.get('fim'), request.args.get('status')
+    tipo = request.args.get('tipo', 'resumo')
+    try:
+        if tipo == 'vendas':
+            linhas = relatorios.csv_vendas(inicio, fim, status)
+        else:
+            linhas = relatorios.csv_resumo(inicio, fim, request.args.get('granularidade', 'dia'), status)
+        de, ate = relatorios.intervalo(inicio, fim)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    nome = f"vendas-{tipo}-{de}-a-{fim or 'hoje'}.csv"
+    return Response(stream_with_context(linhas), mimetype="text/csv",
+                    headers={"Content-Disposition": f'attachment; filename="{nome}"'})
 
 @app.route("/admin/configuracoes", methods=['GET', 'POST'])
 def admin_configuracoes():
@@ -323,20 +539,21 @@ def admin_configuracoes():
             if valor is not None: database.update_configuracao(campo, valor)
         
         # Upload da Logo
-        file_logo = request.files.get('logo_img')
-        if file_logo and allowed_file(file_logo.filename):
-            filename = f"logo_{int(datetime.datetime.now().timestamp())}_{secure_filename(file_logo.filename)}"
-            file_logo.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            database.update_configuracao('logo_img', f'/static/uploads/{filename}')
-
-        # Upload dos 4 Banners (Grid Automático)
-        for i in range(1, 5):
-            file_key = f'banner_principal_{i}'
-            file = request.files.get(file_key)
-            if file and allowed_file(file.filename):
-                filename = f"banner_{i}_{int(datetime.datetime.now().timestamp())}_{secure_filename(file.filename)}"
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                database.update_configuracao(file_key, f'/static/uploads/{filename}')
+        try:
+            file_logo = request.files.get('logo_img')
+            if file_logo and allowed_file(file_logo.filename):
+                filename = midia.salvar_upload(file_logo, app.config['UPLOAD_FOLDER'])
+                database.update_configuracao('logo_img', f'/static/uploads/{filename}')
+
+            # Upload dos 4 Banners (Grid Automático)
+            for i in range(1, 5):
+                file_key = f'banner_principal_{i}'
+                file = request.files.get(file_key)
+                if file and allowed_file(file.filename):
+                    filename = midia.salvar_upload(file, app.config['UPLOAD_FOLDER'])
+                    database.update_configuracao(file_key, f'/static/uploads/{filename}')
+        except midia.ArquivoMuitoGrande as e:
+            flash(f"Arquivo não enviado: {e}")
 
         flash("Configurações atualizadas!")
         return redirect(url_for('admin_dashboard'))
@@ -348,10 +565,12 @@ def admin_upload_capa_cat():
     if not session.get('admin_logged_in'): return redirect(url_for('admin_login'))
     categoria, file = request.form.get('categoria'), request.files.get('imagem_capa')
     if file and categoria:
-        filename = secure_filename(f"capa_{categoria.lower()}.png")
-        file.save(os.path.join(UPLOAD_FOLDER_CAT, filename))
-        database.update_capa_categoria(categoria, f"uploads/categorias/{filename}")
-        flash(f'Capa de {categoria} atualizada!')
+        try:
+            filename = midia.salvar_upload(file, UPLOAD_FOLDER_CAT)
+            database.update_capa_categoria(categoria, f"uploads/categorias/{filename}")
+            flash(f'Capa de {categoria} atualizada!')
+        except midia.ArquivoMuitoGrande as e:
+            flash(f"Arquivo não enviado: {e}")
     return redirect(url_for('admin_dashboard'))
 
 @app.route("/admin/edit", methods=['GET', 'POST'])
@@ -360,14 +579,26 @@ def admin_edit(id_produto=None):
     if not session.get('admin_logged_in'): return redirect(url_for('admin_login'))
     if request.method == 'POST':
         def to_f(v): return float(str(v).replace(',', '.')) if v else 0.0
-        dados = {'id': id_produto or request.form.get('id'), 'nome': request.form.get('nome'), 'categoria': request.form.get('categoria'), 'preco': to_f(request.form.get('preco')), 'descricao': request.form.get('descricao'), 'em_oferta': 'em_oferta' in request.form, 'novo_preco': to_f(request.form.get('novo_preco')), 'oferta_fim': request.form.get('oferta_fim'), 'desconto_pix': int(request.form.get('desconto_pix') or 0), 'estoque': int(request.form.get('estoque') or 0), 'frete_gratis_valor': to_f(request.form.get('frete_gratis_valor')), 'prazo_entrega': request.form.get('prazo_entrega'), 'tempo_preparo': request.form.get('tempo_preparo')}
-        for i in range(1, 5):
-            f = request.files.get(f'imagem_{i}')
-            if f and allowed_file(f.filename):
-                fname = secure_filename(f.filename)
-                f.save(os.path.join(app.config['UPLOAD_FOLDER'], fname))
-                dados[f'img_path_{i}'] = f'/static/uploads/{fname}'
+        dados = {'id': id_produto or request.form.get('id'), 'nome': request.form.get('nome'), 'categoria': request.form.get('categoria'), 'preco': to_f(request.form.get('preco')), 'descricao': request.form.get('descricao'), 'em_oferta': 'em_oferta' in request.form, 'novo_preco': to_f(request.form.get('novo_preco')), 'oferta_fim': request.form.get('oferta_fim'), 'desconto_pix': int(request.form.get('desconto_pix') or 0), 'estoque': int(request.form.get('estoque') or 0), 'frete_gratis_valor': to_f(request.form.get('frete_gratis_valor')), 'prazo_entrega': request.form.get('prazo_entrega'), 'tempo_preparo': request.form.get('tempo_preparo'), 'largura_cm': request.form.get('largura_cm'), 'altura_cm': request.form.get('altura_cm'), 'comprimento_cm': request.form.get('comprimento_cm'), 'peso_kg': request.form.get('peso_kg')}
+        # Mantém as mídias já cadastradas quando nenhum arquivo novo é enviado
+        atual = database.get_produto_por_id(dados['id']) if dados['id'] else None
+        for campo in ('img_path_1', 'img_path_2', 'img_path_3', 'img_path_4', 'video_path'):
+            if atual and atual.get(campo): dados[campo] = atual[campo]
+        try:
+            for i in range(1, 5):
+                f = request.files.get(f'imagem_{i}')
+                if f and allowed_file(f.filename):
+                    fname = midia.salvar_upload(f, app.config['UPLOAD_FOLDER'])
+                    dados[f'img_path_{i}'] = f'/static/uploads/{fname}'
+            video = request.files.get('video')
+            if video and allowed_file(video.filename):
+                fname = midia.salvar_upload(video, app.config['UPLOAD_FOLDER'])
+                dados['video_path'] = f'/static/uploads/{fname}'
+        except midia.ArquivoMuitoGrande as e:
+            flash(f"Arquivo não enviado: {e}")
+            return redirect(request.url)
         database.add_or_update_produto(dados)
+        ofertas.reagendar()
         flash("Produto salvo!")
         return redirect(url_for('admin_dashboard'))
     produto = database.get_produto_por_id(id_produto) if id_produto else None
@@ -384,38 +615,112 @@ def admin_delete(id_produto):
 # --- APIs E FRETE ---
 @app.route("/calcular_frete", methods=['POST'])
 def calcular_frete_rota():
-    dados = request.json
-    produto = database.get_produto_por_id(dados.get('produto_id'))
-    if not produto: return jsonify({"error": "Produto não encontrado"}), 404
+    # {"cep", "produto_id", "quantidade"} cota um produto; {"cep", "carrinho": true} o carrinho inteiro
+    dados = request.get_json(silent=True) or {}
+    if dados.get('carrinho'):
+        resumo = carrinho.calcular_carrinho(carrinho.itens())
+        if not resumo['itens']: return jsonify({"error": "Carrinho vazio"}), 404
+    else:
+        resumo = carrinho.calcular_carrinho({dados.get('produto_id'): dados.get('quantidade') or 1})
+        if not resumo['itens']: return jsonify({"error": "Produto não encontrado"}), 404
     config, _ = load_shop_config()
-    opcoes = melhorenvio.calcular_frete(cep_destino=dados.get('cep'), preco_produto=float(produto['novo_preco'] if produto.get('em_oferta') else produto['preco']), token_melhor_envio=config.get('melhor_envio_token'), cep_origem_config=config.get('cep_origem'))
-    return jsonify(opcoes)
+    return jsonify(cotar_frete(resumo, dados.get('cep'), config))
+
+def cotar_frete(resumo, cep, config):
+    """Opções de frete do Melhor Envio para os itens do resumo (cotações em cache)"""
+    itens = [(item['produto'], item['quantidade'], item['preco_unitario']) for item in resumo['itens']]
+    return melhorenvio.cotar_carrinho(cep, itens, token_melhor_envio=config.get('melhor_envio_token'), cep_origem_config=config.get('cep_origem'))
+
+def frete_escolhido(resumo, cep, id_servico, config):
+    """
+    Preço do serviço de frete escolhido no checkout, cotado de novo no servidor
+    (o valor do formulário não vale). None se o serviço não estiver na cotação.
+    Loja sem token do Melhor Envio não cobra frete.
+    """
+    if not config.get('melhor_envio_token'):
+        return 0.0
+    for opcao in cotar_frete(resumo, cep, config):
+        if str(opcao['id']) == str(id_servico):
+            return opcao['preco']
+    return None
+
+@app.route("/admin/produto/<id_produto>/vendas")
+def admin_vendas_produto(id_produto):
+    if not session.get('admin_logged_in'): return redirect(url_for('admin_login'))
+    vendas, proximo_cursor = database.get_vendas_do_produto(id_produto, PEDIDOS_POR_PAGINA, cursor=request.args.get('cursor', type=int))
+    return jsonify({'resumo': database.get_resumo_vendas_produto(id_produto), 'vendas': vendas, 'proximo_cursor': proximo_cursor})
+
+@app.route("/admin/cache_frete")
+def admin_cache_frete():
+    if not session.get('admin_logged_in'): return redirect(url_for('admin_login'))
+    return jsonify(melhorenvio.estatisticas_cache())
+
+@app.route("/admin/cache_paginas")
+def admin_cache_paginas():
+    if not session.get('admin_logged_in'): return redirect(url_for('admin_login'))
+    return jsonify(estatisticas_paginas())
+
+@app.route("/admin/metrics")
+def admin_metrics():
+    # Além da sessão do admin, aceita o token de METRICAS_TOKEN (coletor do Prometheus)
+    token = os.getenv("METRICAS_TOKEN")
+    autorizado = session.get('admin_logged_in') or (token and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"))
+    if not autorizado: return redirect(url_for('admin_login'))
+    return Response(metricas.exportar_prometheus(), mimetype="text/plain; version=0.0.4")
 
 # --- ROTA DE PROCESSAR PAGAMENTO ---
 @app.route("/processar_pagamento", methods=['POST'])
 def processar_pagamento():
     try:
-        total_real = float(request.form.get('total_final'))
         nome = request.form.get('nome')
         email = request.form.get('email')
         whatsapp = request.form.get('whatsapp')
         id_prod = request.form.get('id_produto')
 
+        # O total é recalculado no servidor (frete inclusive); do formulário só vêm o serviço de frete e o método
         if id_prod and id_prod != 'carrinho_multi':
-            p = database.get_produto_por_id(id_prod)
+            resumo = carrinho.calcular_carrinho({id_prod: request.form.get('quantidade', 1, type=int)})
+            p = resumo['itens'][0]['produto'] if resumo['itens'] else None
             nome_pedido = p['nome'] if p else "Produto da Loja"
             item_pagamento = p if p else {'nome': nome_pedido, 'id': id_prod}
         else:
+            resumo = carrinho.calcular_carrinho(carrinho.itens())
             nome_pedido = "Pedido em Carrinho"
             item_pagamento = {'nome': nome_pedido, 'id': 'carrinho'}
 
-        id_v = database.registrar_venda(nome, email, whatsapp, nome_pedido, 1, total_real)
-        link = gerar_link_pagamento(item_pagamento, id_v, total_real)
+        if not resumo['itens']:
+            flash("Seu carrinho está vazio.")
+            return redirect(url_for('homepage'))
+        config, _ = load_shop_config()
+        frete = frete_escolhido(resumo, request.form.get('cep'), request.form.get('frete_servico'), config)
+        if frete is None:
+            flash("Não foi possível confirmar o frete escolhido. Calcule o frete novamente.")
+            return redirect(request.referrer or url_for('homepage'))
+        total_real = carrinho.total_a_pagar(resumo, request.form.get('metodo_pagamento'), frete)
+
+        # Clique duplo/reenvio do mesmo pedido reaproveita a venda e o link já criados
+        itens = {item['produto']['id']: item['quantidade'] for item in resumo['itens']}
+        itens_venda = [(item['produto']['id'], item['produto']['nome'], item['quantidade'], item['preco_unitario']) for item in resumo['itens']]
+        chave = apimercadopago.chave_idempotencia(email, itens, total_real)
+        venda = {}
+        def registrar_venda():
+            # A venda nasce com o estoque dos itens reservado até o pagamento (ou até vencer)
+            venda['id'] = estoque.registrar_venda_reservando(nome, email, whatsapp, nome_pedido, resumo['quantidade_total'], total_real, itens_venda)
+            return venda['id']
+        try:
+            link = apimercadopago.checkout_idempotente(chave, registrar_venda, item_pagamento, total_real)
+        except estoque.EstoqueInsuficiente as e:
+            produto = database.get_produto_por_id(e.produto_id)
+            flash(f"Estoque insuficiente para {produto['nome'] if produto else 'um dos itens'}. Ajuste a quantidade.")
+            return redirect(url_for('exibir_carrinho') if id_prod in (None, '', 'carrinho_multi') else url_for('produto_detalhes', id_produto=id_prod))
         
         if link:
-            session.pop('carrinho', None)
+            carrinho.esvaziar()
             return redirect(link)
         else:
+            # Sem link não há como pagar: cancela a venda para devolver a reserva na hora
+            if venda.get('id'):
+                database.atualizar_status_venda(venda['id'], 'cancelado')
             return "Erro ao gerar link de pagamento. Verifique suas chaves de API."
     except Exception as e: 
         return f"Erro no processamento de pagamento: {e}"
@@ -424,19 +729,13 @@ def processar_pagamento():
 @app.route('/webhook/mercadopago', methods=['POST', 'GET'])
 def webhook_mercadopago():
     data = request.args if request.method == 'GET' else (request.json if request.is_json else request.form)
-    id_venda = data.get('external_reference')
-    status = data.get('status') or data.get('collection_status')
     payment_id = data.get('data.id') or (data.get('data', {}).get('id') if isinstance(data, dict) else None)
-    
-    if payment_id:
-        status_oficial, ref_oficial = consultar_status_mp(payment_id)
-        if status_oficial:
-            status = status_oficial
-            id_venda = ref_oficial
+    payment_id = payment_id or request.args.get('data.id') or data.get('payment_id') or data.get('collection_id')
+    tipo = data.get('type') or data.get('topic') or request.args.get('type') or request.args.get('topic')
 
-    if id_venda and status == 'approved':
-        database.atualizar_status_venda(id_venda, 'pago')
-        print(f"✅ Venda {id_venda} aprovada!")
+    if payment_id and tipo in (None, 'payment'):
+        # A confirmação com a API do Mercado Pago é feita pelo worker da fila
+        webhooks.receber_notificacao(payment_id)
 
     if request.method == 'GET':
         return redirect(url_for('sucesso'))
@@ -450,11 +749,8 @@ def sucesso():
 # --- ADICIONAR AO CARRINHO ---
 @app.route('/adicionar_carrinho/<id_produto>', methods=['POST'])
 def adicionar_carrinho(id_produto):
-    quantidade = int(request.form.get('quantidade', 1))
-    if 'carrinho' not in session: session['carrinho'] = {}
-    carrinho = session['carrinho']
-    carrinho[str(id_produto)] = carrinho.get(str(id_produto), 0) + quantidade
-    session.modified = True
+    quantidade = request.form.get('quantidade', 1, type=int) or 1
+    carrinho.adicionar(id_produto, quantidade)
     
     if request.form.get('acao') == 'comprar': 
         return redirect(url_for('checkout', id_produto=id_produto, qtd=quantidade))
@@ -1,26 +1,140 @@
 import os
+import json
+import math
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 import requests
+from requests.adapters import HTTPAdapter
+import database
+import metricas
+from cache import CacheLRU
 
-def calcular_frete(cep_destino, preco_produto, token_melhor_envio, cep_origem_config):
-    """
-    Calcula o frete usando a API do Melhor Envio com dados dinâmicos do Admin.
-    """
-    # Se não vier token do banco, tenta pegar do ambiente ou retorna erro
-    token = token_melhor_envio
-    cep_origem = "".join(filter(str.isdigit, str(cep_origem_config)))
+# Pode apontar para um servidor local falso em testes/benchmarks
+URL_CALCULO = os.getenv("MELHOR_ENVIO_URL", "https://www.melhorenvio.com.br/api/v2/me/shipment/calculate")
 
-    if not token or len(token) < 10:
-        print("ERRO: Token do Melhor Envio não encontrado nas configurações do banco.")
-        return []
+# Pacote usado quando o produto não informa dimensões (cm / kg)
+PACOTE_PADRAO = {"width": 11, "height": 11, "length": 16, "weight": 0.5}
+# Limites de um volume aceitos pelas transportadoras (cm / kg); acima disso o
+# carrinho é dividido em mais pacotes
+PACOTE_MAX_PESO = 30.0
+PACOTE_MAX_LADO = 100.0
+PACOTE_MAX_SOMA_LADOS = 200.0
+
+# Cotação de carrinho: pacotes cotados em paralelo, todos dentro do prazo total (s)
+FRETE_THREADS = int(os.getenv("FRETE_THREADS", "8"))
+FRETE_PRAZO_TOTAL = 8.0
+FRETE_TIMEOUT_HTTP = 10.0
+
+# Cotações para a mesma origem/destino/pacote/seguro mudam pouco em algumas horas
+FRETE_CACHE_TTL = 6 * 3600
+FRETE_CACHE_MAX_ITENS = 2048
+# Faixa (R$) em que o valor do seguro é arredondado para cima ao montar a chave
+FRETE_FAIXA_SEGURO = 10.0
+# Segunda camada do cache no SQLite, compartilhada entre os workers
+FRETE_CACHE_PERSISTENTE = os.getenv("FRETE_CACHE_PERSISTENTE", "1") != "0"
+
+# Sessão HTTP reaproveitada (keep-alive) por todo o processo
+_sessao = requests.Session()
+_sessao.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=1))
+
+_cache = CacheLRU(FRETE_CACHE_MAX_ITENS, FRETE_CACHE_TTL, eventos=("hits_memoria", "hits_banco", "misses"))
 
-    url = "https://www.melhorenvio.com.br/api/v2/me/shipment/calculate"
-    cep_destino = "".join(filter(str.isdigit, str(cep_destino)))
+_executor = {'pool': None, 'pid': None}
+_executor_lock = threading.Lock()
 
+def estatisticas_cache():
+    """Acertos/erros do cache de cotações deste processo (para dimensionar o cache)"""
+    return _cache.estatisticas()
+
+def _so_digitos(valor):
+    return "".join(filter(str.isdigit, str(valor or "")))
+
+def _faixa_seguro(preco_produto):
     try:
         valor_seguro = float(preco_produto)
         if valor_seguro < 0.1: valor_seguro = 0.1
     except:
         valor_seguro = 10.0
+    # Arredonda para cima: a cotação usa exatamente o valor da chave do cache
+    return math.ceil(valor_seguro / FRETE_FAIXA_SEGURO) * FRETE_FAIXA_SEGURO
+
+def _chave_cache(token, cep_origem, cep_destino, pacote, valor_seguro):
+    conta = hashlib.sha1(token.encode()).hexdigest()[:10]
+    dims = "x".join(str(pacote[k]) for k in ("width", "height", "length", "weight"))
+    return f"{conta}:{cep_origem}:{cep_destino}:{dims}:{valor_seguro:.2f}"
+
+def _obter_pool():
+    with _executor_lock:
+        # Threads não atravessam o fork do gunicorn: cada worker cria o seu pool
+        if _executor['pid'] != os.getpid():
+            _executor['pool'] = ThreadPoolExecutor(max_workers=FRETE_THREADS, thread_name_prefix="frete")
+            _executor['pid'] = os.getpid()
+        return _executor['pool']
+
+# --- EMPACOTAMENTO ---
+
+def _medidas(produto):
+    """Lados da embalagem de uma unidade (maior primeiro) e peso; o que faltar vem do pacote padrão"""
+    lados = [float(produto.get(coluna) or PACOTE_PADRAO[chave]) for coluna, chave in
+             (('comprimento_cm', 'length'), ('largura_cm', 'width'), ('altura_cm', 'height'))]
+    return sorted(lados, reverse=True), float(produto.get('peso_kg') or PACOTE_PADRAO['weight'])
+
+def _cabe(pacote, lados, peso):
+    comprimento = max(pacote['comprimento'], lados[0])
+    largura = max(pacote['largura'], lados[1])
+    altura = pacote['altura'] + lados[2]
+    return (pacote['peso'] + peso <= PACOTE_MAX_PESO
+            and max(comprimento, largura, altura) <= PACOTE_MAX_LADO
+            and comprimento + largura + altura <= PACOTE_MAX_SOMA_LADOS)
+
+def montar_pacotes(itens):
+    """
+    Junta as unidades do carrinho [(produto, quantidade, preco_unitario)] em pacotes:
+    as maiores primeiro, cada uma empilhada (pelo lado menor) no primeiro pacote
+    em que ainda cabe dentro dos limites. Retorna [(pacote, valor_seguro)] no
+    formato da API. Unidade que sozinha passa dos limites vai num pacote próprio.
+    """
+    unidades = []
+    for produto, quantidade, preco in itens:
+        lados, peso = _medidas(produto)
+        unidades += [(lados, peso, float(preco or 0))] * max(int(quantidade or 0), 0)
+    unidades.sort(key=lambda u: (u[0][0] * u[0][1] * u[0][2], u[1]), reverse=True)
+
+    pacotes = []
+    for lados, peso, preco in unidades:
+        pacote = next((p for p in pacotes if _cabe(p, lados, peso)), None)
+        if pacote is None:
+            pacote = {'comprimento': 0.0, 'largura': 0.0, 'altura': 0.0, 'peso': 0.0, 'valor': 0.0}
+            pacotes.append(pacote)
+        pacote['comprimento'] = max(pacote['comprimento'], lados[0])
+        pacote['largura'] = max(pacote['largura'], lados[1])
+        pacote['altura'] += lados[2]
+        pacote['peso'] += peso
+        pacote['valor'] += preco
+    # Centímetros inteiros e peso em gramas: pacotes parecidos caem na mesma chave do cache
+    return [({"width": math.ceil(p['largura']), "height": math.ceil(p['altura']),
+              "length": math.ceil(p['comprimento']), "weight": round(p['peso'], 3)}, p['valor'])
+            for p in pacotes]
+
+# --- COTAÇÃO ---
+
+def _cotar_pacote(token, cep_origem, cep_destino, pacote, valor_seguro, timeout=FRETE_TIMEOUT_HTTP):
+    """Opções (ordenadas por preço) para um pacote; cotações iguais são servidas do cache"""
+    chave = _chave_cache(token, cep_origem, cep_destino, pacote, valor_seguro)
+    opcoes = _cache.get(chave)
+    if opcoes is not None:
+        _cache.contar("hits_memoria")
+        return opcoes
+    if FRETE_CACHE_PERSISTENTE:
+        salvo = database.get_cache_frete(chave)
+        if salvo:
+            opcoes, expira_em = json.loads(salvo[0]), salvo[1]
+            _cache.set(chave, opcoes, expira_em)
+            _cache.contar("hits_banco")
+            return opcoes
+    _cache.contar("misses")
 
     headers = {
         "Accept": "application/json",
@@ -33,20 +147,13 @@ def calcular_frete(cep_destino, preco_produto, token_melhor_envio, cep_origem_co
         "from": {"postal_code": cep_origem},
         "to": {"postal_code": cep_destino},
         "products": [
-            {
-                "id": "item_venda",
-                "width": 11,
-                "height": 11,
-                "length": 16,
-                "weight": 0.5,
-                "insurance_value": valor_seguro,
-                "quantity": 1
-            }
+            dict(pacote, id="item_venda", insurance_value=valor_seguro, quantity=1)
         ]
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        with metricas.medir_api('melhorenvio', 'cotacao'):
+            response = _sessao.post(URL_CALCULO, json=payload, headers=headers, timeout=timeout)
         if response.status_code == 200:
             opcoes = response.json()
             validas = []
@@ -60,9 +167,81 @@ def calcular_frete(cep_destino, preco_produto, token_melhor_envio, cep_origem_co
                         "prazo": opt.get("delivery_range", {}).get("max") or opt.get("delivery_time"),
                         "logo": opt.get("company", {}).get("picture")
                     })
-            return sorted(validas, key=lambda x: x['preco'])
+            validas = sorted(validas, key=lambda x: x['preco'])
+            # Só guarda cotações com resultado; erros e listas vazias são refeitos
+            if validas:
+                expira_em = time.time() + FRETE_CACHE_TTL
+                _cache.set(chave, validas, expira_em)
+                if FRETE_CACHE_PERSISTENTE:
+                    database.salvar_cache_frete(chave, json.dumps(validas), expira_em)
+            return validas
         else:
             return []
     except Exception as e:
         print(f"Erro Conexão Melhor Envio: {e}")
         return []
+
+def _juntar_opcoes(cotacoes):
+    """
+    Une as cotações [(opcoes, n_pacotes)] numa lista só: fica o serviço que atende
+    todos os pacotes, com o preço somado e o maior prazo. Ordenada por preço.
+    """
+    por_servico = None
+    for opcoes, n_pacotes in cotacoes:
+        atuais = {opt['id']: opt for opt in opcoes}
+        if por_servico is None:
+            por_servico = {i: dict(opt, preco=opt['preco'] * n_pacotes, pacotes=n_pacotes) for i, opt in atuais.items()}
+            continue
+        for id_servico in list(por_servico):
+            opt = atuais.get(id_servico)
+            if opt is None:
+                por_servico.pop(id_servico)
+                continue
+            junto = por_servico[id_servico]
+            junto['preco'] += opt['preco'] * n_pacotes
+            junto['pacotes'] += n_pacotes
+            if opt.get('prazo') is not None:
+                junto['prazo'] = max(junto.get('prazo') or 0, opt['prazo'])
+    for opt in (por_servico or {}).values():
+        opt['preco'] = round(opt['preco'], 2)
+    return sorted((por_servico or {}).values(), key=lambda x: x['preco'])
+
+def cotar_carrinho(cep_destino, itens, token_melhor_envio, cep_origem_config, prazo=FRETE_PRAZO_TOTAL):
+    """
+    Frete do carrinho inteiro [(produto, quantidade, preco_unitario)]: empacota os
+    itens, cota os pacotes distintos em paralelo e junta o resultado. Se algum
+    pacote não tiver cotação dentro do prazo (segundos) retorna [].
+    """
+    token = token_melhor_envio
+    cep_origem = _so_digitos(cep_origem_config)
+    if not token or len(token) < 10:
+        print("ERRO: Token do Melhor Envio não encontrado nas configurações do banco.")
+        return []
+    cep_destino = _so_digitos(cep_destino)
+
+    # Pacotes iguais (mesmas medidas e faixa de seguro) são cotados uma vez só
+    distintos = {}
+    for pacote, valor in montar_pacotes(itens):
+        chave = (tuple(pacote.items()), _faixa_seguro(valor))
+        distintos[chave] = distintos.get(chave, 0) + 1
+    if not distintos:
+        return []
+
+    if len(distintos) == 1:
+        (pacote, valor_seguro), n_pacotes = next(iter(distintos.items()))
+        opcoes = _cotar_pacote(token, cep_origem, cep_destino, dict(pacote), valor_seguro, min(prazo, FRETE_TIMEOUT_HTTP))
+        return _juntar_opcoes([(opcoes, n_pacotes)]) if opcoes else []
+
+    pool = _obter_pool()
+    futuros = {pool.submit(_cotar_pacote, token, cep_origem, cep_destino, dict(pacote), valor_seguro,
+                           min(prazo, FRETE_TIMEOUT_HTTP)): n_pacotes
+               for (pacote, valor_seguro), n_pacotes in distintos.items()}
+    _, pendentes = wait(futuros, timeout=prazo)
+    if pendentes:
+        for futuro in pendentes: futuro.cancel()
+        print(f"Frete: {len(pendentes)} de {len(futuros)} pacote(s) sem cotação em {prazo}s")
+        return []
+    cotacoes = [(futuro.result(), n_pacotes) for futuro, n_pacotes in futuros.items()]
+    if not all(opcoes for opcoes, _ in cotacoes):
+        return []
+    return _juntar_opcoes(cotacoes)
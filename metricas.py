@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import glob
+import random
+import inspect
+import cProfile
+import tempfile
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from flask import g, request
+
+# Desliga toda a instrumentação (hooks, wrappers e gravação) com METRICAS=0
+METRICAS_ATIVAS = os.getenv("METRICAS", "1") != "0"
+# Limites (segundos) dos buckets dos histogramas de latência
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Cada worker do gunicorn grava seus números aqui; o /admin/metrics soma todos
+METRICAS_PASTA = os.getenv("METRICAS_PASTA", os.path.join(tempfile.gettempdir(), "loja-metricas"))
+METRICAS_INTERVALO_GRAVACAO = 5.0
+# Fração das requisições perfiladas com cProfile (0 = desligado) e a partir de
+# quantos segundos o perfil é salvo em METRICAS_PERFIL_PASTA
+PERFIL_AMOSTRA = float(os.getenv("METRICAS_PERFIL_AMOSTRA", "0"))
+PERFIL_LENTO = float(os.getenv("METRICAS_PERFIL_LENTO", "1.0"))
+PERFIL_PASTA = os.getenv("METRICAS_PERFIL_PASTA", os.path.join(METRICAS_PASTA, "perfis"))
+
+HISTOGRAMAS = {
+    'loja_http_request_duration_seconds': ("Tempo de resposta por rota", ('rota', 'metodo')),
+    'loja_db_duration_seconds': ("Tempo das funções do database", ('funcao',)),
+    'loja_template_duration_seconds': ("Tempo de renderização Jinja", ('template',)),
+    'loja_api_externa_duration_seconds': ("Tempo das chamadas HTTP externas", ('servico', 'operacao')),
+}
+CONTADORES = {
+    'loja_http_requests_total': ("Requisições por rota e status", ('rota', 'metodo', 'status')),
+    'loja_db_erros_total': ("Exceções nas funções do database", ('funcao',)),
+    'loja_api_externa_erros_total': ("Falhas (exceção) nas chamadas HTTP externas", ('servico', 'operacao')),
+    'loja_perfis_salvos_total': ("Perfis cProfile salvos de requisições lentas", ('rota',)),
+}
+
+_lock = threading.Lock()
+_histogramas = {nome: {} for nome in HISTOGRAMAS}
+_contadores = {nome: {} for nome in CONTADORES}
+_gravacao = {'pid': None, 'ultima': 0.0}
+
+def observar(nome, rotulos, segundos):
+    """Soma uma amostra no histograma nome (rotulos na ordem de HISTOGRAMAS)"""
+    with _lock:
+        serie = _histogramas[nome].get(rotulos)
+        if serie is None:
+            serie = _histogramas[nome][rotulos] = [[0] * len(BUCKETS), 0.0, 0]
+        for i, limite in enumerate(BUCKETS):
+            if segundos <= limite:
+                serie[0][i] += 1
+                break
+        serie[1] += segundos
+        serie[2] += 1
+
+def incrementar(nome, rotulos, valor=1):
+    with _lock:
+        _contadores[nome][rotulos] = _contadores[nome].get(rotulos, 0) + valor
+
+def _instrumentar_funcao(func, nome):
+    @wraps(func)
+    def medido(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            incrementar('loja_db_erros_total', (nome,))
+            raise
+        finally:
+            observar('loja_db_duration_seconds', (nome,), time.perf_counter() - inicio)
+    medido.__medido__ = True
+    return medido
+
+def instrumentar_modulo(modulo):
+    """
+    Troca as funções públicas do módulo (ex.: database) por versões cronometradas.
+    Geradores ficam de fora: o tempo deles é gasto por quem consome.
+    """
+    if not METRICAS_ATIVAS: return
+    for nome, func in list(vars(modulo).items()):
+        if (nome.startswith('_') or not inspect.isfunction(func) or func.__module__ != modulo.__name__
+                or inspect.isgeneratorfunction(func) or getattr(func, '__medido__', False)):
+            continue
+        setattr(modulo, nome, _instrumentar_funcao(func, nome))
+
+@contextmanager
+def medir_api(servico, operacao):
+    """Cronometra uma chamada HTTP externa: with medir_api('melhorenvio', 'cotacao'): ..."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        incrementar('loja_api_externa_erros_total', (servico, operacao))
+        raise
+    finally:
+        observar('loja_api_externa_duration_seconds', (servico, operacao), time.perf_counter() - inicio)
+
+# --- HOOKS DO FLASK ---
+
+def _rota():
+    # A regra (/produto/<id_produto>) e não a URL, para não explodir o número de séries
+    return request.url_rule.rule if request.url_rule else 'sem_rota'
+
+def _iniciar_requisicao():
+    g.metricas_inicio = time.perf_counter()
+    if PERFIL_AMOSTRA and random.random() < PERFIL_AMOSTRA:
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+            g.metricas_perfil = perfil
+        except ValueError:
+            # Já existe um profiler ativo nesta thread
+            pass
+
+def _finalizar_requisicao(status):
+    inicio = g.pop('metricas_inicio', None)
+    if inicio is None: return
+    duracao = time.perf_counter() - inicio
+    rota = _rota()
+    observar('loja_http_request_duration_seconds', (rota, request.method), duracao)
+    incrementar('loja_http_requests_total', (rota, request.method, str(status)))
+
+    perfil = g.pop('metricas_perfil', None)
+    if perfil:
+        perfil.disable()
+        if duracao >= PERFIL_LENTO:
+            _salvar_perfil(perfil, rota, duracao)
+    _gravar_snapshot()
+
+def _salvar_perfil(perfil, rota, duracao):
+    try:
+        os.makedirs(PERFIL_PASTA, exist_ok=True)
+        nome = "".join(c if c.isalnum() else "_" for c in rota).strip("_") or "raiz"
+        caminho = os.path.join(PERFIL_PASTA, f"{int(time.time())}-{os.getpid()}-{nome}-{int(duracao * 1000)}ms.prof")
+        perfil.dump_stats(caminho)
+        incrementar('loja_perfis_salvos_total', (rota,))
+    except OSError as e:
+        print(f"Erro ao salvar perfil: {e}")
+
+def _rastrear_templates(app):
+    from flask import before_render_template, template_rendered
+
+    def antes(sender, template, context, **extra):
+        g.setdefault('metricas_templates', []).append(time.perf_counter())
+
+    def depois(sender, template, context, **extra):
+        inicios = g.get('metricas_templates')
+        if inicios:
+            observar('loja_template_duration_seconds', (template.name or 'string',), time.perf_counter() - inicios.pop())
+
+    before_render_template.connect(antes, app, weak=False)
+    template_rendered.connect(depois, app, weak=False)
+
+def instalar(app):
+    """Registra os hooks de tempo por requisição e de renderização no app"""
+    if not METRICAS_ATIVAS: return
+
+    app.before_request(_iniciar_requisicao)
+
+    @app.after_request
+    def _metricas_depois(response):
+        _finalizar_requisicao(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _metricas_erro(exc):
+        # Exceção não tratada: o after_request não roda
+        if exc is not None:
+            _finalizar_requisicao(500)
+
+    _rastrear_templates(app)
+
+# --- EXPORTAÇÃO (formato texto do Prometheus) ---
+
+def _snapshot():
+    with _lock:
+        return {
+            'histogramas': {n: [[list(r), s[0][:], s[1], s[2]] for r, s in series.items()] for n, series in _histogramas.items()},
+            'contadores': {n: [[list(r), v] for r, v in series.items()] for n, series in _contadores.items()},
+        }
+
+def _gravar_snapshot(forcar=False):
+    agora = time.monotonic()
+    if _gravacao['pid'] == os.getpid() and not forcar and agora - _gravacao['ultima'] < METRICAS_INTERVALO_GRAVACAO:
+        return
+    _gravacao['pid'], _gravacao['ultima'] = os.getpid(), agora
+    try:
+        os.makedirs(METRICAS_PASTA, exist_ok=True)
+        caminho = os.path.join(METRICAS_PASTA, f"worker-{os.getpid()}.json")
+        temporario = caminho + ".tmp"
+        with open(temporario, "w") as f:
+            json.dump(_snapshot(), f)
+        os.replace(temporario, caminho)
+    except OSError as e:
+        print(f"Erro ao gravar métricas: {e}")
+
+def _processo_vivo(caminho):
+    try:
+        pid = int(os.path.basename(caminho)[len("worker-"):-len(".json")])
+        os.kill(pid, 0)
+    except ValueError:
+        return False
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _somar_snapshots():
+    """Junta os arquivos de todos os workers (este processo entra com o estado atual)"""
+    _gravar_snapshot(forcar=True)
+    histogramas = {n: {} for n in HISTOGRAMAS}
+    contadores = {n: {} for n in CONTADORES}
+    for caminho in glob.glob(os.path.join(METRICAS_PASTA, "worker-*.json")):
+        if not _processo_vivo(caminho):
+            # Worker que já morreu (reinício do gunicorn): seus números saem da soma
+            try: os.remove(caminho)
+            except OSError: pass
+            continue
+        try:
+            with open(caminho) as f:
+                dados = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for nome, series in dados.get('histogramas', {}).items():
+            if nome not in histogramas: continue
+            for rotulos, buckets, soma, n in series:
+                atual = histogramas[nome].setdefault(tuple(rotulos), [[0] * len(BUCKETS), 0.0, 0])
+                atual[0] = [a + b for a, b in zip(atual[0], buckets)]
+                atual[1] += soma
+                atual[2] += n
+        for nome, series in dados.get('contadores', {}).items():
+            if nome not in contadores: continue
+            for rotulos, valor in series:
+                contadores[nome][tuple(rotulos)] = contadores[nome].get(tuple(rotulos), 0) + valor
+    return histogramas, contadores
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _serie(nome, nomes_rotulos, rotulos, le=None):
+    pares = [f'{r}="{_escapar(v)}"' for r, v in zip(nomes_rotulos, rotulos)]
+    if le is not None: pares.append(f'le="{le}"')
+    return nome + ("{" + ",".join(pares) + "}" if pares else "")
+
+def exportar_prometheus():
+    """Texto no formato de exposição do Prometheus, somando todos os workers"""
+    histogramas, contadores = _somar_snapshots()
+    linhas = []
+    for nome, (ajuda, nomes_rotulos) in HISTOGRAMAS.items():
+        linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} histogram"]
+        for rotulos, (buckets, soma, n) in sorted(histogramas[nome].items()):
+            acumulado = 0
+            for limite, qtd in zip(BUCKETS, buckets):
+                acumulado += qtd
+                linhas.append(f"{_serie(nome + '_bucket', nomes_rotulos, rotulos, limite)} {acumulado}")
+            linhas.append(f"{_serie(nome + '_bucket', nomes_rotulos, rotulos, '+Inf')} {n}")
+            linhas.append(f"{_serie(nome + '_sum', nomes_rotulos, rotulos)} {soma:.6f}")
+            linhas.append(f"{_serie(nome + '_count', nomes_rotulos, rotulos)} {n}")
+    for nome, (ajuda, nomes_rotulos) in CONTADORES.items():
+        linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} counter"]
+        for rotulos, valor in sorted(contadores[nome].items()):
+            linhas.append(f"{_serie(nome, nomes_rotulos, rotulos)} {valor}")
+    return "\n".join(linhas) + "\n"
@@ -0,0 +1,207 @@
+import os
+import re
+import glob
+import time
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Sem Pillow a loja continua servindo só os originais
+    Image = None
+
+# Larguras (px) geradas para cada foto enviada; o navegador escolhe pelo srcset
+LARGURAS_VARIANTES = (320, 640, 1024)
+FORMATOS_VARIANTES = ('webp', 'jpg')
+QUALIDADE = {'webp': 80, 'jpg': 82}
+EXTENSOES_IMAGEM = {'png', 'jpg', 'jpeg'}
+
+# Limites de tamanho por upload (bytes)
+MAX_BYTES_IMAGEM = 10 * 1024 * 1024
+MAX_BYTES_VIDEO = 100 * 1024 * 1024
+EXTENSOES_VIDEO = {'mp4'}
+TAMANHO_BLOCO = 1024 * 1024
+# Arquivos mais novos que isso nunca são apagados pela limpeza (upload em andamento)
+GC_CARENCIA = 3600
+# Nome de arquivo endereçado por conteúdo: <hash>.<ext> ou a variante <hash>__<largura>w.<ext>
+PADRAO_HASH = re.compile(r"^([0-9a-f]{32})(__\d+w)?\.[a-z0-9]+$")
+
+class ArquivoMuitoGrande(ValueError):
+    pass
+
+# Fotos são processadas fora da requisição do admin
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="midia")
+# (arquivo, formato) -> srcset pronto, quando todas as variantes já existem
+_prontas = {}
+_prontas_lock = threading.Lock()
+
+def larguras_variantes(largura_original):
+    """
+    Larguras das variantes de uma imagem: as de LARGURAS_VARIANTES menores que ela
+    e, se ela não passar da maior, a própria largura (nunca amplia)
+    """
+    larguras = [l for l in LARGURAS_VARIANTES if l < largura_original]
+    if largura_original <= LARGURAS_VARIANTES[-1]:
+        larguras.append(largura_original)
+    return larguras
+
+def _largura_original(caminho):
+    # Só o cabeçalho é lido; fotos giradas pelo EXIF (5 a 8) trocam largura e altura
+    with Image.open(caminho) as imagem:
+        return imagem.height if imagem.getexif().get(0x0112) in (5, 6, 7, 8) else imagem.width
+
+def caminho_variante(caminho, largura, formato):
+    base, _ = os.path.splitext(caminho)
+    return f"{base}__{largura}w.{formato}"
+
+def _salvar(imagem, destino, formato):
+    # Grava em arquivo temporário e troca de uma vez: quem lê nunca vê meio arquivo
+    temporario = f"{destino}.tmp"
+    if formato == 'jpg':
+        if imagem.mode in ('RGBA', 'LA', 'P'):
+            fundo = Image.new('RGB', imagem.size, (255, 255, 255))
+            imagem = imagem.convert('RGBA')
+            fundo.paste(imagem, mask=imagem.split()[-1])
+            imagem = fundo
+        imagem.convert('RGB').save(temporario, 'JPEG', quality=QUALIDADE['jpg'], optimize=True, progressive=True)
+    else:
+        imagem.save(temporario, 'WEBP', quality=QUALIDADE['webp'], method=4)
+    os.replace(temporario, destino)
+
+def gerar_variantes(caminho_arquivo):
+    """Cria as versões redimensionadas (WebP e JPEG) de uma imagem já salva em disco"""
+    if Image is None: return []
+    geradas = []
+    with Image.open(caminho_arquivo) as original:
+        original = ImageOps.exif_transpose(original)
+        for largura in larguras_variantes(original.width):
+            altura = max(1, round(original.height * largura / original.width))
+            reduzida = original.resize((largura, altura), Image.LANCZOS) if largura != original.width else original.copy()
+            for formato in FORMATOS_VARIANTES:
+                destino = caminho_variante(caminho_arquivo, largura, formato)
+                _salvar(reduzida, destino, formato)
+                geradas.append(destino)
+    return geradas
+
+def _gerar_com_log(caminho_arquivo):
+    try:
+        gerar_variantes(caminho_arquivo)
+    except Exception as e:
+        print(f"Erro ao gerar variantes de {caminho_arquivo}: {e}")
+
+def agendar_variantes(caminho_arquivo):
+    """Enfileira a geração das variantes no pool de segundo plano"""
+    extensao = caminho_arquivo.rsplit('.', 1)[-1].lower()
+    if Image is None or extensao not in EXTENSOES_IMAGEM: return None
+    return _executor.submit(_gerar_com_log, caminho_arquivo)
+
+def _arquivo_da_url(url):
+    prefixo = current_app.static_url_path.rstrip('/') + '/'
+    if not url or not url.startswith(prefixo): return None
+    return os.path.join(current_app.static_folder, url[len(prefixo):])
+
+def srcset(url, formato='webp'):
+    """Filtro Jinja: 'url 320w, url 640w, ...' quando as variantes da imagem já existem em disco"""
+    arquivo = _arquivo_da_url(url)
+    if not arquivo: return ''
+    chave = (arquivo, formato)
+    with _prontas_lock:
+        pronto = _prontas.get(chave)
+    if pronto is None:
+        if Image is None or not os.path.exists(arquivo): return ''
+        try:
+            larguras = larguras_variantes(_largura_original(arquivo))
+        except (OSError, ValueError):
+            return ''
+        if not all(os.path.exists(caminho_variante(arquivo, l, formato)) for l in larguras):
+            return ''
+        base_url, _ = os.path.splitext(url)
+        pronto = ", ".join(f"{base_url}__{l}w.{formato} {l}w" for l in larguras)
+        with _prontas_lock:
+            _prontas[chave] = pronto
+    return pronto
+
+def _renovar(caminho):
+    """Data de modificação do arquivo e das variantes vai para agora; levanta FileNotFoundError sem o original"""
+    os.utime(caminho)
+    for variante in glob.glob(f"{glob.escape(os.path.splitext(caminho)[0])}__*w.*"):
+        try:
+            os.utime(variante)
+        except FileNotFoundError:
+            pass
+
+def salvar_upload(arquivo, pasta):
+    """
+    Grava um upload com nome derivado do conteúdo (sha256) lendo em blocos. Uploads
+    idênticos viram o mesmo arquivo; imagens novas têm as variantes agendadas.
+    Retorna o nome do arquivo; levanta ArquivoMuitoGrande acima do limite.
+    """
+    extensao = arquivo.filename.rsplit('.', 1)[-1].lower()
+    limite = MAX_BYTES_VIDEO if extensao in EXTENSOES_VIDEO else MAX_BYTES_IMAGEM
+    os.makedirs(pasta, exist_ok=True)
+    resumo = hashlib.sha256()
+    tamanho = 0
+    descritor, temporario = tempfile.mkstemp(dir=pasta, suffix='.upload')
+    try:
+        with os.fdopen(descritor, 'wb') as destino:
+            while True:
+                bloco = arquivo.stream.read(TAMANHO_BLOCO)
+                if not bloco: break
+                tamanho += len(bloco)
+                if tamanho > limite:
+                    raise ArquivoMuitoGrande(f"{arquivo.filename} passa de {limite // (1024 * 1024)} MB")
+                resumo.update(bloco)
+                destino.write(bloco)
+        nome = f"{resumo.hexdigest()[:32]}.{extensao}"
+        caminho = os.path.join(pasta, nome)
+        try:
+            # Mesmo conteúdo de um arquivo antigo (talvez sem referência até o produto
+            # ser salvo): a data renovada faz a limpeza respeitar a GC_CARENCIA
+            _renovar(caminho)
+            os.remove(temporario)
+        except FileNotFoundError:
+            os.replace(temporario, caminho)
+            agendar_variantes(caminho)
+        return nome
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+def _base_hash(nome):
+    encontrado = PADRAO_HASH.match(nome)
+    return encontrado.group(1) if encontrado else None
+
+def eh_imutavel(nome):
+    """Arquivos endereçados por conteúdo nunca mudam: podem ter cache eterno"""
+    return PADRAO_HASH.match(nome) is not None
+
+def coletar_lixo(pastas, referencias, apagar=True):
+    """
+    Remove das pastas os arquivos que nenhuma referência (caminhos gravados em
+    produtos/configuracoes) usa mais. Variantes seguem o original. Retorna a lista
+    de arquivos removidos (ou que seriam removidos, com apagar=False).
+    """
+    usados = {os.path.basename(r) for r in referencias if r}
+    hashes_usados = {_base_hash(nome) for nome in usados} - {None}
+    limite = time.time() - GC_CARENCIA
+    removidos = []
+    for pasta in pastas:
+        if not os.path.isdir(pasta): continue
+        for nome in os.listdir(pasta):
+            caminho = os.path.join(pasta, nome)
+            if not os.path.isfile(caminho) or os.path.getmtime(caminho) > limite:
+                continue
+            if nome in usados or _base_hash(nome) in hashes_usados:
+                continue
+            # Variantes de arquivos antigos (nome livre) seguem o mesmo original
+            original = re.sub(r"__\d+w\.[a-z0-9]+$", "", nome)
+            if original != nome and any(u.rsplit('.', 1)[0] == original for u in usados):
+                continue
+            removidos.append(caminho)
+            if apagar:
+                os.remove(caminho)
+    return removidos
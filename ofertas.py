@@ -0,0 +1,57 @@
+import os
+import datetime
+import threading
+import database
+
+# Maior intervalo entre checagens: pega ofertas novas cadastradas por outro worker
+OFERTAS_INTERVALO_MAX = 60.0
+
+_acordar = threading.Event()
+_agendador = {'thread': None, 'pid': None}
+_agendador_lock = threading.Lock()
+
+def _ler_fim(texto):
+    try:
+        return datetime.datetime.fromisoformat(texto)
+    except (TypeError, ValueError):
+        return None
+
+def oferta_ativa(produto, agora=None):
+    """Oferta ligada e ainda dentro do prazo (vale mesmo antes do agendador rodar)"""
+    if not produto.get('em_oferta'): return False
+    fim = produto.get('oferta_fim')
+    if not fim: return True
+    agora = agora or datetime.datetime.now().strftime(database.FORMATO_OFERTA)
+    return fim > agora
+
+def segundos_ate_proxima_expiracao():
+    fim = _ler_fim(database.proximo_fim_oferta())
+    if fim is None: return OFERTAS_INTERVALO_MAX
+    restante = (fim - datetime.datetime.now()).total_seconds()
+    return min(max(restante, 0.5), OFERTAS_INTERVALO_MAX)
+
+def _loop_agendador():
+    while True:
+        try:
+            if database.expirar_ofertas():
+                print("⏰ Ofertas vencidas desligadas")
+            espera = segundos_ate_proxima_expiracao()
+        except Exception as e:
+            print(f"Erro no agendador de ofertas: {e}")
+            espera = OFERTAS_INTERVALO_MAX
+        _acordar.wait(espera)
+        _acordar.clear()
+
+def iniciar_agendador():
+    """Sobe a thread que desliga as ofertas no horário de oferta_fim (uma por processo)"""
+    with _agendador_lock:
+        thread = _agendador['thread']
+        if thread and thread.is_alive() and _agendador['pid'] == os.getpid():
+            return
+        thread = threading.Thread(target=_loop_agendador, name="agendador-ofertas", daemon=True)
+        thread.start()
+        _agendador['thread'], _agendador['pid'] = thread, os.getpid()
+
+def reagendar():
+    """Chamar depois de salvar um produto: a próxima expiração pode ter mudado"""
+    _acordar.set()
@@ -0,0 +1,77 @@
+import io
+import csv
+import datetime
+import database
+
+# Período padrão dos relatórios quando não vem data na URL
+DIAS_PADRAO = 30
+# Relatório por hora cobre no máximo este intervalo (evita respostas gigantes)
+MAX_DIAS_POR_HORA = 31
+
+def intervalo(inicio=None, fim=None):
+    """
+    Converte as datas 'AAAA-MM-DD' (fim inclusivo) em (inicio, fim_exclusivo).
+    Sem datas: os últimos DIAS_PADRAO dias até hoje. Levanta ValueError se inválidas.
+    """
+    hoje = datetime.date.today()
+    data_fim = datetime.date.fromisoformat(fim) if fim else hoje
+    data_inicio = datetime.date.fromisoformat(inicio) if inicio else data_fim - datetime.timedelta(days=DIAS_PADRAO - 1)
+    if data_inicio > data_fim:
+        raise ValueError("início depois do fim")
+    return data_inicio.isoformat(), (data_fim + datetime.timedelta(days=1)).isoformat()
+
+def resumo(inicio=None, fim=None, granularidade='dia', status=None):
+    """Série por período/status e totais do intervalo, só com o resumo pré-calculado"""
+    if granularidade not in database.FORMATOS_PERIODO:
+        raise ValueError(f"granularidade inválida: {granularidade}")
+    de, ate = intervalo(inicio, fim)
+    if granularidade == 'hora' and (datetime.date.fromisoformat(ate) - datetime.date.fromisoformat(de)).days > MAX_DIAS_POR_HORA:
+        raise ValueError(f"relatório por hora limitado a {MAX_DIAS_POR_HORA} dias")
+
+    serie = database.get_resumo_periodos(granularidade, de, ate, status)
+    totais = {}
+    for linha in serie:
+        total = totais.setdefault(linha['status'], {'pedidos': 0, 'faturamento': 0.0})
+        total['pedidos'] += linha['pedidos']
+        total['faturamento'] += linha['faturamento']
+    for total in totais.values():
+        total['faturamento'] = round(total['faturamento'], 2)
+        total['ticket_medio'] = round(total['faturamento'] / total['pedidos'], 2) if total['pedidos'] else 0.0
+    for linha in serie:
+        linha['faturamento'] = round(linha['faturamento'], 2)
+    return {'inicio': de, 'fim': (datetime.date.fromisoformat(ate) - datetime.timedelta(days=1)).isoformat(),
+            'granularidade': granularidade, 'totais': totais, 'serie': serie}
+
+# Texto que a planilha interpretaria como fórmula (nome do cliente "=HYPERLINK(...)")
+INICIO_DE_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+def _celula(valor):
+    """Texto começando como fórmula vai com ' na frente; números saem como estão"""
+    if isinstance(valor, str) and valor.startswith(INICIO_DE_FORMULA):
+        return "'" + valor
+    return valor
+
+def _csv_em_blocos(cabecalho, linhas, linhas_por_bloco=500):
+    """Gera o CSV aos pedaços, para a resposta ser enviada enquanto é lida do banco"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(cabecalho)
+    for numero, linha in enumerate(linhas, start=1):
+        escritor.writerow([_celula(valor) for valor in linha])
+        if numero % linhas_por_bloco == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def csv_resumo(inicio=None, fim=None, granularidade='dia', status=None):
+    dados = resumo(inicio, fim, granularidade, status)
+    return _csv_em_blocos(
+        ['periodo', 'status', 'pedidos', 'faturamento'],
+        ([l['periodo'], l['status'], l['pedidos'], f"{l['faturamento']:.2f}"] for l in dados['serie']))
+
+def csv_vendas(inicio=None, fim=None, status=None):
+    """Uma linha por venda do intervalo, lida do banco em blocos"""
+    de, ate = intervalo(inicio, fim)
+    colunas = ['id', 'data', 'nome_cliente', 'email_cliente', 'produto_nome', 'quantidade', 'valor_total', 'status']
+    return _csv_em_blocos(colunas, ([v[c] for c in colunas] for v in database.iterar_vendas_periodo(de, ate, status)))
@@ -0,0 +1,36 @@
+import os
+import sys
+import tempfile
+
+# Os módulos da loja ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Sem instrumentação e sem pool de processos para os hashes nos testes
+os.environ.setdefault("METRICAS", "0")
+os.environ["AUTH_PROCESSOS"] = "0"
+# O Postgres só é usado pela suíte que pede (tests/test_postgres.py); o resto roda
+# num SQLite temporário
+POSTGRES_URL = os.environ.pop("DATABASE_URL", "")
+# O import do main.py migra o banco padrão; que não seja o loja.db do repositório
+os.environ["LOJA_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="loja-testes-"), "loja.db")
+
+import pytest
+import database
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    """Banco SQLite novo e migrado, só deste teste"""
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "loja.db"))
+    monkeypatch.setattr(database, "DATABASE_URL", "")
+    database.invalidar_cache_config()
+    database.init_db()
+    yield database
+    database._pool.fechar_todas()
+    database.invalidar_cache_config()
+
+@pytest.fixture
+def cliente(banco):
+    """Cliente de teste do Flask sobre o banco do teste"""
+    import main
+    main.app.config['TESTING'] = True
+    with main.app.test_client() as c:
+        yield c
@@ -0,0 +1,16 @@
+from mercadopago.config import Config
+import apimercadopago
+import benchmark
+
+def test_sdk_usa_mp_api_url_sem_alterar_a_config_global(banco, monkeypatch):
+    servidor, url = benchmark.iniciar_apis_falsas(0)
+    monkeypatch.setattr(apimercadopago, "MP_API_URL", url)
+    monkeypatch.setitem(apimercadopago._sdk, 'token', None)
+    banco.update_configuracao('mercado_pago_token', "TEST-token")
+    try:
+        link = apimercadopago.gerar_link_pagamento({'id': 'p1', 'nome': "Caneca"}, 1, 10.0, "chave-1")
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+    assert link.startswith("http://mp.invalid/checkout/")
+    assert Config().api_base_url == apimercadopago.MP_API_URL_PADRAO
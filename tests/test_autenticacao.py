@@ -0,0 +1,36 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import autenticacao
+
+def test_bloqueio_do_admin_ignora_maiusculas(banco):
+    variantes = ["admin", "ADMIN", " Admin", "aDmin ", "Admin"]
+    assert len(variantes) == autenticacao.LIMITE_CONTA[0]
+    for n, usuario in enumerate(variantes):
+        assert autenticacao.login_admin(usuario, "errada", f"10.0.0.{n}") is None
+    with pytest.raises(autenticacao.LoginBloqueado):
+        autenticacao.login_admin("ADMIN", "errada", "10.0.0.99")
+
+def test_conta_inexistente_tambem_confere_um_hash(banco, monkeypatch):
+    conferidos = []
+    monkeypatch.setattr(autenticacao, "_conferir", lambda senha_hash, senha: conferidos.append(senha_hash) or False)
+    assert autenticacao.login_cliente("ninguem@teste.com", "qualquer", "10.0.0.1") is None
+    assert len(conferidos) == 1
+    assert conferidos[0].split("$", 1)[0] == autenticacao.METODO_HASH
+
+def test_vaga_so_volta_quando_o_hash_abandonado_termina(monkeypatch):
+    terminar = threading.Event()
+    pool = ThreadPoolExecutor(1)
+    semaforo = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(autenticacao, "_obter_pool", lambda: pool)
+    monkeypatch.setattr(autenticacao, "AUTH_TIMEOUT", 0.05)
+    monkeypatch.setitem(autenticacao._vagas, "semaforo", semaforo)
+    try:
+        with pytest.raises(autenticacao.AutenticacaoOcupada):
+            autenticacao._executar(terminar.wait)
+        # A espera desistiu, mas o hash continua rodando e segura a vaga
+        assert not semaforo.acquire(blocking=False)
+    finally:
+        terminar.set()
+        pool.shutdown()
+    assert semaforo.acquire(blocking=False)
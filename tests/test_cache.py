@@ -0,0 +1,13 @@
+import cache
+import carrinho
+
+def test_quem_tem_carrinho_nao_recebe_a_pagina_compartilhada(banco, cliente, monkeypatch):
+    monkeypatch.setattr(cache, "_paginas", cache.CacheLRU(8, 60, eventos=("hits", "nao_modificado", "misses")))
+    cliente.get("/sobre")
+    cliente.get("/sobre")
+    cliente.set_cookie(carrinho.COOKIE_CARRINHO, "x" * 32)
+    cliente.get("/sobre")
+    with cliente.session_transaction() as sessao:
+        sessao['admin_logged_in'] = True
+    estatisticas = cliente.get("/admin/cache_paginas").get_json()
+    assert (estatisticas['misses'], estatisticas['hits']) == (1, 1)
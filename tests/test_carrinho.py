@@ -0,0 +1,25 @@
+import carrinho
+
+def _carrinhos_no_banco(banco):
+    conn = banco.create_connection()
+    total = conn.cursor().execute("SELECT COUNT(*) FROM carrinhos").fetchone()[0]
+    conn.close()
+    return total
+
+def test_contador_nao_migra_o_carrinho_antigo_da_sessao(banco, cliente):
+    banco.add_or_update_produto({'id': 'p1', 'nome': 'Caneca', 'preco': 10, 'estoque': 5})
+    with cliente.session_transaction() as sessao:
+        sessao['carrinho'] = {'p1': 2}
+
+    resposta = cliente.get("/")
+    assert resposta.status_code == 200
+    assert b'<span class="cart-badge">1</span>' in resposta.data
+    assert carrinho.COOKIE_CARRINHO not in resposta.headers.get('Set-Cookie', '')
+    assert _carrinhos_no_banco(banco) == 0
+
+    # A página do carrinho faz a migração
+    resposta = cliente.get("/carrinho")
+    assert carrinho.COOKIE_CARRINHO in resposta.headers.get('Set-Cookie', '')
+    assert _carrinhos_no_banco(banco) == 1
+    with cliente.session_transaction() as sessao:
+        assert 'carrinho' not in sessao
@@ -0,0 +1,61 @@
+import pytest
+import apimercadopago
+import benchmark
+import carrinho
+import melhorenvio
+
+@pytest.fixture
+def melhor_envio(banco, monkeypatch):
+    """Melhor Envio falso do benchmark (PAC 24,90 / SEDEX 42,10 / .Package 19,75), sem cache"""
+    servidor, url = benchmark.iniciar_apis_falsas(0)
+    monkeypatch.setattr(melhorenvio, "URL_CALCULO", f"{url}/me/shipment/calculate")
+    monkeypatch.setattr(melhorenvio, "FRETE_CACHE_PERSISTENTE", False)
+    melhorenvio._cache.limpar()
+    banco.update_configuracao('melhor_envio_token', "TOKEN-de-teste-123")
+    banco.update_configuracao('cep_origem', "01001-000")
+    yield
+    servidor.shutdown()
+    servidor.server_close()
+
+@pytest.fixture
+def cobrancas(monkeypatch):
+    """Valores enviados ao Mercado Pago (sem chamar a API)"""
+    valores = []
+    def checkout_idempotente(chave, registrar_venda, produto, valor_total):
+        registrar_venda()
+        valores.append(valor_total)
+        return "http://mp.invalid/checkout/1"
+    monkeypatch.setattr(apimercadopago, "checkout_idempotente", checkout_idempotente)
+    return valores
+
+@pytest.fixture
+def produto(banco):
+    banco.add_or_update_produto({'id': 'p1', 'nome': 'Caneca', 'preco': 100, 'estoque': 5})
+
+def _pagar(cliente, **form):
+    dados = {'nome': 'Ana', 'email': 'ana@teste.com', 'whatsapp': '', 'id_produto': 'p1', 'quantidade': 2,
+             'metodo_pagamento': 'cartao', 'cep': '20040-002'}
+    dados.update(form)
+    return cliente.post("/processar_pagamento", data=dados)
+
+def test_frete_vem_da_cotacao_do_servidor(cliente, melhor_envio, cobrancas, produto):
+    resposta = _pagar(cliente, frete_servico='2', frete_valor='-150')
+    assert resposta.status_code == 302
+    assert cobrancas == [242.10]
+
+def test_servico_de_frete_fora_da_cotacao_e_recusado(cliente, melhor_envio, cobrancas, produto):
+    for servico in ('99', ''):
+        resposta = _pagar(cliente, frete_servico=servico, frete_valor='0')
+        assert resposta.status_code == 302
+    assert cobrancas == []
+
+@pytest.mark.parametrize("frete", [-150, float('nan'), float('inf')])
+def test_total_a_pagar_recusa_frete_invalido(frete):
+    resumo = {'subtotal': 200.0, 'total_pix': 200.0}
+    with pytest.raises(ValueError):
+        carrinho.total_a_pagar(resumo, 'pix', frete)
+
+def test_total_a_pagar_soma_o_frete_ao_valor_do_metodo():
+    resumo = {'subtotal': 200.0, 'total_pix': 190.0}
+    assert carrinho.total_a_pagar(resumo, 'pix', 15.5) == 205.5
+    assert carrinho.total_a_pagar(resumo, 'cartao', '15.5') == 215.5
@@ -0,0 +1,30 @@
+from concurrent.futures import ProcessPoolExecutor
+import database
+import estoque
+
+def _apontar_banco(caminho):
+    # Roda em cada processo comprador: mesmo SQLite do teste, conexões próprias
+    database.DB_PATH = caminho
+    database.DATABASE_URL = ""
+
+def _comprar(numero):
+    try:
+        return estoque.registrar_venda_reservando(f"Comprador {numero}", f"c{numero}@teste.com", "", "disputado",
+                                                  1, 10.0, [("disputado", "Produto disputado", 1, 10.0)])
+    except estoque.EstoqueInsuficiente:
+        return None
+
+def test_compras_simultaneas_nao_vendem_alem_do_estoque(banco):
+    compradores, estoque_inicial = 80, 10
+    banco.add_or_update_produto({'id': 'disputado', 'nome': 'Produto disputado', 'preco': 10, 'estoque': estoque_inicial})
+
+    with ProcessPoolExecutor(8, initializer=_apontar_banco, initargs=(banco.DB_PATH,)) as pool:
+        vendas = [v for v in pool.map(_comprar, range(compradores)) if v]
+    produto = banco.get_produto_por_id('disputado')
+    assert len(vendas) == estoque_inicial
+    assert (produto['estoque'], produto['estoque_reservado']) == (estoque_inicial, estoque_inicial)
+
+    for id_venda in vendas:
+        banco.atualizar_status_venda(id_venda, 'pago')
+    produto = banco.get_produto_por_id('disputado')
+    assert (produto['estoque'], produto['estoque_reservado']) == (0, 0)
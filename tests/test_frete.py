@@ -0,0 +1,34 @@
+import time
+import pytest
+import benchmark
+import melhorenvio
+
+LATENCIA = 0.3
+
+@pytest.fixture
+def melhor_envio_lento(monkeypatch):
+    """Melhor Envio falso que demora LATENCIA s por resposta, sem cache"""
+    servidor, url = benchmark.iniciar_apis_falsas(LATENCIA)
+    monkeypatch.setattr(melhorenvio, "URL_CALCULO", f"{url}/me/shipment/calculate")
+    monkeypatch.setattr(melhorenvio, "FRETE_CACHE_PERSISTENTE", False)
+    melhorenvio._cache.limpar()
+    yield
+    servidor.shutdown()
+    servidor.server_close()
+
+def test_pacotes_do_carrinho_sao_cotados_em_paralelo(melhor_envio_lento):
+    # Cada produto pesa quase o limite: um pacote por produto, e pesos diferentes
+    # para não cair na mesma chave do cache
+    pacotes = 6
+    itens = [({'peso_kg': melhorenvio.PACOTE_MAX_PESO - 1 - i / 10, 'comprimento_cm': 40, 'largura_cm': 30, 'altura_cm': 20}, 1, 100.0)
+             for i in range(pacotes)]
+    assert len(melhorenvio.montar_pacotes(itens)) == pacotes
+
+    inicio = time.perf_counter()
+    opcoes = melhorenvio.cotar_carrinho("01001000", itens, "TOKEN-de-teste-123", "20040002")
+    duracao = time.perf_counter() - inicio
+
+    assert opcoes and all(o['pacotes'] == pacotes for o in opcoes)
+    assert opcoes == sorted(opcoes, key=lambda o: o['preco'])
+    assert [o['preco'] for o in opcoes] == [round(19.75 * pacotes, 2), round(24.90 * pacotes, 2), round(42.10 * pacotes, 2)]
+    assert duracao < LATENCIA * pacotes / 2
@@ -0,0 +1,40 @@
+import io
+import importacao
+
+def _jsonl(*linhas):
+    return importacao.ler_jsonl(io.StringIO("\n".join(linhas) + "\n"))
+
+def test_linhas_sem_id_ganham_ids_distintos(banco):
+    linhas = [(n, {'nome': f"Produto {n}", 'preco': 10, 'estoque': 1}) for n in range(1, 6)]
+    assert importacao.importar(linhas) == (5, [])
+    produtos = list(banco.iterar_produtos())
+    assert len({p['id'] for p in produtos}) == 5
+    assert len(banco.buscar_produtos("Produto")) == 5
+
+def test_produtos_sem_id_saem_do_mais_novo_para_o_mais_antigo_entre_paginas(banco):
+    primeiro = banco.add_or_update_produto({'nome': "Primeiro", 'preco': 10})
+    segundo = banco.add_or_update_produto({'nome': "Segundo", 'preco': 10})
+    pagina, cursor = banco.get_produtos_pagina(limite=1)
+    assert [p['id'] for p in pagina] == [segundo]
+    pagina, cursor = banco.get_produtos_pagina(limite=1, cursor=cursor)
+    assert ([p['id'] for p in pagina], cursor) == ([primeiro], None)
+
+def test_id_repetido_no_lote_fica_com_a_ultima_linha(banco):
+    linhas = [(1, {'id': 'x1', 'nome': "Caneca azul", 'preco': 10}),
+              (2, {'id': 'x2', 'nome': "Prato", 'preco': 20}),
+              (3, {'id': 'x1', 'nome': "Caneca verde", 'preco': 12})]
+    total, rejeitados = importacao.importar(linhas)
+    assert (total, rejeitados) == (2, [])
+    assert banco.get_produto_por_id('x1')['nome'] == "Caneca verde"
+    assert [p['id'] for p in banco.buscar_produtos("caneca")] == ['x1']
+
+def test_linhas_com_tipos_errados_sao_rejeitadas(banco):
+    linhas = _jsonl('{"nome": "Caneca", "preco": 10, "estoque": [1]}',
+                    '{"nome": "Prato", "preco": 10, "novo_preco": {"valor": 1}}',
+                    '[1, 2]',
+                    '"texto"',
+                    '{"nome": "Copo", "preco": 5}')
+    total, rejeitados = importacao.importar(linhas)
+    assert total == 1
+    assert [numero for numero, _, _ in rejeitados] == [1, 2, 3, 4]
+    assert rejeitados[0][1] == "estoque inválido: [1]"
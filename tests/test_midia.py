@@ -0,0 +1,42 @@
+import io
+import os
+import time
+import pytest
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+import midia
+
+def _upload(conteudo, nome="foto.mp4"):
+    return FileStorage(stream=io.BytesIO(conteudo), filename=nome)
+
+def test_upload_repetido_renova_a_carencia_da_limpeza(tmp_path):
+    nome = midia.salvar_upload(_upload(b"video"), str(tmp_path))
+    caminho = tmp_path / nome
+    antigo = time.time() - 2 * midia.GC_CARENCIA
+    os.utime(caminho, (antigo, antigo))
+    assert midia.coletar_lixo([str(tmp_path)], [], apagar=False) == [str(caminho)]
+
+    assert midia.salvar_upload(_upload(b"video"), str(tmp_path)) == nome
+    assert midia.coletar_lixo([str(tmp_path)], []) == []
+    assert os.listdir(tmp_path) == [nome]
+
+def test_variantes_nunca_ampliam_e_o_srcset_anuncia_a_largura_real(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    app = Flask(__name__, static_folder=str(tmp_path), static_url_path="/static")
+    (tmp_path / "uploads").mkdir()
+    caminho = tmp_path / "uploads" / "foto.jpg"
+    Image.new("RGB", (700, 350), "red").save(caminho)
+
+    geradas = midia.gerar_variantes(str(caminho))
+    assert sorted(os.path.basename(g) for g in geradas) == [
+        "foto__320w.jpg", "foto__320w.webp", "foto__640w.jpg", "foto__640w.webp", "foto__700w.jpg", "foto__700w.webp"]
+    with Image.open(tmp_path / "uploads" / "foto__700w.webp") as variante:
+        assert variante.size == (700, 350)
+    with app.app_context():
+        assert midia.srcset("/static/uploads/foto.jpg") == (
+            "/static/uploads/foto__320w.webp 320w, /static/uploads/foto__640w.webp 640w, /static/uploads/foto__700w.webp 700w")
+
+def test_larguras_variantes():
+    assert midia.larguras_variantes(2000) == [320, 640, 1024]
+    assert midia.larguras_variantes(1024) == [320, 640, 1024]
+    assert midia.larguras_variantes(200) == [200]
@@ -0,0 +1,146 @@
+import sqlite3
+import threading
+import pytest
+from conftest import POSTGRES_URL
+
+pytestmark = pytest.mark.skipif(not POSTGRES_URL, reason="DATABASE_URL não definido (Postgres de teste)")
+psycopg2 = pytest.importorskip("psycopg2")
+import banco_postgres
+import database
+import estoque
+
+def _esvaziar_esquema():
+    conn = psycopg2.connect(POSTGRES_URL)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("DROP SCHEMA public CASCADE")
+        cur.execute("CREATE SCHEMA public")
+    conn.close()
+
+@pytest.fixture
+def banco_pg(monkeypatch):
+    """Esquema public recriado e migrado no Postgres de POSTGRES_URL"""
+    _esvaziar_esquema()
+    monkeypatch.setattr(database, "DATABASE_URL", POSTGRES_URL)
+    database.invalidar_cache_config()
+    database.init_db()
+    yield database
+    # Os comandos preparados das conexões do pool são do esquema apagado no próximo teste
+    if banco_postgres._pool['pool']:
+        banco_postgres._pool['pool'].closeall()
+    banco_postgres._pool['dsn'] = None
+    database.invalidar_cache_config()
+
+def _colunas_sqlite(caminho):
+    conn = sqlite3.connect(caminho)
+    tabelas = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    # produtos_busca (FTS5) e suas tabelas internas não existem no Postgres: lá a busca é um índice GIN
+    colunas = {t: {r[1] for r in conn.execute(f"PRAGMA table_info({t})")} for t in tabelas if not t.startswith('produtos_busca')}
+    conn.close()
+    return colunas
+
+def test_init_db_aplica_as_migracoes_uma_vez(banco_pg):
+    aplicadas = banco_pg.get_migracoes_aplicadas()
+    assert sorted(aplicadas) == [versao for versao, _, _ in banco_pg.MIGRACOES]
+    banco_pg.init_db()
+    assert banco_pg.get_migracoes_aplicadas() == aplicadas
+    assert banco_pg.get_admin_para_login('utbdenis6752')
+
+def test_esquema_igual_nos_dois_motores(banco_pg, tmp_path, monkeypatch):
+    conn = psycopg2.connect(POSTGRES_URL)
+    with conn.cursor() as cur:
+        postgres = {t: set(c) for t, c in banco_postgres._tabelas_postgres(cur).items()}
+    conn.close()
+
+    caminho = str(tmp_path / "loja.db")
+    monkeypatch.setattr(database, "DB_PATH", caminho)
+    monkeypatch.setattr(database, "DATABASE_URL", "")
+    database.init_db()
+    database._pool.fechar_todas()
+    assert _colunas_sqlite(caminho) == postgres
+
+def test_reservas_simultaneas_nao_vendem_alem_do_estoque(banco_pg):
+    # Cada thread pega sua conexão do pool; a reserva passa pelo advisory lock do produto
+    banco_pg.add_or_update_produto({'id': 'disputado', 'nome': 'Produto disputado', 'preco': 10, 'estoque': 5})
+    vendas, erros = [], []
+    def comprar(numero):
+        try:
+            vendas.append(estoque.registrar_venda_reservando(f"Comprador {numero}", f"c{numero}@teste.com", "", "disputado",
+                                                             1, 10.0, [("disputado", "Produto disputado", 1, 10.0)]))
+        except estoque.EstoqueInsuficiente:
+            pass
+        except Exception as e:
+            erros.append(e)
+    threads = [threading.Thread(target=comprar, args=(n,)) for n in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert erros == []
+    assert len(vendas) == 5 and all(vendas)
+    produto = banco_pg.get_produto_por_id('disputado')
+    assert (produto['estoque'], produto['estoque_reservado']) == (5, 5)
+    banco_pg.atualizar_status_venda(vendas[0], 'pago')
+    banco_pg.atualizar_status_venda(vendas[1], 'cancelado')
+    produto = banco_pg.get_produto_por_id('disputado')
+    assert (produto['estoque'], produto['estoque_reservado']) == (4, 3)
+
+def test_lock_do_estoque_e_por_produto(banco_pg):
+    for id_prod in ('a', 'b'):
+        banco_pg.add_or_update_produto({'id': id_prod, 'nome': f"Produto {id_prod}", 'preco': 10, 'estoque': 5})
+    def reservar(id_prod):
+        thread = threading.Thread(target=banco_pg.registrar_venda_com_reserva,
+                                  args=("Ana", "ana@teste.com", "", id_prod, 1, 10.0, [(id_prod, id_prod, 1, 10.0)], 1800))
+        thread.start()
+        return thread
+    # Outra transação segura o estoque de 'a' (como uma reserva em andamento)
+    conn = psycopg2.connect(POSTGRES_URL)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('estoque:a'))")
+        reserva_a, reserva_b = reservar('a'), reservar('b')
+        reserva_b.join(5)
+        assert not reserva_b.is_alive()
+        reserva_a.join(0.3)
+        assert reserva_a.is_alive()
+    finally:
+        conn.rollback()
+        conn.close()
+    reserva_a.join(5)
+    assert [banco_pg.get_produto_por_id(i)['estoque_reservado'] for i in ('a', 'b')] == [1, 1]
+
+def test_webhook_vai_para_um_worker_so(banco_pg):
+    banco_pg.enfileirar_webhook("1-abc")
+    pegos = []
+    threads = [threading.Thread(target=lambda: pegos.append(banco_pg.pegar_proximo_webhook(60))) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert [item['payment_id'] for item in pegos if item] == ["1-abc"]
+
+def test_copiar_do_sqlite(banco, tmp_path, monkeypatch):
+    banco.add_or_update_produto({'id': 'p1', 'nome': 'Caneca', 'preco': 10, 'estoque': 5})
+    venda_id, _ = banco.registrar_venda_com_reserva("Ana", "ana@teste.com", "", "Caneca", 2, 20.0,
+                                                    [("p1", "Caneca", 2, 10.0)], 1800)
+    banco.update_configuracao('cep_origem', "01001-000")
+    banco._pool.fechar_todas()
+    caminho = banco.DB_PATH
+
+    _esvaziar_esquema()
+    monkeypatch.setattr(database, "DATABASE_URL", POSTGRES_URL)
+    database.invalidar_cache_config()
+    try:
+        database.init_db()
+        copiadas = banco_postgres.copiar_do_sqlite(POSTGRES_URL, caminho)
+        assert copiadas['produtos'] == 1 and copiadas['vendas'] == 1 and copiadas['itens_venda'] == 1
+        assert database.get_produto_por_id('p1')['estoque_reservado'] == 2
+        assert database.get_configuracoes()['cep_origem'] == "01001-000"
+        # A sequência dos ids continua depois dos copiados
+        novo_id, _ = database.registrar_venda_com_reserva("Bia", "bia@teste.com", "", "Caneca", 1, 10.0,
+                                                          [("p1", "Caneca", 1, 10.0)], 1800)
+        assert novo_id > venda_id
+        # Sem substituir, uma segunda cópia é recusada
+        with pytest.raises(ValueError):
+            banco_postgres.copiar_do_sqlite(POSTGRES_URL, caminho)
+    finally:
+        if banco_postgres._pool['pool']:
+            banco_postgres._pool['pool'].closeall()
+        banco_postgres._pool['dsn'] = None
@@ -0,0 +1,13 @@
+import csv
+import io
+import relatorios
+
+def test_csv_de_vendas_nao_exporta_formulas(banco):
+    banco.add_or_update_produto({'id': 'p1', 'nome': 'Caneca', 'preco': 10, 'estoque': 5})
+    for nome in ('=HYPERLINK("http://x.invalid","clique")', '@SUM(A1)', 'Ana'):
+        banco.registrar_venda_com_reserva(nome, "ana@teste.com", "", "-caneca", 1, 10.0,
+                                          [("p1", "Caneca", 1, 10.0)], 1800)
+    linhas = list(csv.DictReader(io.StringIO("".join(relatorios.csv_vendas()))))
+    assert [l['nome_cliente'] for l in linhas] == ["'=HYPERLINK(\"http://x.invalid\",\"clique\")", "'@SUM(A1)", "Ana"]
+    assert {l['produto_nome'] for l in linhas} == {"'-caneca"}
+    assert {l['valor_total'] for l in linhas} == {"10.0"}
@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+from banco_postgres import traduzir
+
+def test_insert_or_replace_vira_upsert_pela_chave_da_tabela():
+    numerado, n, formatado = traduzir("INSERT OR REPLACE INTO configuracoes (chave, valor) VALUES (?, ?)")
+    assert numerado == "INSERT INTO configuracoes (chave, valor) VALUES ($1, $2) ON CONFLICT (chave) DO UPDATE SET valor = EXCLUDED.valor"
+    assert n == 2
+    assert formatado == "INSERT INTO configuracoes (chave, valor) VALUES (%s, %s) ON CONFLICT (chave) DO UPDATE SET valor = EXCLUDED.valor"
+
+def test_insert_or_replace_usa_a_primeira_coluna_como_chave_padrao():
+    numerado, _, _ = traduzir("INSERT OR REPLACE INTO produtos (id, nome) VALUES (?, ?)")
+    assert numerado.endswith("ON CONFLICT (id) DO UPDATE SET nome = EXCLUDED.nome")
+
+def test_insert_or_ignore_vira_on_conflict_do_nothing():
+    numerado, n, _ = traduzir("INSERT OR IGNORE INTO versoes (nome, versao) VALUES (?, 0)")
+    assert numerado == "INSERT INTO versoes (nome, versao) VALUES ($1, 0) ON CONFLICT DO NOTHING"
+    assert n == 1
+
+def test_min_max_escalares_viram_least_greatest_e_agregados_ficam():
+    numerado, _, _ = traduzir("UPDATE produtos SET estoque_reservado = MAX(estoque_reservado - ?, 0) WHERE id = ?")
+    assert numerado == "UPDATE produtos SET estoque_reservado = GREATEST(estoque_reservado - $1, 0) WHERE id = $2"
+    numerado, _, _ = traduzir("SELECT MAX(id), MIN(MAX(a, b)), MIN(preco) FROM vendas")
+    assert numerado == "SELECT MAX(id), MIN(GREATEST(a, b)), MIN(preco) FROM vendas"
+
+def test_interrogacao_dentro_de_texto_nao_e_parametro_e_porcentagem_e_escapada():
+    numerado, n, formatado = traduzir("SELECT * FROM vendas WHERE status = 'pago?' AND nome LIKE '%' || ? || '%'")
+    assert n == 1
+    assert numerado == "SELECT * FROM vendas WHERE status = 'pago?' AND nome LIKE '%' || $1 || '%'"
+    assert formatado == "SELECT * FROM vendas WHERE status = 'pago?' AND nome LIKE '%%' || %s || '%%'"
+
+def test_insert_em_tabela_com_id_devolve_o_id():
+    assert traduzir("INSERT INTO vendas (nome_cliente) VALUES (?)")[0] == "INSERT INTO vendas (nome_cliente) VALUES ($1) RETURNING id"
+    assert traduzir("INSERT INTO produtos (id) VALUES (?)")[0] == "INSERT INTO produtos (id) VALUES ($1)"
+    assert traduzir("INSERT INTO vendas (nome_cliente) VALUES (?) RETURNING id")[0].count("RETURNING") == 1
+
+def test_collate_nocase_e_begin():
+    assert traduzir("SELECT * FROM users WHERE username = ? COLLATE NOCASE")[0] == "SELECT * FROM users WHERE lower(username) = lower($1)"
+    assert traduzir("BEGIN IMMEDIATE") == ("BEGIN", 0, "BEGIN")
+    assert traduzir("BEGIN")[0] == "BEGIN ISOLATION LEVEL REPEATABLE READ"
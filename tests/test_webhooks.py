@@ -0,0 +1,68 @@
+import pytest
+import apimercadopago
+import webhooks
+
+@pytest.fixture
+def mercado_pago(banco, monkeypatch):
+    """Mercado Pago falso; devolve o dicionário de status dos pagamentos (padrão 'approved')"""
+    pagamentos = {}
+    # O id do pagamento nos testes é "<id_venda>-<aleatório>"
+    monkeypatch.setattr(apimercadopago, "consultar_status_mp",
+                        lambda pid: (pagamentos.get(pid, "approved"), pid.split("-")[0]))
+    return pagamentos
+
+def _venda(banco):
+    return banco.registrar_venda("Ana", "ana@teste.com", "", "Caneca", 1, 10.0)
+
+def _status_da_venda(banco):
+    return banco.get_vendas_pagina()[0][0]['status']
+
+def test_aprovacao_que_chega_durante_o_processamento_nao_se_perde(banco, mercado_pago, monkeypatch):
+    payment_id = f"{_venda(banco)}-abc"
+    mercado_pago[payment_id] = "pending"
+    assert banco.enfileirar_webhook(payment_id)
+
+    consultar = apimercadopago.consultar_status_mp
+    def consultar_e_aprovar(pid):
+        # O worker leu 'pending'; antes de gravar o resultado o pagamento é
+        # aprovado e a notificação nova chega
+        resposta = consultar(pid)
+        mercado_pago[pid] = "approved"
+        assert banco.enfileirar_webhook(pid)
+        return resposta
+    monkeypatch.setattr(apimercadopago, "consultar_status_mp", consultar_e_aprovar)
+
+    assert webhooks.processar_pendentes(limite=1) == 1
+    assert _status_da_venda(banco) == 'pendente'
+    assert banco.get_fila_webhooks_resumo() == {'pendente': 1}
+
+    monkeypatch.setattr(apimercadopago, "consultar_status_mp", consultar)
+    assert webhooks.processar_pendentes() == 1
+    assert _status_da_venda(banco) == 'pago'
+    assert banco.get_fila_webhooks_resumo() == {'concluido': 1}
+
+def test_repeticao_de_pagamento_aprovado_e_descartada(banco, mercado_pago):
+    payment_id = f"{_venda(banco)}-xyz"
+    assert banco.enfileirar_webhook(payment_id)
+    webhooks.processar_pendentes()
+    assert not banco.enfileirar_webhook(payment_id)
+    assert banco.get_fila_webhooks_resumo() == {'concluido': 1}
+
+def test_pagamento_pendente_volta_para_a_fila_na_notificacao_seguinte(banco, mercado_pago):
+    payment_id = f"{_venda(banco)}-def"
+    mercado_pago[payment_id] = "pending"
+    banco.enfileirar_webhook(payment_id)
+    webhooks.processar_pendentes()
+    assert _status_da_venda(banco) == 'pendente'
+
+    mercado_pago[payment_id] = "approved"
+    assert banco.enfileirar_webhook(payment_id)
+    webhooks.processar_pendentes()
+    assert _status_da_venda(banco) == 'pago'
+
+def test_retorno_sem_payment_id_nao_altera_a_venda(banco, cliente):
+    venda_id = _venda(banco)
+    resposta = cliente.get(f"/webhook/mercadopago?external_reference={venda_id}&status=approved")
+    assert resposta.status_code == 302
+    assert _status_da_venda(banco) == 'pendente'
+    assert banco.get_fila_webhooks_resumo() == {}
@@ -0,0 +1,90 @@
+import os
+import time
+import threading
+import database
+import apimercadopago
+
+# Tentativas de verificar um pagamento antes de desistir
+WEBHOOK_MAX_TENTATIVAS = 6
+# Espera entre tentativas: BASE * 2^n segundos, limitada a MAX
+WEBHOOK_BACKOFF_BASE = 5
+WEBHOOK_BACKOFF_MAX = 600
+# Por quanto tempo um item fica reservado para o worker que o pegou
+WEBHOOK_TEMPO_BLOQUEIO = 120
+# Intervalo de varredura da fila quando ninguém avisa que chegou notificação
+WEBHOOK_INTERVALO = 5.0
+
+_acordar = threading.Event()
+_worker = {'thread': None, 'pid': None}
+_worker_lock = threading.Lock()
+
+def _espera_backoff(tentativas):
+    return min(WEBHOOK_BACKOFF_BASE * (2 ** (tentativas - 1)), WEBHOOK_BACKOFF_MAX)
+
+def processar_item(item):
+    """Confere o pagamento no Mercado Pago e aplica o status na venda"""
+    tentativas = item['tentativas'] + 1
+    status, id_venda = apimercadopago.consultar_status_mp(item['payment_id'])
+
+    if not status:
+        if tentativas >= WEBHOOK_MAX_TENTATIVAS:
+            database.finalizar_webhook(item['id'], 'falhou', erro="Pagamento não confirmado na API", tentativas=tentativas)
+            print(f"❌ Webhook {item['payment_id']} descartado após {tentativas} tentativas")
+        else:
+            database.finalizar_webhook(item['id'], 'pendente', erro="Falha ao consultar a API", tentativas=tentativas,
+                                       proxima_tentativa=time.time() + _espera_backoff(tentativas))
+        return False
+
+    if id_venda and status == 'approved':
+        database.atualizar_status_venda(id_venda, 'pago')
+        print(f"✅ Venda {id_venda} aprovada!")
+    database.finalizar_webhook(item['id'], 'concluido', status_mp=status, id_venda=id_venda, tentativas=tentativas)
+    return True
+
+def processar_pendentes(limite=None):
+    """Processa os itens vencidos da fila até ela esvaziar (ou até limite itens)"""
+    processados = 0
+    while limite is None or processados < limite:
+        item = database.pegar_proximo_webhook(WEBHOOK_TEMPO_BLOQUEIO)
+        if not item:
+            break
+        try:
+            processar_item(item)
+        except Exception as e:
+            print(f"Erro ao processar webhook {item['payment_id']}: {e}")
+            database.finalizar_webhook(item['id'], 'pendente', erro=str(e), tentativas=item['tentativas'] + 1,
+                                       proxima_tentativa=time.time() + _espera_backoff(item['tentativas'] + 1))
+        processados += 1
+    return processados
+
+def _loop_worker():
+    espera = 0
+    while True:
+        _acordar.wait(espera)
+        _acordar.clear()
+        try:
+            processar_pendentes()
+            # Dorme até a próxima retentativa vencer (ou até chegar notificação nova)
+            proximo = database.proximo_webhook_em()
+            espera = WEBHOOK_INTERVALO if proximo is None else min(max(proximo - time.time(), 0.05), WEBHOOK_INTERVALO)
+        except Exception as e:
+            print(f"Erro no worker de webhooks: {e}")
+            espera = WEBHOOK_INTERVALO
+
+def iniciar_worker():
+    """Sobe a thread de processamento deste processo (uma por worker do gunicorn)"""
+    with _worker_lock:
+        thread = _worker['thread']
+        if thread and thread.is_alive() and _worker['pid'] == os.getpid():
+            return
+        thread = threading.Thread(target=_loop_worker, name="fila-webhooks", daemon=True)
+        thread.start()
+        _worker['thread'], _worker['pid'] = thread, os.getpid()
+
+def receber_notificacao(payment_id):
+    """Grava a notificação na fila e acorda o worker; não chama a API do Mercado Pago"""
+    enfileirado = database.enfileirar_webhook(payment_id)
+    if enfileirado:
+        iniciar_worker()
+        _acordar.set()
+    return enfileirado